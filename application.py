@@ -1,17 +1,51 @@
 ''' Main Flask Web API application file '''
-from flask import Flask, request
+import numpy as np
+from flask import Flask, Response, request
 from flask_cors import CORS
 from flask_restx import Api, Resource, fields, abort
-from config import DevConfig
-from compare_texts import compare_mix_texts
-from docu_functions import simplify_response
+from config import get_config
+from compare_texts import (
+    compare_mix_texts, compare_batch_texts, add_author_texts, compare_author_texts,
+    identify_author, author_store, models)
+from author_index import SEARCH_METHODS
+from docu_functions import simplify_response, StoredFile
+from jobs import JOB_STATES, JobRunner, create_job_store
+from request_profiler import is_profile_token, profile_call
+from metrics import metrics, span, start_request_spans, server_timing
 
 # Create the Flask app
 app = Flask(__name__)
 CORS(app)
-app.config.from_object(DevConfig)
+app.config.from_object(get_config())
 api = Api(app, doc='/docs')  # Setup API documentation
 
+# load the models without blocking the app from serving
+if app.config['WARM_UP_ON_START']:
+    models.start_warm_up()
+
+# runs comparisons posted as jobs in the background
+job_runner = JobRunner(
+    create_job_store(app.config['JOB_DB'] or None, app.config['JOB_TTL']),
+    app.config['JOB_WORKERS'])
+
+
+@app.before_request
+def collect_spans():
+    '''Collects the timing spans of the request when Server-Timing headers are on'''
+    if app.config['SERVER_TIMING']:
+        start_request_spans()
+
+
+@app.after_request
+def add_server_timing(response):
+    '''Reports the timing spans of the request in its Server-Timing header'''
+    if app.config['SERVER_TIMING']:
+        timing = server_timing()
+        if timing:
+            response.headers['Server-Timing'] = timing
+    return response
+
+
 # Create the API models
 compare_model = api.parser()
 compare_model.add_argument(
@@ -27,6 +61,66 @@ compare_model.add_argument(
     'unknown_file', type='file', required=False,
     help='Unknown file to compare against')
 
+profiled_compare_model = compare_model.copy()
+profiled_compare_model.add_argument(
+    'X-Profile-Token', location='headers', required=False,
+    help='Admin token to profile the request, naming the stored profile in the X-Profile header')
+
+author_model = api.parser()
+author_model.add_argument(
+    'name', type=str, required=False,
+    help='Name of the author to register')
+
+author_texts_model = api.parser()
+author_texts_model.add_argument(
+    'known_texts', type=str, action='append', required=False,
+    help='List of known texts written by the author')
+author_texts_model.add_argument(
+    'known_files', type='file', action='append', required=False,
+    help='List of known files written by the author')
+
+author_compare_model = api.parser()
+author_compare_model.add_argument(
+    'unknown_text', type=str, required=False,
+    help='Unknown text to compare against the author')
+author_compare_model.add_argument(
+    'unknown_file', type='file', required=False,
+    help='Unknown file to compare against the author')
+
+identify_model = author_compare_model.copy()
+identify_model.add_argument(
+    'top_k', type=int, default=5, required=False,
+    help='Number of likeliest authors to return')
+identify_model.add_argument(
+    'method', type=str, choices=SEARCH_METHODS, required=False,
+    help='Shortlist the closest authors exactly or with the IVF index (the default is set '
+    'by AUTHOR_SEARCH)')
+
+profile_model = api.model('Profile', {
+    'author_id': fields.String(
+        required=True,
+        description='ID of the author'),
+    'name': fields.String(
+        description='Name of the author'),
+    'document_count': fields.Integer(
+        required=True,
+        description='Number of known documents in the author profile'),
+    'added': fields.Integer(
+        description='Number of new documents added by the request')
+})
+
+duplicate_model = api.model('Duplicate', {
+    'input': fields.String(
+        required=True,
+        description='Known text or file which was dropped, such as known_files[1]'),
+    'duplicate_of': fields.String(
+        required=True,
+        description='Earlier known text or file it duplicates, which was kept'),
+    'similarity': fields.Float(
+        required=True,
+        description='Estimated share of word shingles the two have in common')
+})
+
 score_model = api.model('Score', {
     'w_sim': fields.List(fields.Float(
         required=True,
@@ -51,17 +145,153 @@ score_model = api.model('Score', {
         description='Total number of words used'),
     'score': fields.Integer(
         required=True,
-        description='Overall authorship score out of 100')
+        description='Overall authorship score out of 100'),
+    'duplicates': fields.List(
+        fields.Nested(duplicate_model),
+        description='Known texts & files left out as near duplicates of an earlier one')
+})
+
+author_set_model = api.model('AuthorSet', {
+    'name': fields.String(
+        description='Name of the author used to label their scores'),
+    'known_texts': fields.List(
+        fields.String, required=True,
+        description='List of known texts written by the author')
+})
+
+batch_model = api.model('BatchCompare', {
+    'authors': fields.List(
+        fields.Nested(author_set_model),
+        description='Authors given by their known texts'),
+    'author_ids': fields.List(
+        fields.String,
+        description='IDs of registered authors to compare against'),
+    'unknown_texts': fields.List(
+        fields.String, required=True,
+        description='Unknown texts to compare against every author'),
+    'pairs': fields.Boolean(
+        default=False,
+        description='Only compare each unknown text to the author at the same position')
+})
+
+ranked_score_model = api.model('RankedScore', {
+    'unknown': fields.Integer(
+        required=True,
+        description='Position of the unknown text'),
+    'author': fields.Integer(
+        required=True,
+        description='Position of the author, authors coming before author_ids'),
+    'score': fields.Integer(
+        required=True,
+        description='Authorship score out of 100')
+})
+
+batch_score_model = api.model('BatchScore', {
+    'authors': fields.List(
+        fields.String,
+        description='Label of every author, authors coming before author_ids'),
+    'scores': fields.List(
+        fields.List(fields.Integer),
+        description='Scores out of 100 with a row per unknown text and a column per author '
+        '(a single column when comparing pairs)'),
+    'ranking': fields.List(
+        fields.Nested(ranked_score_model),
+        description='Every score from highest to lowest')
+})
+
+identified_author_model = api.model('IdentifiedAuthor', {
+    'author_id': fields.String(
+        required=True,
+        description='ID of the author'),
+    'name': fields.String(
+        description='Name of the author'),
+    'score': fields.Integer(
+        required=True,
+        description='Authorship score out of 100')
+})
+
+identification_model = api.model('Identification', {
+    'authors': fields.List(
+        fields.Nested(identified_author_model),
+        description='Likeliest authors from highest to lowest score'),
+    'candidates': fields.Integer(
+        description='Authors shortlisted by the author index and scored'),
+    'indexed': fields.Integer(
+        description='Registered authors with known texts')
+})
+
+job_model = api.model('Job', {
+    'job_id': fields.String(
+        required=True,
+        description='ID of the job'),
+    'status': fields.String(
+        required=True, enum=JOB_STATES,
+        description='Job status: queued, running, done or failed'),
+    'code': fields.Integer(
+        description='HTTP status the comparison finished with'),
+    'result': fields.Raw(
+        description='Score Model once the job is done, or the error message if it failed')
+})
+
+status_model = api.model('Status', {
+    'state': fields.String(
+        required=True,
+        description='Model state: unloaded, loading, preloaded, loaded, warming, ready or failed'),
+    'ready': fields.Boolean(
+        required=True,
+        description='Whether the models are loaded and warmed up'),
+    'load_time': fields.Float(
+        description='Seconds taken to load the models'),
+    'warm_up_time': fields.Float(
+        description='Seconds taken by the warm-up forward pass'),
+    'error': fields.String(
+        description='Error raised while loading or warming up the models')
 })
 
 
+@api.route('/healthz', methods=['GET'])
+class Health(Resource):
+    '''
+    Reports that the app is up along with the load state of the models
+    '''
+
+    @api.marshal_with(status_model)
+    def get(self):
+        '''Reports that the app is up along with the load state of the models'''
+        return models.status(), 200
+
+
+@api.route('/readyz', methods=['GET'])
+class Ready(Resource):
+    '''
+    Reports whether the models are warmed up and the app is ready for traffic
+    '''
+
+    @api.marshal_with(status_model)
+    def get(self):
+        '''Reports whether the models are warmed up and the app is ready for traffic'''
+        status = models.status()
+        return status, 200 if status['ready'] else 503
+
+
+@api.route('/metrics', methods=['GET'])
+class Metrics(Resource):
+    '''
+    Reports the stage timings & counters of this process in the Prometheus text format
+    '''
+
+    def get(self):
+        '''Reports the stage timings & counters of this process in the Prometheus text format'''
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @api.route('/compare', methods=['POST'])
 class Compare(Resource):
     '''
     Compares a list of known texts to an unknown text and returns a score
     '''
 
-    @api.expect(compare_model)
+    @api.expect(profiled_compare_model)
     @api.marshal_with(score_model)
     def post(self):
         '''Compares a list of known texts to an unknown text and returns a score'''
@@ -72,24 +302,272 @@ class Compare(Resource):
         unknown_file = request.files.get('unknown_file')
         unknown_text = request.form.get('unknown_text')
 
-        # Calculate the score
-        score, response = compare_mix_texts(
+        # Calculate the score, profiling the request if an admin asked for it
+        # (the header is ignored when profiling isn't configured)
+        profile_token = request.headers.get('X-Profile-Token')
+        if profile_token is None or not app.config['PROFILE_TOKEN']:
+            score, response = compare_mix_texts(
+                known_files, known_texts, unknown_file, unknown_text)
+            return finalise_response(score, response)
+
+        if not is_profile_token(profile_token, app.config['PROFILE_TOKEN']):
+            abort(403, 'Invalid profile token')
+
+        (score, response), profile_name = profile_call(
+            app.config['PROFILE_DIR'], 'compare', compare_mix_texts,
             known_files, known_texts, unknown_file, unknown_text)
 
+        return *finalise_response(score, response), {'X-Profile': profile_name}
+
+
+@api.route('/compare/jobs', methods=['POST'])
+class CompareJobs(Resource):
+    '''
+    Queues a comparison of known texts to an unknown text and returns its job
+    '''
+
+    @api.expect(compare_model)
+    @api.marshal_with(job_model, code=202)
+    def post(self):
+        '''Queues a comparison of known texts to an unknown text and returns its job'''
+
+        # Get the request data, copying the files as they are closed once the request ends
+        known_files = [
+            StoredFile.from_upload(known_file)
+            for known_file in request.files.getlist('known_files')]
+        known_texts = request.form.getlist('known_texts')
+        unknown_file = request.files.get('unknown_file')
+        if unknown_file:
+            unknown_file = StoredFile.from_upload(unknown_file)
+        unknown_text = request.form.get('unknown_text')
+
+        job = job_runner.submit(
+            run_compare_job, known_files, known_texts, unknown_file, unknown_text)
+        return job.to_dict(), 202, {'Location': api.url_for(CompareJob, job_id=job.job_id)}
+
+
+@api.route('/compare/jobs/<string:job_id>', methods=['GET'])
+class CompareJob(Resource):
+    '''
+    Gets the status of a comparison job and its score once done
+    '''
+
+    @api.marshal_with(job_model)
+    def get(self, job_id):
+        '''Gets the status of a comparison job and its score once done'''
+        job = job_runner.store.get(job_id)
+        if job is None:
+            abort(404, 'Job not found')
+
+        return job.to_dict(), 200
+
+
+@api.route('/compare/batch', methods=['POST'])
+class CompareBatch(Resource):
+    '''
+    Compares many unknown texts to many authors and returns a ranked score matrix
+    '''
+
+    @api.expect(batch_model, validate=True)
+    @api.marshal_with(batch_score_model)
+    def post(self):
+        '''Compares many unknown texts to many authors and returns a ranked score matrix'''
+        # Get the request data
+        authors = api.payload.get('authors') or []
+        author_ids = api.payload.get('author_ids') or []
+        unknown_texts = api.payload.get('unknown_texts') or []
+        pairs = api.payload.get('pairs', False)
+
+        # Check the size of the batch
+        pair_count = len(unknown_texts) * (1 if pairs else len(authors) + len(author_ids))
+        if pair_count > app.config['BATCH_MAX_PAIRS']:
+            abort(413, f'Too many comparisons, at most {app.config["BATCH_MAX_PAIRS"]} allowed')
+
+        # Calculate the scores
+        error, scores = compare_batch_texts(
+            [author['known_texts'] for author in authors], author_ids, unknown_texts, pairs)
+
         # Check for errors
-        if score == 2:
-            abort(400, 'No known texts provided or known files couldnt be read')
-        elif score == 3:
-            abort(401, 'No unknown text provided or unknown file couldnt be read')
+        if error == 2:
+            abort(400, 'No authors provided or an author has no known texts')
+        elif error == 3:
+            abort(401, 'No unknown texts provided or an unknown text is empty')
+        elif error == 4:
+            abort(400, 'Pairs need as many authors as unknown texts')
+        elif error == 5:
+            abort(404, 'Author not found')
 
         # finalise response
+        scores = np.rint(scores*100).astype(int)
+        ranking = [
+            {'unknown': int(unknown), 'author': int(author) if not pairs else int(unknown),
+             'score': int(scores[unknown, author])}
+            for unknown, author in zip(*np.unravel_index(
+                np.argsort(-scores, axis=None, kind='stable'), scores.shape))
+        ]
+        labels = [
+            author.get('name') or str(i) for i, author in enumerate(authors)
+        ] + author_ids
+
+        return {'authors': labels, 'scores': scores.tolist(), 'ranking': ranking}, 200
+
+
+def score_response(score, response) -> tuple[dict, int]:
+    '''Simplifies the result of a comparison into the score model, or an error message'''
+    # Check for errors
+    if score == 2:
+        return {'message': 'No known texts provided or known files couldnt be read'}, 400
+    if score == 3:
+        return {'message': 'No unknown text provided or unknown file couldnt be read'}, 401
+    if score == 5:
+        return {'message': 'Author not found'}, 404
+
+    # finalise response
+    duplicates = response.pop('duplicates', [])
+    with span('simplify'):
         response = simplify_response(response)
-        try:
-            response['score'] = int(round(score*100))
-        except TypeError:
-            abort(500, 'Error calculating score')
+    response['duplicates'] = duplicates
+    try:
+        response['score'] = int(round(score*100))
+    except TypeError:
+        return {'message': 'Error calculating score'}, 500
+
+    return response, 200
+
+
+def finalise_response(score, response) -> tuple[dict, int]:
+    '''Checks the result of a comparison for errors and simplifies it into the score model'''
+    response, code = score_response(score, response)
+    if code != 200:
+        abort(code, response['message'])
+
+    return response, code
+
+
+def run_compare_job(known_files, known_texts, unknown_file, unknown_text) -> tuple[dict, int]:
+    '''Compares a mix of known texts and files to an unknown text within a background job'''
+    return score_response(*compare_mix_texts(
+        known_files, known_texts, unknown_file, unknown_text))
+
+
+def get_author(author_id: str):
+    '''Gets the profile of a registered author, aborting if there isn't one'''
+    profile = author_store.get(author_id)
+    if profile is None:
+        abort(404, 'Author not found')
+
+    return profile
+
+
+@api.route('/authors', methods=['POST'])
+class Authors(Resource):
+    '''
+    Registers an author whose known texts are stored in a profile
+    '''
 
+    @api.expect(author_model)
+    @api.marshal_with(profile_model, code=201)
+    def post(self):
+        '''Registers an author whose known texts are stored in a profile'''
+        profile = author_store.create(request.form.get('name'))
+        return profile.to_dict(), 201
+
+
+@api.route('/authors/identify', methods=['POST'])
+class AuthorIdentify(Resource):
+    '''
+    Finds the registered authors most likely to have written an unknown text
+    '''
+
+    @api.expect(identify_model)
+    @api.marshal_with(identification_model)
+    def post(self):
+        '''Finds the registered authors most likely to have written an unknown text'''
+        # Get the request data
+        top_k = request.form.get('top_k', 5, type=int)
+        method = request.form.get('method') or app.config['AUTHOR_SEARCH']
+        if top_k < 1:
+            abort(400, 'top_k must be at least 1')
+        if method not in SEARCH_METHODS:
+            abort(400, f'method must be one of {", ".join(SEARCH_METHODS)}')
+
+        # Rank the shortlisted authors
+        error, result = identify_author(
+            request.files.get('unknown_file'), request.form.get('unknown_text'),
+            top_k, method=method)
+
+        # Check for errors
+        if error == 2:
+            abort(400, 'No registered authors have known texts')
+        elif error == 3:
+            abort(401, 'No unknown text provided or unknown file couldnt be read')
+
+        # finalise response
+        ranking, candidates, indexed = result
+        return {
+            'authors': [
+                {'author_id': author_id, 'name': name, 'score': int(round(score*100))}
+                for author_id, name, score in ranking],
+            'candidates': candidates,
+            'indexed': indexed
+        }, 200
+
+
+@api.route('/authors/<string:author_id>', methods=['GET'])
+class Author(Resource):
+    '''
+    Gets the profile of a registered author
+    '''
+
+    @api.marshal_with(profile_model)
+    def get(self, author_id):
+        '''Gets the profile of a registered author'''
+        return get_author(author_id).to_dict(), 200
+
+
+@api.route('/authors/<string:author_id>/documents', methods=['POST'])
+class AuthorDocuments(Resource):
+    '''
+    Adds known texts and files to the profile of a registered author
+    '''
+
+    @api.expect(author_texts_model)
+    @api.marshal_with(profile_model)
+    def post(self, author_id):
+        '''Adds known texts and files to the profile of a registered author'''
+        get_author(author_id)
+
+        # Update the profile
+        added, profile = add_author_texts(
+            author_id, request.files.getlist('known_files'),
+            request.form.getlist('known_texts'))
+
+        if profile is None:
+            abort(400, 'No known texts provided or known files couldnt be read')
+
+        response = profile.to_dict()
+        response['added'] = added
         return response, 200
 
+
+@api.route('/authors/<string:author_id>/compare', methods=['POST'])
+class AuthorCompare(Resource):
+    '''
+    Compares an unknown text to the profile of a registered author and returns a score
+    '''
+
+    @api.expect(author_compare_model)
+    @api.marshal_with(score_model)
+    def post(self, author_id):
+        '''Compares an unknown text to the profile of a registered author and returns a score'''
+        get_author(author_id)
+
+        # Calculate the score
+        score, response = compare_author_texts(
+            author_id, request.files.get('unknown_file'), request.form.get('unknown_text'))
+
+        return finalise_response(score, response)
+
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0')
+    app.run(debug=app.config['DEBUG'], host='0.0.0.0')
@@ -0,0 +1,344 @@
+''' ASGI version of the Compare API, run with: uvicorn asgi:app '''
+import io
+import os
+import json
+import asyncio
+import tempfile
+import threading
+import contextlib
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+from flask_restx import marshal
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+from application import app as flask_app, score_model, status_model, run_compare_job
+from compare_texts import models
+from docu_functions import StoredFile
+from request_profiler import is_profile_token, profile_call
+
+
+class RequestError(Exception):
+    '''Error answered with its status code, message & extra headers'''
+
+    def __init__(self, code: int, message: str, headers: list = None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.headers = headers or []
+
+
+class ClientDisconnected(Exception):
+    '''The client went away before its request was read'''
+
+
+def busy_error() -> RequestError:
+    '''Error refusing a request because the server is busy'''
+    return RequestError(503, 'Server is busy, try again later', [(b'retry-after', b'1')])
+
+
+class BoundedExecutor:
+    '''
+    Threads running at most max_workers calls at once with at most max_queue more
+    waiting for a thread, refusing any further calls so a busy server answers 503
+    straight away instead of queueing requests it can't serve in time
+    '''
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 16):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        # only changed by the event loop's thread
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @property
+    def saturated(self) -> bool:
+        '''Whether every thread is busy and the queue is full'''
+        return self.pending >= self.max_workers + self.max_queue
+
+    async def run(self, func, *args):
+        '''Run func(*args) on a thread, raising a 503 RequestError when saturated'''
+        if self.saturated:
+            raise busy_error()
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        '''Start the threads on first use (and again in forked processes)'''
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='compare')
+                self._pid = os.getpid()
+            return self._executor
+
+    def shutdown(self):
+        '''Stop the threads once their calls finish'''
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+
+class UploadSlots:
+    '''
+    Requests whose uploads are being read or held, refusing any over max_slots so a
+    process buffers a bounded number of uploads however many slow clients connect
+    '''
+
+    def __init__(self, max_slots: int = 256):
+        self.max_slots = max(1, max_slots)
+        # only changed by the event loop's thread
+        self.in_use = 0
+
+    @contextlib.contextmanager
+    def hold(self):
+        '''Hold a slot until the request is answered, raising a 503 RequestError if none is free'''
+        if self.in_use >= self.max_slots:
+            raise busy_error()
+
+        self.in_use += 1
+        try:
+            yield
+        finally:
+            self.in_use -= 1
+
+
+class MultipartForm:
+    '''
+    Fields & files of a multipart/form-data body, parsed as its chunks arrive, where
+    files are written to disk once max_memory bytes of them are held in memory
+    '''
+
+    def __init__(self, boundary: bytes, max_memory: int = 1024 * 1024):
+        self.decoder = MultipartDecoder(boundary)
+        self.form = MultiDict()
+        self.files = MultiDict()
+        self.max_memory = max_memory
+        # bytes of the files read so far which are held in memory
+        self.memory = 0
+        self._part = None
+        # contents of the part being read, spooled to disk for files
+        self._buffer = None
+
+    @property
+    def _spool_size(self) -> int:
+        '''Bytes of the next file held in memory, what is left of the budget'''
+        return max(1, self.max_memory - self.memory)
+
+    def feed(self, chunk: bytes):
+        '''Parse the next chunk of the body, None once all of it has arrived'''
+        self.decoder.receive_data(chunk)
+        event = self.decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, (Field, File)):
+                self._part = event
+                self._buffer = tempfile.SpooledTemporaryFile(self._spool_size) \
+                    if isinstance(event, File) else io.BytesIO()
+            elif isinstance(event, Data):
+                self._buffer.write(event.data)
+                if not event.more_data:
+                    self._add_part()
+            event = self.decoder.next_event()
+
+    def _add_part(self):
+        '''Add the field or file which has just been read'''
+        buffer, self._buffer = self._buffer, None
+        if not isinstance(self._part, File):
+            self.form.add(self._part.name, buffer.getvalue().decode('UTF-8', 'replace'))
+        elif not self._part.filename:
+            # like Flask, a file input left empty is sent without a filename
+            buffer.close()
+        else:
+            if buffer.tell() <= self._spool_size:
+                self.memory += buffer.tell()
+            buffer.seek(0)
+            self.files.add(self._part.name, StoredFile(self._part.filename, buffer))
+
+    def close(self):
+        '''Close the files read so far, deleting those written to disk'''
+        close_files(self.files)
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+
+
+def close_files(files: MultiDict):
+    '''Close every uploaded file of a form'''
+    for _, file in files.items(multi=True):
+        file.close()
+
+
+async def body_chunks(receive, max_bytes: int):
+    '''Yield the chunks of the request body as they arrive'''
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if max_bytes and size > max_bytes:
+            raise RequestError(413, 'Request body is too large')
+        if chunk:
+            yield chunk
+        if not message.get('more_body', False):
+            return
+
+
+async def read_form(content_type: str, chunks) -> tuple[MultiDict, MultiDict]:
+    '''Read the fields & files of a form body without blocking the event loop'''
+    mimetype, options = parse_options_header(content_type)
+
+    if mimetype == 'multipart/form-data':
+        if not options.get('boundary'):
+            raise RequestError(400, 'Missing multipart boundary')
+        form = MultipartForm(
+            options['boundary'].encode('latin-1'), flask_app.config['ASYNC_SPOOL_BYTES'])
+        try:
+            async for chunk in chunks:
+                form.feed(chunk)
+            form.feed(None)
+        except ValueError as error:
+            form.close()
+            raise RequestError(400, 'Invalid multipart body') from error
+        except BaseException:
+            # too large, disconnected or cancelled
+            form.close()
+            raise
+        return form.form, form.files
+
+    body = b''.join([chunk async for chunk in chunks])
+    if mimetype == 'application/x-www-form-urlencoded':
+        return MultiDict(parse_qsl(body.decode('UTF-8', 'replace'), keep_blank_values=True)), \
+            MultiDict()
+
+    return MultiDict(), MultiDict()
+
+
+# runs the comparisons without blocking the event loop
+compare_executor = BoundedExecutor(
+    flask_app.config['ASYNC_COMPARE_WORKERS'], flask_app.config['ASYNC_COMPARE_QUEUE'])
+# bounds the uploads read or held at once, as they are read before a thread is free
+upload_slots = UploadSlots(flask_app.config['ASYNC_MAX_UPLOADS'])
+
+
+async def compare(headers: dict, receive) -> tuple[dict, int, list]:
+    '''Compares a list of known texts to an unknown text and returns a score'''
+    # refuse before reading the upload when the comparison would be refused anyway
+    if compare_executor.saturated:
+        raise busy_error()
+
+    with upload_slots.hold():
+        # Get the request data
+        form, files = await read_form(
+            headers.get('content-type', ''),
+            body_chunks(receive, flask_app.config['MAX_UPLOAD_BYTES']))
+        try:
+            return await compare_form(headers, form, files)
+        finally:
+            close_files(files)
+
+
+async def compare_form(headers: dict, form: MultiDict, files: MultiDict) -> tuple[dict, int, list]:
+    '''Compares the known texts & files of a form to its unknown text or file'''
+    args = (
+        files.getlist('known_files'), form.getlist('known_texts'),
+        files.get('unknown_file'), form.get('unknown_text'))
+
+    # Calculate the score, profiling the request if an admin asked for it
+    # (the header is ignored when profiling isn't configured)
+    profile_token = headers.get('x-profile-token')
+    extra_headers = []
+    if profile_token is None or not flask_app.config['PROFILE_TOKEN']:
+        response, code = await compare_executor.run(run_compare_job, *args)
+    elif not is_profile_token(profile_token, flask_app.config['PROFILE_TOKEN']):
+        raise RequestError(403, 'Invalid profile token')
+    else:
+        (response, code), profile_name = await compare_executor.run(
+            profile_call, flask_app.config['PROFILE_DIR'], 'compare', run_compare_job, *args)
+        extra_headers.append((b'x-profile', profile_name.encode('latin-1')))
+
+    if code != 200:
+        raise RequestError(code, response['message'])
+
+    return marshal(response, score_model), code, extra_headers
+
+
+async def health(headers: dict, receive) -> tuple[dict, int, list]:  # pylint: disable=unused-argument
+    '''Reports that the app is up along with the load state of the models'''
+    return marshal(models.status(), status_model), 200, []
+
+
+async def ready(headers: dict, receive) -> tuple[dict, int, list]:  # pylint: disable=unused-argument
+    '''Reports whether the models are warmed up and the app is ready for traffic'''
+    status = models.status()
+    return marshal(status, status_model), 200 if status['ready'] else 503, []
+
+
+# (method, handler) of every path
+ROUTES = {
+    '/compare': ('POST', compare),
+    '/healthz': ('GET', health),
+    '/readyz': ('GET', ready)
+}
+
+
+async def send_json(send, code: int, body: dict, headers: list):
+    '''Send a JSON response'''
+    content = json.dumps(body).encode('UTF-8')
+    await send({
+        'type': 'http.response.start',
+        'status': code,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(content)).encode('latin-1'))
+        ] + headers
+    })
+    await send({'type': 'http.response.body', 'body': content})
+
+
+async def lifespan(receive, send):
+    '''Stop the comparison threads when the server stops, the models warm up on import'''
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            compare_executor.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    '''ASGI entry point serving the /compare, /healthz & /readyz routes'''
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    headers = {
+        name.decode('latin-1').lower(): value.decode('latin-1')
+        for name, value in scope['headers']}
+    try:
+        if scope['path'] not in ROUTES:
+            raise RequestError(404, 'Not found')
+        method, handler = ROUTES[scope['path']]
+        if scope['method'] != method:
+            raise RequestError(405, 'Method not allowed', [(b'allow', method.encode('latin-1'))])
+
+        body, code, extra_headers = await handler(headers, receive)
+    except RequestError as error:
+        body, code, extra_headers = {'message': error.message}, error.code, error.headers
+    except ClientDisconnected:
+        return
+
+    await send_json(send, code, body, extra_headers)
@@ -0,0 +1,175 @@
+'''Unit Testing for the ASGI Compare API'''
+import io
+import os
+import json
+import asyncio
+import unittest
+from werkzeug.test import encode_multipart
+from werkzeug.datastructures import FileStorage, MultiDict
+from application import app as flask_app
+from asgi import app, compare_executor, upload_slots, MultipartForm
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def multipart_body(fields: list[tuple]) -> tuple[bytes, bytes]:
+    '''Content type & body of a multipart form of (name, text or file path) fields'''
+    data = MultiDict()
+    for name, value in fields:
+        if name.endswith('_file') or name.endswith('_files'):
+            with open(value, 'rb') as file:
+                value = FileStorage(
+                    stream=io.BytesIO(file.read()),
+                    filename=os.path.basename(value))
+        data.add(name, value)
+    boundary, body = encode_multipart(data)
+    return f'multipart/form-data; boundary={boundary}'.encode('latin-1'), body
+
+
+def call_app(method: str, path: str, content_type: bytes = b'', body: bytes = b'',
+             chunk_size: int = 64, *, disconnect: bool = False) -> tuple[int, dict, dict]:
+    '''
+    Send a request to the ASGI app in chunks, returning its status, headers & JSON body
+    (None without a response), where the client goes away after the body if disconnect is set
+    '''
+    chunks = [body[i:i+chunk_size] for i in range(0, len(body), chunk_size)] or [b'']
+    messages = [
+        {'type': 'http.request', 'body': chunk, 'more_body': disconnect or i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http', 'method': method, 'path': path,
+        'headers': [(b'content-type', content_type)] if content_type else []
+    }
+    asyncio.run(app(scope, receive, send))
+    if not sent:
+        return None, {}, None
+
+    headers = {name.decode(): value.decode() for name, value in sent[0]['headers']}
+    return sent[0]['status'], headers, json.loads(sent[1]['body'])
+
+
+class AsgiTestCase(unittest.TestCase):
+    '''Class to run test cases for the ASGI app'''
+
+    def setUp(self):
+        '''Sets up the flask app to compare the responses against'''
+        flask_app.config['TESTING'] = True
+        self.client = flask_app.test_client()
+
+    def test_compare(self):
+        '''Test the ASGI app answers like the Flask app, with uploads read in chunks'''
+        fields = [
+            ('known_texts', 'This is a test. It has two sentences.'),
+            ('known_files', BASE_DIR+'/test_files/txt_test01.txt'),
+            ('known_files', BASE_DIR+'/test_files/docx_test01.docx'),
+            ('unknown_file', BASE_DIR+'/test_files/pdf_test01.pdf')
+        ]
+        content_type, body = multipart_body(fields)
+        code, headers, response = call_app('POST', '/compare', content_type, body)
+
+        flask_response = self.client.post(
+            '/compare', data=body, content_type=content_type.decode('latin-1'))
+        self.assertEqual(code, 200)
+        self.assertEqual(headers['content-type'], 'application/json')
+        self.assertEqual(list(response), list(flask_response.json))
+        self.assertEqual(response['score'], flask_response.json['score'])
+
+        # the same errors as the Flask app
+        content_type, body = multipart_body([('unknown_text', 'This is a test.')])
+        self.assertEqual(call_app('POST', '/compare', content_type, body)[0], 400)
+        content_type, body = multipart_body([('known_texts', 'This is a test.')])
+        code, _, response = call_app('POST', '/compare', content_type, body)
+        self.assertEqual(code, 401)
+        self.assertIn('message', response)
+
+        # url encoded forms
+        code, _, response = call_app(
+            'POST', '/compare', b'application/x-www-form-urlencoded',
+            b'known_texts=This+is+a+test.&unknown_text=This+is+a+test.')
+        self.assertEqual(code, 200)
+        self.assertIn('score', response)
+
+    def test_spooled_files(self):
+        '''Test files past the memory budget are read from disk and every slot is released'''
+        fields = [
+            ('known_files', BASE_DIR+'/test_files/txt_test01.txt'),
+            ('known_files', BASE_DIR+'/test_files/docx_test01.docx'),
+            ('unknown_file', BASE_DIR+'/test_files/pdf_test01.pdf')
+        ]
+        content_type, body = multipart_body(fields)
+        expected = call_app('POST', '/compare', content_type, body)
+
+        spool_bytes = flask_app.config['ASYNC_SPOOL_BYTES']
+        flask_app.config['ASYNC_SPOOL_BYTES'] = 0
+        try:
+            self.assertEqual(call_app('POST', '/compare', content_type, body), expected)
+        finally:
+            flask_app.config['ASYNC_SPOOL_BYTES'] = spool_bytes
+        self.assertEqual(expected[0], 200)
+
+        form = MultipartForm(content_type.split(b'boundary=')[1], 4096)
+        for i in range(0, len(body), 64):
+            form.feed(body[i:i+64])
+        form.feed(None)
+        for (_, file), (_, path) in zip(form.files.items(multi=True), fields):
+            with open(path, 'rb') as original:
+                self.assertEqual(file.read(), original.read())
+        self.assertLessEqual(form.memory, 4096)
+        form.close()
+
+        # slots are released whether the upload is answered, too large or dropped
+        max_bytes = flask_app.config['MAX_UPLOAD_BYTES']
+        flask_app.config['MAX_UPLOAD_BYTES'] = len(body) - 1
+        try:
+            self.assertEqual(call_app('POST', '/compare', content_type, body)[0], 413)
+        finally:
+            flask_app.config['MAX_UPLOAD_BYTES'] = max_bytes
+        # no response is sent to a client which went away
+        self.assertIsNone(call_app(
+            'POST', '/compare', content_type, body[:len(body) // 2], disconnect=True)[0])
+        self.assertEqual(upload_slots.in_use, 0)
+        self.assertEqual(compare_executor.pending, 0)
+
+    def test_limits(self):
+        '''Test saturated executors, large bodies & unknown routes are refused'''
+        content_type, body = multipart_body([
+            ('known_texts', 'This is a test.'), ('unknown_text', 'This is a test.')])
+
+        pending = compare_executor.pending
+        compare_executor.pending = compare_executor.max_workers + compare_executor.max_queue
+        try:
+            code, headers, _ = call_app('POST', '/compare', content_type, body)
+        finally:
+            compare_executor.pending = pending
+        self.assertEqual(code, 503)
+        self.assertIn('retry-after', headers)
+
+        max_bytes = flask_app.config['MAX_UPLOAD_BYTES']
+        flask_app.config['MAX_UPLOAD_BYTES'] = len(body) - 1
+        try:
+            self.assertEqual(call_app('POST', '/compare', content_type, body)[0], 413)
+        finally:
+            flask_app.config['MAX_UPLOAD_BYTES'] = max_bytes
+
+        # slow uploads are refused once every upload slot is taken
+        upload_slots.in_use = upload_slots.max_slots
+        try:
+            self.assertEqual(call_app('POST', '/compare', content_type, body)[0], 503)
+        finally:
+            upload_slots.in_use = 0
+
+        self.assertEqual(call_app('GET', '/compare')[0], 405)
+        self.assertEqual(call_app('GET', '/missing')[0], 404)
+        self.assertIn(call_app('GET', '/readyz')[0], (200, 503))
+
+
+if __name__ == '__main__':
+    unittest.main()
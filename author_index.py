@@ -0,0 +1,143 @@
+''' Index of the author representations, searched for the authors closest to a text '''
+import threading
+import numpy as np
+
+# ways the index can shortlist the authors closest to a text
+SEARCH_METHODS = ('exact', 'ivf')
+
+
+def nearest_centroids(vectors, centroids):
+    '''Position of the centroid nearest each vector'''
+    # |v - c|^2 without |v|^2, which is the same for every centroid
+    distances = np.einsum('ij,ij->i', centroids, centroids) - 2 * (vectors @ centroids.T)
+    return np.argmin(distances, axis=1)
+
+
+def kmeans(vectors, list_count: int, iterations: int = 10, seed: int = 0) -> tuple:
+    '''Cluster vectors around list_count centroids, returning them & every vector's centroid'''
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), list_count, replace=False)].astype(np.float64)
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=list_count)
+        # centroids which lost every vector stay where they are
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+
+    return centroids.astype(np.float32), nearest_centroids(vectors, centroids)
+
+
+class AuthorIndex:
+    '''
+    Representations (mean base network features) of every author with known documents,
+    searched by Euclidean distance either exactly, scanning every author, or through
+    an IVF partition, where the authors are clustered around about sqrt(n) centroids
+    and a search only scans the authors of the centroids nearest the text, so the time
+    a search takes grows with the square root of the number of authors
+    '''
+
+    def __init__(
+            self, author_ids: list[str], names: list[str], representations,
+            *, probes: int = 8, min_size: int = 256):
+        self.author_ids = list(author_ids)
+        self.names = list(names)
+        self.representations = np.asarray(representations, dtype=np.float32).reshape(
+            len(self.author_ids), -1) if self.author_ids else np.zeros((0, 0), dtype=np.float32)
+        self.probes = max(1, probes)
+        self.norms = np.einsum('ij,ij->i', self.representations, self.representations)
+
+        # small indexes are always scanned exactly
+        self.centroids = None
+        self.lists = []
+        if len(self.author_ids) >= min_size:
+            self.centroids, assignments = kmeans(
+                self.representations, int(round(np.sqrt(len(self.author_ids)))))
+            order = np.argsort(assignments, kind='stable')
+            bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+            self.lists = [order[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def __len__(self) -> int:
+        return len(self.author_ids)
+
+    def search(self, features, count: int, method: str = 'ivf'):
+        '''
+        Positions of the count authors closest to the features of a text, closest first.
+        The IVF partition scans the lists of at least self.probes centroids,
+        probing more until they hold count authors
+        '''
+        if method not in SEARCH_METHODS:
+            raise ValueError(f'Unknown search method {method!r}, expected one of {SEARCH_METHODS}')
+
+        features = np.asarray(features, dtype=np.float32).reshape(-1)
+        if method == 'exact' or self.centroids is None:
+            candidates = np.arange(len(self))
+        else:
+            centroid_distances = np.einsum(
+                'ij,ij->i', self.centroids, self.centroids) - 2 * (self.centroids @ features)
+            order = np.argsort(centroid_distances)
+            sizes = np.cumsum([len(self.lists[i]) for i in order])
+            probes = max(self.probes, int(np.searchsorted(sizes, count)) + 1)
+            candidates = np.concatenate([self.lists[i] for i in order[:probes]])
+
+        distances = self.norms[candidates] - 2 * (self.representations[candidates] @ features)
+        if count < len(candidates):
+            closest = np.argpartition(distances, count)[:count]
+            candidates, distances = candidates[closest], distances[closest]
+
+        return candidates[np.argsort(distances, kind='stable')]
+
+
+class AuthorIndexer:
+    '''
+    Keeps an index of the authors in a profile store. Once there is one, changes to the
+    store are picked up by rebuilding the index on a background thread while searches
+    keep using the previous index, so writes never make a search scan every author
+    '''
+
+    def __init__(self, store, probes: int = 8):
+        self.store = store
+        self.probes = probes
+        self._index = None
+        self._revision = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def get(self) -> AuthorIndex:
+        '''Latest index of the authors, starting a rebuild if the store has changed since'''
+        revision = self.store.revision()
+        with self._lock:
+            index = self._index
+            # an empty index can't serve a search, so it is rebuilt straight away
+            if index is None or (len(index) == 0 and self._revision != revision):
+                index = None
+            elif self._revision != revision and not (
+                    self._thread is not None and self._thread.is_alive()):
+                self._thread = threading.Thread(
+                    target=self.rebuild, name='author-index', daemon=True)
+                self._thread.start()
+
+        return self.rebuild() if index is None else index
+
+    def rebuild(self) -> AuthorIndex:
+        '''Build an index of the authors as they currently are in the store'''
+        with self._build_lock:
+            revision = self.store.revision()
+            with self._lock:
+                if self._index is not None and self._revision == revision:
+                    return self._index
+
+            author_ids, names, representations = self.store.representations()
+            index = AuthorIndex(author_ids, names, representations, probes=self.probes)
+            with self._lock:
+                self._index = index
+                self._revision = revision
+            return index
+
+    def wait(self):
+        '''Wait for a rebuild running in the background'''
+        thread = self._thread
+        if thread is not None:
+            thread.join()
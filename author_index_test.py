@@ -0,0 +1,92 @@
+'''Unit Testing for the author index'''
+import tempfile
+import unittest
+import numpy as np
+from author_index import AuthorIndex, AuthorIndexer
+from author_profiles import MemoryProfileStore, SQLiteProfileStore
+from feature_cache import DocumentFeatures
+
+
+def clustered_vectors(count: int, size: int = 64, clusters: int = 50, seed: int = 0):
+    '''Vectors spread around random cluster centres, like authors writing in similar styles'''
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, size)) * 4
+    return (centres[rng.integers(clusters, size=count)]
+            + rng.standard_normal((count, size))).astype(np.float32)
+
+
+def brute_force(vectors, query, count: int):
+    '''Positions of the count vectors closest to the query'''
+    return np.argsort(np.linalg.norm(vectors - query, axis=1), kind='stable')[:count]
+
+
+class AuthorIndexTestCase(unittest.TestCase):
+    '''Class to test searching the author index'''
+    vectors = clustered_vectors(5000)
+    queries = clustered_vectors(50, seed=1)
+    index = AuthorIndex([str(i) for i in range(5000)], [None] * 5000, vectors)
+
+    def test_exact(self):
+        '''Exact search must find the same authors as a brute force search'''
+        for query in self.queries:
+            np.testing.assert_array_equal(
+                np.sort(self.index.search(query, 10, 'exact')),
+                np.sort(brute_force(self.vectors, query, 10)))
+
+    def test_ivf(self):
+        '''The IVF partition must find most of the closest authors while scanning fewer'''
+        found = 0
+        for query in self.queries:
+            found += len(np.intersect1d(
+                self.index.search(query, 10, 'ivf'), brute_force(self.vectors, query, 10)))
+
+        self.assertEqual(len(self.index.lists), 71)
+        self.assertGreaterEqual(found / (10 * len(self.queries)), 0.9)
+        # asking for more authors than the probed lists hold probes more lists
+        self.assertEqual(len(self.index.search(self.queries[0], 2000, 'ivf')), 2000)
+        with self.assertRaises(ValueError):
+            self.index.search(self.queries[0], 10, 'lsh')
+
+    def test_small(self):
+        '''Small indexes are scanned exactly, returning every author when asked for more'''
+        index = AuthorIndex(['a', 'b', 'c'], ['A', 'B', 'C'], self.vectors[:3])
+        self.assertIsNone(index.centroids)
+        self.assertEqual(sorted(index.search(self.vectors[1], 10, 'ivf')), [0, 1, 2])
+        self.assertEqual(index.search(self.vectors[1], 1, 'ivf')[0], 1)
+
+    def test_indexer(self):
+        '''The index must be rebuilt whenever the profiles change, in the background once built'''
+        with tempfile.TemporaryDirectory() as directory:
+            for store in (MemoryProfileStore(), SQLiteProfileStore(directory+'/authors.db')):
+                indexer = AuthorIndexer(store)
+                self.assertEqual(len(indexer.get()), 0)
+
+                profile = store.create('Author')
+                store.create('Empty')
+                for i, key in enumerate(('x', 'y', 'x')):
+                    store.add_documents(profile.author_id, [(key, DocumentFeatures(
+                        np.zeros(3), np.zeros(2), 1, self.vectors[i]))])
+
+                index = indexer.get()
+                self.assertIs(indexer.get(), index)
+                self.assertEqual(index.author_ids, [profile.author_id])
+                self.assertEqual(index.names, ['Author'])
+                np.testing.assert_allclose(
+                    index.representations[0], self.vectors[:2].mean(axis=0), rtol=1e-6)
+                np.testing.assert_array_equal(
+                    index.representations[0],
+                    store.get(profile.author_id).mean_features().features)
+
+                # searches keep the previous index until the rebuild is done
+                other = store.create('Other')
+                store.add_documents(other.author_id, [('z', DocumentFeatures(
+                    np.zeros(3), np.zeros(2), 1, self.vectors[3]))])
+                with indexer._build_lock:  # pylint: disable=protected-access
+                    self.assertIs(indexer.get(), index)
+                    self.assertIs(indexer.get(), index)
+                indexer.wait()
+                self.assertEqual(indexer.get().author_ids, [profile.author_id, other.author_id])
+
+
+if __name__ == '__main__':
+    unittest.main()
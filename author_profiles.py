@@ -0,0 +1,236 @@
+''' Persistent author profiles built up incrementally from known documents '''
+import uuid
+import threading
+import numpy as np
+from functions import STYLE_HEADERS
+from sqlite_connections import ProcessConnection
+from feature_cache import DocumentFeatures, array_to_blob, blob_to_array
+
+
+def copy_array(array):
+    '''Copy an array which may not be set yet'''
+    return None if array is None else array.copy()
+
+
+class AuthorProfile:
+    '''
+    Running sums of the features of an author's known documents, so adding
+    a document is O(1) and the author representation is their mean
+    '''
+
+    def __init__(
+            self, author_id: str, name: str = None, *, document_count: int = 0,
+            feature_sum=None, w2v_sum=None, style_sum=None, word_count_sum: float = 0):
+        self.author_id = author_id
+        self.name = name
+        self.document_count = document_count
+        self.feature_sum = feature_sum
+        self.w2v_sum = w2v_sum
+        self.style_sum = style_sum
+        self.word_count_sum = word_count_sum
+
+    def add(self, entry: DocumentFeatures):
+        '''Add the features of a known document, which must include its base network features'''
+        if self.document_count == 0:
+            self.feature_sum = np.zeros_like(entry.features, dtype=np.float64)
+            self.w2v_sum = np.zeros_like(entry.w2v_vec, dtype=np.float64)
+            self.style_sum = np.zeros_like(entry.style_vec, dtype=np.float64)
+
+        self.feature_sum += entry.features
+        self.w2v_sum += entry.w2v_vec
+        self.style_sum += entry.style_vec
+        self.word_count_sum += entry.word_count
+        self.document_count += 1
+
+    def representation(self):
+        '''Mean base network features of the known documents, representing the author'''
+        return (self.feature_sum/self.document_count).astype(np.float32)
+
+    def mean_features(self) -> DocumentFeatures:
+        '''Mean features of the known documents, with the author representation as features'''
+        return DocumentFeatures(
+            self.w2v_sum/self.document_count, self.style_sum/self.document_count,
+            self.word_count_sum/self.document_count, self.representation())
+
+    def style_dict(self) -> dict:
+        '''Mean of every style value over the known documents'''
+        mean = self.mean_features()
+        style_dict = dict(zip(STYLE_HEADERS, mean.style_vec))
+        style_dict['word_count'] = mean.word_count
+        return style_dict
+
+    def to_dict(self) -> dict:
+        '''Summary of the profile returned by the API'''
+        return {
+            'author_id': self.author_id,
+            'name': self.name,
+            'document_count': self.document_count
+        }
+
+
+class MemoryProfileStore:
+    '''Author profiles kept in the memory of the current process'''
+
+    def __init__(self):
+        self._profiles = {}
+        self._document_keys = {}
+        # changes whenever an author or document is added
+        self._revision = 0
+        self._lock = threading.Lock()
+
+    def create(self, name: str = None) -> AuthorProfile:
+        '''Register a new author'''
+        profile = AuthorProfile(uuid.uuid4().hex, name)
+        with self._lock:
+            self._profiles[profile.author_id] = profile
+            self._document_keys[profile.author_id] = set()
+            self._revision += 1
+        return profile
+
+    def revision(self) -> int:
+        '''Value which changes whenever the profiles change'''
+        with self._lock:
+            return self._revision
+
+    def representations(self) -> tuple[list, list, list]:
+        '''IDs, names & representations of every author with known documents'''
+        with self._lock:
+            profiles = [
+                profile for profile in self._profiles.values() if profile.document_count > 0]
+            return (
+                [profile.author_id for profile in profiles], [profile.name for profile in profiles],
+                [profile.representation() for profile in profiles])
+
+    def get(self, author_id: str) -> AuthorProfile:
+        '''Get a copy of an author's profile, or None if they aren't registered'''
+        with self._lock:
+            profile = self._profiles.get(author_id)
+            if profile is None:
+                return None
+
+            return AuthorProfile(
+                profile.author_id, profile.name, document_count=profile.document_count,
+                feature_sum=copy_array(profile.feature_sum), w2v_sum=copy_array(profile.w2v_sum),
+                style_sum=copy_array(profile.style_sum), word_count_sum=profile.word_count_sum)
+
+    def add_documents(self, author_id: str, documents: list[tuple]) -> int:
+        '''
+        Add (document key, features) to an author's profile, skipping documents
+        they already have, and return the number of documents added
+        '''
+        with self._lock:
+            profile = self._profiles[author_id]
+            keys = self._document_keys[author_id]
+            added = 0
+            for key, entry in documents:
+                if key not in keys:
+                    keys.add(key)
+                    profile.add(entry)
+                    added += 1
+            self._revision += added
+            return added
+
+
+class SQLiteProfileStore:
+    '''Author profiles kept in an SQLite database shared between processes'''
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._db = ProcessConnection(db_path, [
+            'CREATE TABLE IF NOT EXISTS author_profiles ('
+            'author_id TEXT PRIMARY KEY, name TEXT, document_count INTEGER, '
+            'feature_sum BLOB, w2v_sum BLOB, style_sum BLOB, word_count_sum REAL)',
+            'CREATE TABLE IF NOT EXISTS author_documents ('
+            'author_id TEXT, document_key TEXT, PRIMARY KEY (author_id, document_key))'
+        ], isolation_level=None)
+        self._lock = threading.Lock()
+
+    def create(self, name: str = None) -> AuthorProfile:
+        '''Register a new author'''
+        profile = AuthorProfile(uuid.uuid4().hex, name)
+        with self._lock:
+            self._db.get().execute(
+                'INSERT INTO author_profiles VALUES (?, ?, 0, NULL, NULL, NULL, 0)',
+                (profile.author_id, name))
+        return profile
+
+    def get(self, author_id: str) -> AuthorProfile:
+        '''Get an author's profile, or None if they aren't registered'''
+        with self._lock:
+            return self._get(author_id)
+
+    def revision(self) -> tuple[int, int]:
+        '''Value which changes whenever the profiles change, in this or another process'''
+        with self._lock:
+            # data_version changes when other connections commit, total_changes with this one
+            db = self._db.get()
+            return db.execute('PRAGMA data_version').fetchone()[0], db.total_changes
+
+    def representations(self) -> tuple[list, list, list]:
+        '''IDs, names & representations of every author with known documents'''
+        with self._lock:
+            rows = self._db.get().execute(
+                'SELECT author_id, name, document_count, feature_sum FROM author_profiles '
+                'WHERE document_count > 0 ORDER BY rowid').fetchall()
+
+        return (
+            [row[0] for row in rows], [row[1] for row in rows],
+            [(blob_to_array(row[3])/row[2]).astype(np.float32) for row in rows])
+
+    def add_documents(self, author_id: str, documents: list[tuple]) -> int:
+        '''
+        Add (document key, features) to an author's profile, skipping documents
+        they already have, and return the number of documents added
+        '''
+        with self._lock:
+            db = self._db.get()
+            # lock the database so other processes can't update the profile in between
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                profile = self._get(author_id)
+                added = 0
+                for key, entry in documents:
+                    inserted = db.execute(
+                        'INSERT OR IGNORE INTO author_documents VALUES (?, ?)',
+                        (author_id, key)).rowcount
+                    if inserted:
+                        profile.add(entry)
+                        added += 1
+
+                if added:
+                    db.execute(
+                        'UPDATE author_profiles SET document_count = ?, feature_sum = ?, '
+                        'w2v_sum = ?, style_sum = ?, word_count_sum = ? WHERE author_id = ?',
+                        (profile.document_count, array_to_blob(profile.feature_sum),
+                         array_to_blob(profile.w2v_sum), array_to_blob(profile.style_sum),
+                         profile.word_count_sum, author_id))
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+
+            return added
+
+    def _get(self, author_id: str) -> AuthorProfile:
+        row = self._db.get().execute(
+            'SELECT author_id, name, document_count, feature_sum, w2v_sum, style_sum, '
+            'word_count_sum FROM author_profiles WHERE author_id = ?', (author_id,)).fetchone()
+        if row is None:
+            return None
+
+        author_id, name, document_count, feature_sum, w2v_sum, style_sum, word_count_sum = row
+        if document_count == 0:
+            return AuthorProfile(author_id, name)
+
+        return AuthorProfile(
+            author_id, name, document_count=document_count,
+            feature_sum=blob_to_array(feature_sum), w2v_sum=blob_to_array(w2v_sum),
+            style_sum=blob_to_array(style_sum), word_count_sum=word_count_sum)
+
+
+def create_profile_store(db_path: str = None):
+    '''Create an SQLite profile store if a database is given, otherwise an in-memory one'''
+    if db_path:
+        return SQLiteProfileStore(db_path)
+
+    return MemoryProfileStore()
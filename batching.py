@@ -0,0 +1,81 @@
+''' Micro-batching scheduler used to share model inference between requests '''
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    '''
+    Collects items submitted by concurrent requests and runs them through
+    batch_fn together, sending each result back to its waiting request
+    '''
+
+    def __init__(self, batch_fn, max_batch_size: int = 32, batch_window: float = 0.0):
+        '''
+        batch_fn takes a list of items and returns a list of results in the same order.
+        batch_window is how long (in seconds) to wait for more items once one arrives,
+        with 0 only batching the items that queued up while the last batch was running
+        '''
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_window = max(0.0, batch_window)
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker = None
+        self._pid = None
+
+    def submit(self, item) -> Future:
+        '''Queue an item for the next batch and return a future for its result'''
+        future = Future()
+        self._get_queue().put((item, future))
+        return future
+
+    def run(self, item):
+        '''Queue an item and wait for its result'''
+        return self.submit(item).result()
+
+    def _get_queue(self) -> queue.Queue:
+        '''Start the worker thread on first use (and again in forked processes)'''
+        with self._lock:
+            if self._pid != os.getpid() or not self._worker.is_alive():
+                self._queue = queue.Queue()
+                self._worker = threading.Thread(
+                    target=self._loop, args=(self._queue,), daemon=True)
+                self._worker.start()
+                self._pid = os.getpid()
+            return self._queue
+
+    def _collect(self, work_queue: queue.Queue) -> list:
+        '''Block for one item then gather more until the window or batch size runs out'''
+        batch = [work_queue.get()]
+        deadline = time.monotonic() + self.batch_window
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(work_queue.get(timeout=timeout))
+                else:
+                    batch.append(work_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _loop(self, work_queue: queue.Queue):
+        '''Worker thread which runs batches for as long as the process lives'''
+        while True:
+            batch = self._collect(work_queue)
+            items = [item for item, _ in batch]
+
+            try:
+                results = self.batch_fn(items)
+            except Exception as error:  # pylint: disable=broad-except
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
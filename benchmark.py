@@ -0,0 +1,304 @@
+''' Benchmark of every stage of the comparison pipeline, reported as JSON '''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import subprocess
+import numpy as np
+
+# initial folder path
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# punctuation mixed into the synthetic texts, weighted towards full stops & commas
+SYNTHETIC_PUNCTUATION = ['.'] * 6 + [','] * 6 + [';', ':', '!', '?', '-', '(', '"', '\'']
+
+
+class StageTimer:
+    '''Collects the latency of every run of each stage'''
+
+    def __init__(self):
+        self.latencies = {}
+        self.items = {}
+
+    def time(self, stage: str, func, *func_args, items: int = 1):
+        '''Run func(*func_args), recording how long it took and how many items it processed'''
+        start = time.perf_counter()
+        result = func(*func_args)
+        self.latencies.setdefault(stage, []).append(time.perf_counter() - start)
+        self.items[stage] = self.items.get(stage, 0) + items
+        return result
+
+    def report(self) -> dict:
+        '''Latency percentiles (in ms) and throughput (items per second) of every stage'''
+        report = {}
+        for stage, latencies in self.latencies.items():
+            latencies = np.array(latencies)
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+            report[stage] = {
+                'runs': len(latencies),
+                'items': self.items[stage],
+                'mean_ms': latencies.mean() * 1000,
+                'p50_ms': p50,
+                'p90_ms': p90,
+                'p99_ms': p99,
+                'max_ms': latencies.max() * 1000,
+                'throughput': self.items[stage] / latencies.sum()
+            }
+        return report
+
+
+def load_test_files() -> list:
+    '''Read every file in test_files/ into memory as if it were uploaded'''
+    # imported here so the benchmark configuration is read before the app is
+    from docu_functions import StoredFile  # pylint: disable=import-outside-toplevel
+
+    files = []
+    for name in sorted(os.listdir(BASE_DIR+'/test_files')):
+        with open(BASE_DIR+'/test_files/'+name, 'rb') as file:
+            files.append(StoredFile(name, file.read()))
+    return files
+
+
+def build_vocabulary(texts: list[str]) -> list[str]:
+    '''Words of the given texts used to build synthetic texts'''
+    words = sorted({
+        word.strip('.,;:!?()"\'').lower() for text in texts for word in text.split()})
+    return [word for word in words if word.isalpha()] or ['text']
+
+
+def synthetic_text(vocabulary: list[str], word_count: int, rng: random.Random) -> str:
+    '''Random text of word_count words with sentences of 5 to 30 words'''
+    words = []
+    sentence_length = rng.randint(5, 30)
+    for i in range(word_count):
+        word = rng.choice(vocabulary)
+        sentence_length -= 1
+        if sentence_length == 0 or i == word_count - 1:
+            word += '.'
+            sentence_length = rng.randint(5, 30)
+        elif rng.random() < 0.08:
+            word += rng.choice(SYNTHETIC_PUNCTUATION)
+        words.append(word)
+
+    return ' '.join(words)
+
+
+def peak_rss_mb() -> float:
+    '''Peak resident memory of this process in MiB'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and KiB everywhere else
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+def git_commit() -> str:
+    '''Commit being benchmarked, or None outside a git checkout'''
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, check=True,
+            capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class PipelineBenchmark:
+    '''
+    Times every stage over test_files/ and synthetic texts built from their vocabulary.
+    Unless keep_cache is set the feature cache is cleared before each comparison
+    so every document is processed from scratch
+    '''
+
+    def __init__(
+            self, known_counts: list[int], repeat: int = 5,
+            seed: int = 0, keep_cache: bool = False):
+        self.known_counts = known_counts
+        self.repeat = repeat
+        self.keep_cache = keep_cache
+        self.timer = StageTimer()
+        self.rng = random.Random(seed)
+        self.vocabulary = ['text']
+        self.texts = []
+
+    def run_readers(self):
+        '''Time the file readers over test_files/, keeping the vocabulary of what they read'''
+        # imported here so the benchmark configuration is read before the app is
+        from docu_functions import process_file  # pylint: disable=import-outside-toplevel
+
+        files = load_test_files()
+        texts = []
+        for _ in range(self.repeat):
+            for file in files:
+                file.stream.seek(0)
+                extension = os.path.splitext(file.filename)[1] or 'other'
+                text = self.timer.time('read'+extension, process_file, file)
+                if text and not text.isspace():
+                    texts.append(text)
+
+        self.texts = list(dict.fromkeys(texts))
+        self.vocabulary = build_vocabulary(texts)
+
+    def run_preprocess(self):
+        '''
+        Time preprocess_text over the texts read from test_files/, right after the
+        lemma cache is cleared (cold) and again once it holds their words (warm)
+        '''
+        # imported here so the benchmark configuration is read before the app is
+        # pylint: disable=import-outside-toplevel
+        from functions import get_text_context, parse_document, preprocess_text
+
+        documents = [parse_document(text) for text in self.texts]
+        lemmatize = get_text_context().lemmatize
+        for _ in range(self.repeat):
+            lemmatize.cache_clear()
+            for stage in ('cold', 'warm'):
+                self.timer.time(
+                    f'preprocess_text.{stage}',
+                    lambda: [preprocess_text(document) for document in documents],
+                    items=len(documents))
+
+    def run_texts(self, size: int):
+        '''
+        Time get_vectors, compare_final_texts & the /compare route over
+        synthetic texts of size words, comparing every known-set count
+        '''
+        # imported here so the benchmark configuration is read before the app is
+        # pylint: disable=import-outside-toplevel
+        from application import app
+        from compare_texts import compare_final_texts, models
+        from functions import get_vectors
+
+        client = app.test_client()
+        for _ in range(self.repeat):
+            self.timer.time(
+                f'get_vectors[{size}]', get_vectors,
+                [self.synthetic_text(size)], models.word2vec_model)
+
+        for known_count in self.known_counts:
+            stage = f'[{size}x{known_count}]'
+            for _ in range(self.repeat):
+                known_texts = [self.synthetic_text(size) for _ in range(known_count)]
+                unknown_text = self.synthetic_text(size)
+
+                self.clear_cache()
+                self.timer.time(
+                    'compare_final_texts'+stage, compare_final_texts,
+                    known_texts, [unknown_text], items=known_count + 1)
+
+                self.clear_cache()
+                response = self.timer.time(
+                    'route'+stage, lambda data: client.post('/compare', data=data),
+                    {'known_texts': known_texts, 'unknown_text': unknown_text},
+                    items=known_count + 1)
+                if response.status_code != 200:
+                    raise RuntimeError(f'/compare returned {response.status_code}')
+
+    def run_author_index(self, count: int, size: int, searches: int = 20):
+        '''
+        Time building an index of count authors with representations of size features
+        spread around clusters, like authors writing in similar styles, and searching it
+        '''
+        # imported here so the benchmark configuration is read before the app is
+        from author_index import AuthorIndex  # pylint: disable=import-outside-toplevel
+
+        rng = np.random.default_rng(self.rng.randrange(2**32))
+        centres = rng.standard_normal((50, size)) * 4
+        vectors = (centres[rng.integers(50, size=count + searches)]
+                   + rng.standard_normal((count + searches, size))).astype(np.float32)
+
+        index = self.timer.time(
+            f'author_index.build[{count}]', AuthorIndex,
+            [str(i) for i in range(count)], [None] * count, vectors[:count], items=count)
+        for _ in range(self.repeat):
+            for query in vectors[count:]:
+                for method in ('exact', 'ivf'):
+                    self.timer.time(
+                        f'author_index.{method}[{count}]', index.search, query, 50, method)
+
+    def synthetic_text(self, size: int) -> str:
+        '''Random text of size words'''
+        return synthetic_text(self.vocabulary, size, self.rng)
+
+    def clear_cache(self):
+        '''Clear the feature cache unless it is being kept'''
+        # imported here so the benchmark configuration is read before the app is
+        from compare_texts import feature_cache  # pylint: disable=import-outside-toplevel
+
+        if feature_cache is not None and not self.keep_cache:
+            feature_cache.clear()
+
+
+def run_benchmark(
+        sizes: list[int], known_counts: list[int], repeat: int = 5,
+        seed: int = 0, keep_cache: bool = False, *, author_counts: list[int] = ()) -> dict:
+    '''
+    Benchmark every stage with synthetic texts of every size, and the author index
+    with every number of authors, and report the results
+    '''
+    # imported here so the benchmark configuration is read before the app is
+    from compare_texts import models  # pylint: disable=import-outside-toplevel
+
+    start = time.perf_counter()
+    models.warm_up()
+    load_time = time.perf_counter() - start
+
+    benchmark = PipelineBenchmark(known_counts, repeat, seed, keep_cache)
+    benchmark.run_readers()
+    benchmark.run_preprocess()
+    for size in sizes:
+        benchmark.run_texts(size)
+    for count in author_counts:
+        benchmark.run_author_index(count, models.feature_size)
+
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'parameters': {
+            'sizes': sizes, 'known_counts': known_counts, 'repeat': repeat,
+            'seed': seed, 'keep_cache': keep_cache, 'author_counts': list(author_counts)
+        },
+        'model_load_s': load_time,
+        'stages': benchmark.timer.report(),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def parse_ints(value: str) -> list[int]:
+    '''Parse a comma separated list of integers'''
+    return [int(item) for item in value.split(',') if item]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark every stage of the comparison pipeline')
+    parser.add_argument(
+        '--sizes', type=parse_ints, default=[100, 1000, 5000],
+        help='Comma separated word counts of the synthetic texts')
+    parser.add_argument(
+        '--known-counts', type=parse_ints, default=[1, 5, 20],
+        help='Comma separated numbers of known texts per comparison')
+    parser.add_argument(
+        '--author-counts', type=parse_ints, default=[5000, 20000, 80000],
+        help='Comma separated numbers of authors in the searched author indexes')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of every stage')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic texts')
+    parser.add_argument(
+        '--keep-cache', action='store_true', help="Don't clear the feature cache between runs")
+    parser.add_argument('--output', help='JSON file to write, otherwise printed')
+    args = parser.parse_args()
+
+    # don't start warming up in the background, the benchmark times it
+    os.environ.setdefault('WARM_UP_ON_START', 'False')
+    # only use the in-memory feature cache, as clearing it would wipe the one on disk
+    os.environ['FEATURE_CACHE_DB'] = ''
+    results = json.dumps(run_benchmark(
+        args.sizes, args.known_counts, args.repeat, args.seed, args.keep_cache,
+        author_counts=args.author_counts), indent=2)
+
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as output:
+            output.write(results + '\n')
+    else:
+        print(results)
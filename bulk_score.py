@@ -0,0 +1,469 @@
+''' Offline scoring of a manifest of (known set, unknown) pairs, resumable from a checkpoint '''
+import os
+import csv
+import json
+import hashlib
+import time
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import Config
+from compare_texts import models, embed_features, score_batch, compare_styles
+from docu_functions import read_file, simplify_response
+from feature_cache import FeatureCache, DocumentFeatures, document_key
+from functions import get_text_vectors, get_style_dict
+from near_duplicates import MinHasher, find_duplicates, describe_duplicates
+from word_vectors import load_word_vectors
+
+# formats of the manifest & the results
+MANIFEST_FORMATS = ('jsonl', 'csv')
+OUTPUT_FORMATS = ('jsonl', 'parquet')
+
+# separates the paths of several known files in a CSV manifest
+CSV_PATH_SEPARATOR = ';'
+
+# values of the Score Model written for every row, which are None when it couldn't be scored
+SCORE_FIELDS = (
+    'w_sim', 'punct_p', 'avg_sent_l', 'rare_word_p', 'long_word_p', 'ttr', 'word_count')
+
+# word vectors & MinHasher of a featurising process, loaded once by init_worker
+_WORKER_STATE = {}
+
+
+class ManifestDocument(DocumentFeatures):
+    '''
+    Features of a document of the manifest, along with the digest & MinHash signature
+    of its text which its duplicates in the same known set are found with
+    '''
+
+    def __init__(self, w2v_vec, style_vec, word_count, digest: str, signature=None):
+        super().__init__(w2v_vec, style_vec, word_count)
+        self.digest = digest
+        self.signature = signature
+
+
+def read_manifest(path: str, manifest_format: str):
+    '''
+    Yield the rows of a manifest one at a time as dicts of known_files, known_texts,
+    unknown_file & unknown_text, with an optional id. A JSONL manifest has one JSON object
+    per line, a CSV one has a column per field where known_files are separated by ';'
+    '''
+    with open(path, encoding='UTF-8', newline='') as manifest:
+        if manifest_format == 'csv':
+            for row in csv.DictReader(manifest):
+                yield {
+                    'id': row.get('id') or None,
+                    'known_files': [
+                        file for file in (row.get('known_files') or '').split(CSV_PATH_SEPARATOR)
+                        if file],
+                    'known_texts': [row['known_texts']] if row.get('known_texts') else [],
+                    'unknown_file': row.get('unknown_file') or None,
+                    'unknown_text': row.get('unknown_text') or None
+                }
+        else:
+            for line in manifest:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def init_worker(w2v_load_mode: str, permutations: int):
+    '''Load the word vectors once in every featurising process'''
+    _WORKER_STATE['word_vectors'] = load_word_vectors(w2v_load_mode)
+    _WORKER_STATE['min_hasher'] = MinHasher(permutations) if permutations else None
+
+
+def featurise(document: tuple):
+    '''
+    Extract the text of a ('file', path) or ('text', text) document and get its
+    word2vec vector, style vector, word count, digest & MinHash signature (None when
+    near duplicates aren't looked for), or None if it is unreadable or empty
+    '''
+    kind, value = document
+    try:
+        if kind == 'file':
+            with open(value, 'rb') as file:
+                text = read_file(value, file)
+        else:
+            text = value
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+    if not text or text.isspace():
+        return None
+
+    min_hasher = _WORKER_STATE['min_hasher']
+    return (
+        *get_text_vectors(text, _WORKER_STATE['word_vectors']),
+        hashlib.sha256(text.encode('UTF-8', 'surrogatepass')).hexdigest(),
+        None if min_hasher is None else min_hasher.signature(text))
+
+
+def finalise_row(row_id: str, score, style_dict: dict, duplicates: list[dict] = None) -> dict:
+    '''Result of a row in the Score Model, with its status code like the API'''
+    record = dict.fromkeys(('id', 'code', 'message', 'score') + SCORE_FIELDS + ('duplicates',))
+    record['id'] = row_id
+    if score == 2:
+        record.update(code=400, message='No known texts provided or known files couldnt be read')
+    elif score == 3:
+        record.update(code=401, message='No unknown text provided or unknown file couldnt be read')
+    else:
+        record.update(
+            simplify_response(style_dict), code=200, score=int(round(score*100)),
+            duplicates=duplicates)
+
+    return record
+
+
+class JsonlWriter:
+    '''Appends results to a JSONL file, cutting anything written after the last checkpoint'''
+
+    def __init__(self, path: str, checkpoint: dict):
+        if checkpoint and (
+                not os.path.isfile(path) or os.path.getsize(path) < checkpoint['bytes']):
+            raise ValueError(
+                f'{path} is missing results written before its checkpoint, '
+                'use --restart to overwrite it')
+        self.file = open(path, 'r+b' if checkpoint else 'wb')  # pylint: disable=consider-using-with
+        if checkpoint:
+            self.file.truncate(checkpoint['bytes'])
+            self.file.seek(checkpoint['bytes'])
+
+    def write(self, records: list[dict]):
+        '''Write the results of a batch'''
+        self.file.write(b''.join(
+            json.dumps(record).encode('UTF-8') + b'\n' for record in records))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def position(self) -> dict:
+        '''Where the results written so far end'''
+        return {'bytes': self.file.tell()}
+
+    def close(self):
+        '''Close the file'''
+        self.file.close()
+
+
+class ParquetWriter:
+    '''
+    Writes the results of every batch as a part file in a Parquet dataset directory,
+    removing any part written after the last checkpoint
+    '''
+
+    def __init__(self, path: str, checkpoint: dict):
+        # imported here so pyarrow is only needed to write Parquet
+        # pylint: disable=import-outside-toplevel,import-error
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        self.parquet = pyarrow.parquet
+        self.path = path
+        self.parts = checkpoint['parts'] if checkpoint else 0
+        if not all(os.path.isfile(os.path.join(path, f'part-{part:05d}.parquet'))
+                   for part in range(self.parts)):
+            raise ValueError(
+                f'{path} is missing results written before its checkpoint, '
+                'use --restart to overwrite it')
+        values = pyarrow.list_(pyarrow.float64())
+        self.schema = pyarrow.schema(
+            [('id', pyarrow.string()), ('code', pyarrow.int32()), ('message', pyarrow.string()),
+             ('score', pyarrow.int32())] + [(field, values) for field in SCORE_FIELDS]
+            + [('duplicates', pyarrow.list_(pyarrow.struct([
+                ('input', pyarrow.string()), ('duplicate_of', pyarrow.string()),
+                ('similarity', pyarrow.float64())])))])
+
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.startswith('part-') and int(name[5:10]) >= self.parts:
+                os.remove(os.path.join(path, name))
+
+    def write(self, records: list[dict]):
+        '''Write the results of a batch'''
+        part_path = os.path.join(self.path, f'part-{self.parts:05d}.parquet')
+        self.parquet.write_table(
+            self.pyarrow.Table.from_pylist(records, schema=self.schema), part_path + '.tmp')
+        os.replace(part_path + '.tmp', part_path)
+        self.parts += 1
+
+    def position(self) -> dict:
+        '''How many parts have been written'''
+        return {'parts': self.parts}
+
+    def close(self):
+        '''Nothing is left open between parts'''
+
+
+def create_writer(path: str, output_format: str, checkpoint: dict):
+    '''Create the writer of an output format'''
+    if output_format == 'parquet':
+        return ParquetWriter(path, checkpoint)
+
+    return JsonlWriter(path, checkpoint)
+
+
+class BulkScorer:
+    '''
+    Scores the rows of a manifest in batches. The documents of a batch are extracted and
+    featurised by a pool of processes while the batch before it goes through the networks,
+    and featurised documents are kept in an LRU cache so known sets shared by many rows are
+    only featurised once. At most two batches & the cache are held in memory at a time
+    '''
+
+    def __init__(self, manifest_dir: str, batch_size: int = 64, cache_size: int = 10000):
+        self.manifest_dir = manifest_dir
+        self.batch_size = max(1, batch_size)
+        self.cache = FeatureCache(cache_size)
+        self._pending = {}
+
+    def run(self, rows, executor, writer, on_batch=None, start: int = 0) -> int:
+        '''
+        Score rows, numbered from start, writing their results in order and calling
+        on_batch(rows done) after each batch is written. Returns the rows done
+        '''
+        done = start
+        previous = None
+        batches = iter(lambda: list(itertools.islice(rows, self.batch_size)), [])
+        for batch in itertools.chain(batches, [None]):
+            # featurise this batch while the previous one is scored
+            current = self.submit(
+                executor, batch, done + len(previous[0]) if previous else done) if batch else None
+            if previous:
+                writer.write(self.score(previous))
+                done += len(previous[0])
+                if on_batch is not None:
+                    on_batch(done)
+            previous = current
+
+        return done
+
+    def submit(self, executor, batch: list[dict], start: int) -> tuple[list, dict]:
+        '''
+        Queue the documents of every row which aren't cached or queued yet, returning the
+        (id, known (label, key), unknown keys) of every row and the cached features or
+        pending featurisation of every document
+        '''
+        rows = []
+        sources = {}
+        for number, row in enumerate(batch, start):
+            known = [
+                (f'known_texts[{i}]', self.document('text', text))
+                for i, text in enumerate(row.get('known_texts') or [])]
+            known += [
+                (f'known_files[{i}]', self.document('file', path))
+                for i, path in enumerate(row.get('known_files') or [])]
+            # like the API, the unknown text is used when the unknown file can't be read
+            unknown = []
+            if row.get('unknown_file'):
+                unknown.append(self.document('file', row['unknown_file']))
+            if row.get('unknown_text'):
+                unknown.append(self.document('text', row['unknown_text']))
+
+            for key, document in [document for _, document in known] + unknown:
+                if key is None or key in sources:
+                    continue
+                sources[key] = self.cache.get(key)
+                if sources[key] is None:
+                    if key not in self._pending:
+                        self._pending[key] = executor.submit(featurise, document)
+                    sources[key] = self._pending[key]
+
+            row_id = row.get('id')
+            rows.append((
+                str(number) if row_id is None else str(row_id),
+                [(label, key) for label, (key, _) in known if key is not None],
+                [key for key, _ in unknown if key is not None]))
+
+        return rows, sources
+
+    def document(self, kind: str, value: str) -> tuple:
+        '''
+        (cache key, document) of a text or of a file, keyed by its path & modification
+        so it isn't read to be keyed, with None as the key of a missing file
+        '''
+        if kind == 'text':
+            return document_key(value, models.version), (kind, value)
+
+        path = os.path.join(self.manifest_dir, value)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None, (kind, path)
+
+        return f'file:{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}', (kind, path)
+
+    def features(self, key: str, sources: dict, new_entries: dict) -> DocumentFeatures:
+        '''Features of a document, waiting for it to be featurised if needed'''
+        source = sources[key]
+        if isinstance(source, DocumentFeatures):
+            return source
+        if key in new_entries:
+            return new_entries[key]
+
+        # the batch before may have featurised the same document
+        self._pending.pop(key, None)
+        entry = self.cache.get(key)
+        if entry is None:
+            vectors = source.result()
+            if vectors is not None:
+                entry = new_entries[key] = ManifestDocument(*vectors)
+
+        return entry
+
+    def score(self, prepared: tuple[list, dict]) -> list[dict]:
+        '''Score the rows of a batch in one call of each network, in the Score Model'''
+        prepared_rows, sources = prepared
+        new_entries = {}
+        rows = []
+        for row_id, known_keys, unknown_keys in prepared_rows:
+            known = [
+                (label, self.features(key, sources, new_entries)) for label, key in known_keys]
+            known, duplicates = self.deduplicate(
+                [(label, entry) for label, entry in known if entry is not None])
+            unknown = [self.features(key, sources, new_entries) for key in unknown_keys]
+            rows.append((
+                row_id, known, [entry for entry in unknown if entry is not None][:1], duplicates))
+
+        # run every new document through the base network, then every pair through clf
+        embed_features(list(new_entries.values()))
+        for key, entry in new_entries.items():
+            self.cache.put(key, entry)
+
+        jobs = [(known, unknown) for _, known, unknown, _ in rows if known and unknown]
+        return self.finalise(rows, score_batch(jobs) if jobs else [])
+
+    @staticmethod
+    def deduplicate(known: list[tuple]) -> tuple[list, list[dict]]:
+        '''
+        Features of a row's known (label, document) without their near duplicates,
+        found like the API finds them, along with the inputs which were collapsed
+        '''
+        duplicates = find_duplicates(
+            [entry.digest for _, entry in known], Config.NEAR_DUPLICATE_THRESHOLD,
+            lambda position: known[position][1].signature)
+        collapsed = {position for position, _, _ in duplicates}
+        return [entry for position, (_, entry) in enumerate(known) if position not in collapsed], \
+            describe_duplicates([label for label, _ in known], duplicates)
+
+    @staticmethod
+    def finalise(rows: list[tuple], scores: list[float]) -> list[dict]:
+        '''Results of the (id, known features, unknown features, duplicates) of every row'''
+        scores = iter(scores)
+        records = []
+        for row_id, known, unknown, duplicates in rows:
+            if not known:
+                records.append(finalise_row(row_id, 2, None))
+            elif not unknown:
+                records.append(finalise_row(row_id, 3, None))
+            else:
+                known_style = get_style_dict(
+                    [entry.style_vec for entry in known], [entry.word_count for entry in known])
+                records.append(finalise_row(
+                    row_id, next(scores), compare_styles(known, unknown, known_style), duplicates))
+
+        return records
+
+
+def checkpoint_path(output: str) -> str:
+    '''File recording how far scoring into output got'''
+    return output.rstrip('/') + '.checkpoint.json'
+
+
+def read_checkpoint(output: str) -> dict:
+    '''Checkpoint of an interrupted run, or None to start from the beginning'''
+    try:
+        with open(checkpoint_path(output), encoding='UTF-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(output: str, checkpoint: dict):
+    '''Replace the checkpoint in one step so an interruption never leaves half of it'''
+    path = checkpoint_path(output)
+    with open(path + '.tmp', 'w', encoding='UTF-8') as file:
+        json.dump(checkpoint, file)
+    os.replace(path + '.tmp', path)
+
+
+def bulk_score(
+        manifest: str, output: str, *, manifest_format: str = 'jsonl',
+        output_format: str = 'jsonl', workers: int = None, batch_size: int = 64,
+        cache_size: int = 10000, restart: bool = False) -> dict:
+    '''
+    Score every row of a manifest into output, resuming after the rows
+    already written unless restart is set, and report what was done
+    '''
+    checkpoint = None if restart else read_checkpoint(output)
+    if checkpoint is not None and checkpoint['manifest'] != os.path.abspath(manifest):
+        raise ValueError(
+            f'{output} was scored from {checkpoint["manifest"]}, use --restart to overwrite it')
+    if checkpoint is not None and checkpoint.get('output_format') != output_format:
+        raise ValueError(
+            f'{output} was written as {checkpoint.get("output_format")}, '
+            'use --restart to overwrite it')
+
+    start = checkpoint['rows'] if checkpoint else 0
+    started = time.perf_counter()
+    scorer = BulkScorer(os.path.dirname(os.path.abspath(manifest)), batch_size, cache_size)
+    writer = create_writer(output, output_format, checkpoint)
+
+    # spawned rather than forked, as TensorFlow isn't fork-safe once loaded
+    with ProcessPoolExecutor(
+            workers or os.cpu_count(), mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker, initargs=(
+                Config.W2V_LOAD_MODE, Config.NEAR_DUPLICATE_PERMUTATIONS
+                if Config.NEAR_DUPLICATE_THRESHOLD > 0 else 0)) as executor:
+        try:
+            done = scorer.run(
+                itertools.islice(read_manifest(manifest, manifest_format), start, None),
+                executor, writer, lambda done: write_checkpoint(output, {
+                    'manifest': os.path.abspath(manifest), 'output_format': output_format,
+                    'rows': done, **writer.position()}),
+                start)
+        finally:
+            writer.close()
+
+    return {
+        'rows': done,
+        'resumed_from': start,
+        'seconds': time.perf_counter() - started,
+        'documents_cached': len(scorer.cache)
+    }
+
+
+def guess_format(path: str, formats: tuple, default: str) -> str:
+    '''Format of a file from its extension'''
+    extension = os.path.splitext(path.rstrip('/'))[1].lstrip('.').lower()
+    return extension if extension in formats else default
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Score a JSONL or CSV manifest of (known set, unknown) pairs into JSONL or '
+        'Parquet, resuming an interrupted run from its checkpoint')
+    parser.add_argument('manifest', help='Manifest of the pairs to score')
+    parser.add_argument('output', help='JSONL file or Parquet directory to write')
+    parser.add_argument(
+        '--manifest-format', choices=MANIFEST_FORMATS,
+        help='Format of the manifest (default from its extension, otherwise jsonl)')
+    parser.add_argument(
+        '--output-format', choices=OUTPUT_FORMATS,
+        help='Format of the output (default from its extension, otherwise jsonl)')
+    parser.add_argument(
+        '--workers', type=int, help='Processes featurising documents (default every core)')
+    parser.add_argument('--batch-size', type=int, default=64, help='Rows scored together')
+    parser.add_argument(
+        '--cache-size', type=int, default=10000, help='Featurised documents kept in memory')
+    parser.add_argument(
+        '--restart', action='store_true', help='Ignore the checkpoint and start over')
+    args = parser.parse_args()
+
+    print(json.dumps(bulk_score(
+        args.manifest, args.output,
+        manifest_format=args.manifest_format or guess_format(
+            args.manifest, MANIFEST_FORMATS, 'jsonl'),
+        output_format=args.output_format or guess_format(args.output, OUTPUT_FORMATS, 'jsonl'),
+        workers=args.workers, batch_size=args.batch_size, cache_size=args.cache_size,
+        restart=args.restart), indent=2))
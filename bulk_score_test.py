@@ -0,0 +1,178 @@
+'''Unit Testing for the bulk scoring CLI'''
+import os
+import json
+import tempfile
+import unittest
+from contextlib import ExitStack
+from application import app
+from bulk_score import (
+    SCORE_FIELDS, bulk_score, read_manifest, checkpoint_path, write_checkpoint)
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+try:
+    from pyarrow import parquet
+except ImportError:
+    parquet = None  # pylint: disable=invalid-name
+
+# rows scored in batches of 2, with known files shared between rows & relative paths
+MANIFEST = [
+    {'id': 'a', 'known_files': ['test_files/txt_test01.txt', 'test_files/docx_test01.docx'],
+     'unknown_file': 'test_files/pdf_test01.pdf'},
+    {'id': 'b', 'known_files': ['test_files/txt_test01.txt', 'test_files/docx_test01.docx'],
+     'unknown_file': 'test_files/txt_test02.txt'},
+    {'known_texts': ['This is a test. Another one!'], 'unknown_text': 'This is a test.'},
+    {'known_files': ['test_files/txt_test_EMPTY.txt'], 'unknown_text': 'This is a test.'},
+    {'known_texts': ['This is a test.'], 'unknown_file': 'test_files/missing.pdf'},
+    # the unknown text is used as the unknown file is empty & the last known file is collapsed
+    {'known_files': [
+        'test_files/txt_test01.txt', 'test_files/docx_test01.docx', 'test_files/docx_test02.docx'],
+     'unknown_file': 'test_files/txt_test_EMPTY.txt', 'unknown_text': 'This is a test.'}
+]
+
+
+def read_jsonl(path: str) -> list[dict]:
+    '''Every record of a JSONL file'''
+    with open(path, encoding='UTF-8') as file:
+        return [json.loads(line) for line in file]
+
+
+class BulkScoreTestCase(unittest.TestCase):
+    '''Class to test scoring a manifest offline'''
+
+    def setUp(self):
+        '''Write the manifest next to test_files/ so its relative paths resolve'''
+        self.directory = self.enterContext(tempfile.TemporaryDirectory(dir=BASE_DIR))
+        os.symlink(BASE_DIR+'/test_files', self.directory+'/test_files')
+        self.manifest = self.directory+'/manifest.jsonl'
+        with open(self.manifest, 'w', encoding='UTF-8') as file:
+            file.write(''.join(json.dumps(row) + '\n' for row in MANIFEST))
+        self.client = app.test_client()
+
+    def score(self, output: str, **kwargs) -> dict:
+        '''Score the manifest with one worker in batches of 2'''
+        return bulk_score(self.manifest, output, workers=1, batch_size=2, **kwargs)
+
+    def test_scores(self):
+        '''Every row must be scored like the /compare route, in the manifest's order'''
+        output = self.directory+'/scores.jsonl'
+        report = self.score(output)
+        records = read_jsonl(output)
+
+        self.assertEqual(report['rows'], len(MANIFEST))
+        self.assertEqual([record['id'] for record in records], ['a', 'b', '2', '3', '4', '5'])
+        self.assertEqual([record['code'] for record in records], [200, 200, 200, 400, 401, 200])
+        self.assertEqual(
+            [(duplicate['input'], duplicate['duplicate_of'])
+             for duplicate in records[5]['duplicates']],
+            [('known_files[2]', 'known_files[1]')])
+
+        for row, record in zip(MANIFEST, records):
+            if record['code'] != 200:
+                continue
+            with ExitStack() as files:
+                data = {'known_texts': row.get('known_texts', []), 'known_files': [
+                    files.enter_context(open(BASE_DIR+'/'+path, 'rb'))
+                    for path in row.get('known_files', [])]}
+                if 'unknown_file' in row:
+                    data['unknown_file'] = files.enter_context(
+                        open(BASE_DIR+'/'+row['unknown_file'], 'rb'))
+                if 'unknown_text' in row:
+                    data['unknown_text'] = row['unknown_text']
+                response = self.client.post(
+                    '/compare', data=data, content_type='multipart/form-data').json
+
+            self.assertEqual(set(response), set(SCORE_FIELDS) | {'score', 'duplicates'})
+            self.assertEqual(record['score'], response['score'])
+            self.assertEqual(record['duplicates'], response['duplicates'])
+            for key in SCORE_FIELDS:
+                self.assertEqual(len(record[key]), len(response[key]), key)
+                for value, expected in zip(record[key], response[key]):
+                    if expected is None:
+                        self.assertIsNone(value, key)
+                    else:
+                        self.assertAlmostEqual(value, expected, places=4, msg=key)
+
+    def test_resume(self):
+        '''An interrupted run must resume after its checkpoint, dropping what came after it'''
+        output = self.directory+'/scores.jsonl'
+        self.score(output)
+        expected = read_jsonl(output)
+
+        # interrupted after the first batch, part way through writing the second
+        with open(output, 'rb') as file:
+            first_batch = len(file.readline()) + len(file.readline())
+        with open(output, 'r+b') as file:
+            file.truncate(first_batch + 10)
+        write_checkpoint(output, {
+            'manifest': os.path.abspath(self.manifest), 'output_format': 'jsonl',
+            'rows': 2, 'bytes': first_batch})
+
+        report = self.score(output)
+        self.assertEqual(report['resumed_from'], 2)
+        self.assertEqual(read_jsonl(output), expected)
+
+        # a finished run has nothing left to do, unless restarted
+        self.assertEqual(self.score(output)['rows'], len(MANIFEST))
+        self.assertEqual(self.score(output, restart=True)['resumed_from'], 0)
+        self.assertEqual(read_jsonl(output), expected)
+        self.assertTrue(os.path.exists(checkpoint_path(output)))
+
+        # resuming into another format or from another manifest is refused
+        with self.assertRaisesRegex(ValueError, 'written as jsonl'):
+            self.score(output, output_format='parquet')
+        write_checkpoint(output, {
+            'manifest': os.path.abspath(self.manifest)+'.old', 'output_format': 'jsonl',
+            'rows': 2, 'bytes': first_batch})
+        with self.assertRaisesRegex(ValueError, 'was scored from'):
+            self.score(output)
+
+        # so is resuming into an output which lost results written before the checkpoint
+        write_checkpoint(output, {
+            'manifest': os.path.abspath(self.manifest), 'output_format': 'jsonl',
+            'rows': 2, 'bytes': first_batch})
+        with open(output, 'r+b') as file:
+            file.truncate(first_batch - 1)
+        with self.assertRaisesRegex(ValueError, 'missing results'):
+            self.score(output)
+        with open(output, 'rb') as file:
+            self.assertEqual(len(file.read()), first_batch - 1)
+        os.remove(output)
+        with self.assertRaisesRegex(ValueError, 'missing results'):
+            self.score(output)
+        self.assertEqual(self.score(output, restart=True)['resumed_from'], 0)
+        self.assertEqual(read_jsonl(output), expected)
+
+    def test_csv(self):
+        '''CSV manifests must be read like JSONL ones'''
+        csv_manifest = self.directory+'/manifest.csv'
+        with open(csv_manifest, 'w', encoding='UTF-8') as file:
+            file.write(
+                'id,known_files,known_texts,unknown_file,unknown_text\n'
+                'a,test_files/txt_test01.txt;test_files/docx_test01.docx,,'
+                'test_files/pdf_test01.pdf,\n'
+                ',,"This is a test. Another one!",,This is a test.\n')
+
+        rows = list(read_manifest(csv_manifest, 'csv'))
+        self.assertEqual(rows[0]['known_files'], MANIFEST[0]['known_files'])
+        self.assertEqual(rows[1]['known_texts'], MANIFEST[2]['known_texts'])
+        self.assertIsNone(rows[1]['id'])
+
+    @unittest.skipIf(parquet is None, 'pyarrow is needed to write Parquet')
+    def test_parquet(self):
+        '''Parquet output must hold the same records as JSONL output'''
+        self.score(self.directory+'/scores.jsonl')
+        self.score(self.directory+'/scores.parquet', output_format='parquet')
+
+        self.assertEqual(
+            parquet.read_table(self.directory+'/scores.parquet').to_pylist(),
+            read_jsonl(self.directory+'/scores.jsonl'))
+
+        # resuming is refused once a part written before the checkpoint is gone
+        os.remove(self.directory+'/scores.parquet/part-00000.parquet')
+        with self.assertRaisesRegex(ValueError, 'missing results'):
+            self.score(self.directory+'/scores.parquet', output_format='parquet')
+
+
+if __name__ == '__main__':
+    unittest.main()
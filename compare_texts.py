@@ -1,30 +1,133 @@
 ''' File with functions to compare texts using the models trained in the training phase '''
-import os
-from tensorflow import keras
 import numpy as np
-import gensim
-from functions import get_vectors
-from docu_functions import process_file
+from functions import get_text_vectors, get_style_dict
+from docu_functions import process_file, process_files, ExtractionPool
+from batching import MicroBatcher
+from config import Config
+from model_registry import ModelRegistry
+from feature_cache import FeatureCache, DocumentFeatures, document_key
+from author_profiles import create_profile_store
+from author_index import AuthorIndexer
+from near_duplicates import MinHasher, find_near_duplicates, describe_duplicates
+from metrics import metrics, span
 
-# initial folder path
-BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+# models are loaded on first use or when warmed up
+models = ModelRegistry(Config.W2V_LOAD_MODE, Config.INFERENCE_BACKEND)
 
-# load models
-word2vec_model = gensim.models.Word2Vec.load(
-    BASE_DIR+'/model_files/word2vec_model.model')
-base_network = keras.models.load_model(
-    BASE_DIR+'/model_files/base_network', compile=False)
-clf_network = keras.models.load_model(
-    BASE_DIR+'/model_files/clf_network', compile=False)
+# features of recently seen documents
+feature_cache = FeatureCache(
+    Config.FEATURE_CACHE_SIZE, Config.FEATURE_CACHE_DB or None
+) if Config.FEATURE_CACHE_SIZE > 0 else None
 
+# profiles of registered authors
+author_store = create_profile_store(Config.AUTHOR_PROFILE_DB or None)
 
-def compare_final_texts(known_text: list[str], unknown_text: list[str]) -> float:
-    '''Compares a list of known texts to an unknown text and returns a score'''
+# index of the registered authors, rebuilt when their profiles change
+author_indexer = AuthorIndexer(author_store, Config.AUTHOR_SEARCH_PROBES)
+
+# signatures of the known texts compared to find near duplicates
+min_hasher = MinHasher(Config.NEAR_DUPLICATE_PERMUTATIONS)
+
+# processes extracting multi-file uploads, started on first use
+extraction_pool = ExtractionPool(
+    Config.EXTRACT_WORKERS, Config.EXTRACT_TIMEOUT) if Config.EXTRACT_WORKERS > 0 else None
+
+if feature_cache is not None:
+    metrics.register_gauge(
+        'feature_cache_hits_total', lambda: feature_cache.hits,
+        'Documents whose features were found in the feature cache')
+    metrics.register_gauge(
+        'feature_cache_misses_total', lambda: feature_cache.misses,
+        'Documents whose features had to be extracted')
+    metrics.register_gauge(
+        'feature_cache_entries', lambda: len(feature_cache),
+        'Documents whose features are held in memory')
+
+
+def score_batch(jobs: list[tuple]) -> list[float]:
+    '''
+    Scores a batch of (known features, unknown features) jobs in one graph invocation,
+    filling in the base network features of documents which didn't have them yet
+    '''
+    new_entries = []
+    vectors = []
+    features = []
+    new_segment_ids = []
+    segment_ids = []
+    for i, (known, unknown) in enumerate(jobs):
+        for segment_id, entries in ((2*i, known), (2*i + 1, unknown)):
+            for entry in entries:
+                if entry.features is None:
+                    new_entries.append(entry)
+                    vectors.append(entry.vector)
+                    new_segment_ids.append(segment_id)
+                else:
+                    features.append(entry.features)
+                    segment_ids.append(segment_id)
+
+    with span('predict'):
+        scores, new_features = models.predict_scores(
+            np.array(vectors, dtype=np.float32).reshape(-1, models.input_size),
+            np.array(features, dtype=np.float32).reshape(-1, models.feature_size),
+            np.array(new_segment_ids + segment_ids, dtype=np.int32), len(jobs))
+    metrics.increment('inference_batches_total', 1, 'Batches run through the networks')
+    metrics.increment('inference_pairs_total', len(jobs), 'Pairs scored by the networks')
+
+    for entry, entry_features in zip(new_entries, np.asarray(new_features)):
+        entry.features = entry_features
+
+    return list(np.asarray(scores))
+
+
+# batches model inference from concurrent requests
+inference_batcher = MicroBatcher(
+    score_batch, Config.INFERENCE_BATCH_SIZE, Config.INFERENCE_BATCH_WINDOW)
 
-    # get word vectors using w2v model & style vectors
-    known_vec, known_w2v, known_style = get_vectors(known_text, word2vec_model)
-    unknown_vec, unknown_w2v, unknown_style = get_vectors(
-        unknown_text, word2vec_model)
+
+def get_text_features(texts: list[str]) -> tuple[list, list]:
+    '''
+    Gets the (document key, features) of each text, from the feature cache where possible.
+    Also returns the ones which aren't cached yet, which lack base network features
+    '''
+    documents = []
+    uncached = []
+    for text in texts:
+        key = document_key(text, models.version)
+        entry = feature_cache.get(key) if feature_cache is not None else None
+
+        if entry is None:
+            entry = DocumentFeatures(*get_text_vectors(text, models.word2vec_model))
+            uncached.append((key, entry))
+            metrics.increment(
+                'documents_processed_total', 1, 'Documents whose features were extracted')
+
+        documents.append((key, entry))
+
+    return documents, uncached
+
+
+def embed_features(entries: list[DocumentFeatures]):
+    '''Fills in the base network features of documents in one graph invocation'''
+    if entries:
+        with span('embed'):
+            features = models.embed(
+                np.array([entry.vector for entry in entries], dtype=np.float32))
+        for entry, entry_features in zip(entries, np.asarray(features)):
+            entry.features = entry_features
+
+
+def cache_features(documents: list[tuple]):
+    '''Caches the (document key, features) of documents which have base network features'''
+    if feature_cache is not None:
+        for key, entry in documents:
+            feature_cache.put(key, entry)
+
+
+def compare_styles(
+        known: list[DocumentFeatures], unknown: list[DocumentFeatures], known_style: dict) -> dict:
+    '''Style values of the known & unknown texts side by side, with their word vector distance'''
+    unknown_style = get_style_dict(
+        [entry.style_vec for entry in unknown], [entry.word_count for entry in unknown])
 
     # create dictionary to compare style vectors between known and unknown texts
     style_dict = {
@@ -33,24 +136,42 @@ def compare_final_texts(known_text: list[str], unknown_text: list[str]) -> float
     }
 
     # word vector distances
-    w2v_dist = np.linalg.norm(known_w2v - unknown_w2v, axis=0)
+    w2v_dist = np.linalg.norm(known[-1].w2v_vec - unknown[-1].w2v_vec, axis=0)
     style_dict['w_sim'] = 100*w2v_dist
 
-    # use word vectors to get feature vectors using base network model
-    known_feature_vectors = base_network.predict(
-        np.array(known_vec), verbose=0)
-    unknown_feature_vectors = base_network.predict(
-        np.array(unknown_vec), verbose=0)
+    return style_dict
 
-    # get representations
-    author_representation = np.mean(known_feature_vectors, axis=0)
-    unknown_representation = np.mean(unknown_feature_vectors, axis=0)
 
-    # use representations to get prediction using clf network model
-    my_pred = clf_network.predict(np.array(
-        [np.concatenate((author_representation, unknown_representation), axis=None)]))
+def score_text_features(
+        known: list[DocumentFeatures], unknown: list[DocumentFeatures],
+        known_style: dict) -> tuple[float, dict]:
+    '''Scores the features of known texts against the features of an unknown text'''
+    style_dict = compare_styles(known, unknown, known_style)
+
+    # use word vectors to get the score, batched with concurrent requests
+    with span('inference'):
+        score = inference_batcher.run((known, unknown))
 
-    return my_pred[0][0], style_dict
+    return score, style_dict
+
+
+def compare_final_texts(known_text: list[str], unknown_text: list[str]) -> float:
+    '''Compares a list of known texts to an unknown text and returns a score'''
+
+    # get word vectors using w2v model & style vectors
+    known, known_uncached = get_text_features(known_text)
+    unknown, unknown_uncached = get_text_features(unknown_text)
+    known = [entry for _, entry in known]
+    unknown = [entry for _, entry in unknown]
+    known_style = get_style_dict(
+        [entry.style_vec for entry in known], [entry.word_count for entry in known])
+
+    score, style_dict = score_text_features(known, unknown, known_style)
+
+    # cache the features, which now include the base network features
+    cache_features(known_uncached + unknown_uncached)
+
+    return score, style_dict
 
 
 def compare_string_texts(known_text: str, unknown_text: str) -> float:
@@ -63,6 +184,64 @@ def compare_list_texts(known_texts: list[str], unknown_text: str) -> float:
     return compare_final_texts(known_texts, [unknown_text])
 
 
+def count_extracted(texts: list[str]) -> list[str]:
+    '''Counts the files & bytes of text extracted from uploads'''
+    metrics.increment('files_extracted_total', len(texts), 'Uploaded files read')
+    metrics.increment(
+        'bytes_extracted_total', sum(len(text.encode('UTF-8')) for text in texts if text),
+        'Bytes of UTF-8 text extracted from uploaded files')
+    return texts
+
+
+def read_known_texts(known_files, known_texts: list[str]) -> tuple[list[str], list[dict]]:
+    '''
+    Reads a mix of known texts and files into a list of non-empty texts without
+    near duplicates, along with the inputs which were collapsed into an earlier one
+    '''
+    known_texts = list(known_texts or [])
+    labels = [f'known_texts[{i}]' for i in range(len(known_texts))]
+
+    if known_files:
+        # add known texts from files
+        with span('extract'):
+            known_texts += count_extracted(process_files(known_files, extraction_pool))
+        labels += [f'known_files[{i}]' for i in range(len(known_texts) - len(labels))]
+
+    # remove empty texts
+    inputs = [(label, text) for label, text in zip(labels, known_texts) if (
+        text and not text.isspace())]
+
+    # remove duplicates, before any of them is featurised
+    with span('deduplicate'):
+        duplicates = find_near_duplicates(
+            [text for _, text in inputs], Config.NEAR_DUPLICATE_THRESHOLD, min_hasher)
+    metrics.increment(
+        'known_duplicates_total', len(duplicates),
+        'Known texts collapsed into a duplicate provided before them')
+
+    collapsed = {position for position, _, _ in duplicates}
+    return [text for position, (_, text) in enumerate(inputs) if position not in collapsed], \
+        describe_duplicates([label for label, _ in inputs], duplicates)
+
+
+def read_unknown_text(unknown_file=None, unknown_text: str = None) -> str:
+    '''Reads the unknown text, where the unknown file takes priority, or None if it is empty'''
+    # check if unknown text was provided
+    if unknown_file:
+        with span('extract'):
+            unknown_text2, = count_extracted([process_file(unknown_file)])
+
+        # check if unknown file is not empty
+        if unknown_text2:
+            unknown_text = unknown_text2
+
+    # make sure unknown text is not empty or just whitespaces
+    if not unknown_text or unknown_text.isspace():
+        return None
+
+    return unknown_text
+
+
 def compare_mix_texts(
         known_files, known_texts: list[str],
         unknown_file=None, unknown_text: str = None) -> float:
@@ -71,33 +250,154 @@ def compare_mix_texts(
     if (not known_texts and not known_files) or (len(known_texts) == 0 and len(known_files) == 0):
         return 2, None
 
-    if len(known_files) > 0:
-        # add known texts from files
-        known_texts += [process_file(known_file) for known_file in known_files]
+    known_texts, duplicates = read_known_texts(known_files, known_texts)
 
-    # remove empty texts
-    known_texts = [text for text in known_texts if (
-        text and not text.isspace())]
-    # remove duplicates
-    known_texts = list(dict.fromkeys(known_texts))
+    # check if known texts were provided
+    if len(known_texts) == 0:
+        return 2, None
+
+    unknown_text = read_unknown_text(unknown_file, unknown_text)
+    if not unknown_text:
+        return 3, None
+
+    score, style_dict = compare_final_texts(known_texts, [unknown_text])
+    style_dict['duplicates'] = duplicates
+    return score, style_dict
+
+
+def add_author_texts(author_id: str, known_files, known_texts: list[str]) -> tuple:
+    '''
+    Adds a mix of known texts and files to an author's profile, returning the
+    number of new documents added and the updated profile
+    '''
+    known_texts, _ = read_known_texts(known_files, known_texts)
 
     # check if known texts were provided
     if len(known_texts) == 0:
         return 2, None
 
-    # check if unknown text was provided
-    if unknown_file:
-        unknown_text2 = process_file(unknown_file)
+    documents, uncached = get_text_features(known_texts)
+    embed_features([entry for _, entry in uncached])
+    cache_features(uncached)
 
-        # check if unknown file is not empty
-        if unknown_text2:
-            unknown_text = unknown_text2
+    added = author_store.add_documents(author_id, documents)
+    return added, author_store.get(author_id)
+
+
+def compare_author_texts(
+        author_id: str, unknown_file=None, unknown_text: str = None) -> float:
+    '''Compares an unknown text to the stored profile of an author and returns a score'''
+    profile = author_store.get(author_id)
 
+    # check the author is registered and has known texts
+    if profile is None:
+        return 5, None
+    if profile.document_count == 0:
+        return 2, None
+
+    unknown_text = read_unknown_text(unknown_file, unknown_text)
     if not unknown_text:
         return 3, None
 
-    # make sure unknown text is not empty or just whitespaces
-    if unknown_text.isspace():
+    unknown, uncached = get_text_features([unknown_text])
+    score, style_dict = score_text_features(
+        [profile.mean_features()], [entry for _, entry in unknown], profile.style_dict())
+    cache_features(uncached)
+
+    return score, style_dict
+
+
+def compare_batch_texts(
+        known_sets: list[list[str]], author_ids: list[str],
+        unknown_texts: list[str], pairs: bool = False) -> tuple:
+    '''
+    Scores many unknown texts against many authors, given as sets of known texts
+    and/or IDs of stored profiles. Every unique text is featurised once, then all
+    new documents go through the base network and all pairs through the clf network
+    in one batch each. Returns an error code (0 if there is none) and a matrix of
+    scores with a row per unknown text and a column per author, or a single column
+    scoring each unknown text against the author at the same position when pairs is set
+    '''
+    known_sets = [read_known_texts(None, known_texts)[0] for known_texts in known_sets]
+    profiles = [author_store.get(author_id) for author_id in author_ids]
+    unknown_texts = [read_unknown_text(None, text) for text in unknown_texts]
+
+    # check every author is registered & has known texts and every unknown text isn't empty
+    if any(profile is None for profile in profiles):
+        return 5, None
+    if not known_sets + profiles or any(
+            not known_texts for known_texts in known_sets) or any(
+                profile.document_count == 0 for profile in profiles):
+        return 2, None
+    if not unknown_texts or any(text is None for text in unknown_texts):
         return 3, None
+    if pairs and len(known_sets) + len(profiles) != len(unknown_texts):
+        return 4, None
 
-    return compare_final_texts(known_texts, [unknown_text])
+    # featurise every unique text once
+    texts = list(dict.fromkeys(
+        [text for known_texts in known_sets for text in known_texts] + unknown_texts))
+    documents, uncached = get_text_features(texts)
+    embed_features([entry for _, entry in uncached])
+    cache_features(uncached)
+    features = {text: entry.features for text, (_, entry) in zip(texts, documents)}
+
+    # get representations
+    author_representations = np.array(
+        [np.mean([features[text] for text in known_texts], axis=0) for known_texts in known_sets]
+        + [profile.mean_features().features for profile in profiles], dtype=np.float32)
+    unknown_representations = np.array(
+        [features[text] for text in unknown_texts], dtype=np.float32)
+
+    # pair up representations as [author, unknown]
+    if pairs:
+        pair_vectors = np.concatenate(
+            (author_representations, unknown_representations), axis=1)
+    else:
+        pair_vectors = np.concatenate((
+            np.tile(author_representations, (len(unknown_texts), 1)),
+            np.repeat(unknown_representations, len(author_representations), axis=0)), axis=1)
+
+    scores = np.asarray(models.classify(pair_vectors))
+    return 0, scores.reshape(len(unknown_texts), -1)
+
+
+def identify_author(
+        unknown_file=None, unknown_text: str = None, top_k: int = 5,
+        candidates: int = Config.AUTHOR_SEARCH_CANDIDATES,
+        method: str = Config.AUTHOR_SEARCH) -> tuple:
+    '''
+    Finds the registered authors most likely to have written an unknown text. The author
+    index shortlists the candidates whose representations are closest to the text, and only
+    they are scored by the clf network. Returns an error code (0 if there is none) and the
+    top_k (author ID, name, score) from highest to lowest, the number of authors
+    shortlisted and the number indexed
+    '''
+    index = author_indexer.get()
+
+    # check there are authors with known texts
+    if len(index) == 0:
+        return 2, None
+
+    unknown_text = read_unknown_text(unknown_file, unknown_text)
+    if not unknown_text:
+        return 3, None
+
+    documents, uncached = get_text_features([unknown_text])
+    embed_features([entry for _, entry in uncached])
+    cache_features(uncached)
+    features = documents[0][1].features
+
+    with span('search'):
+        shortlist = index.search(features, max(top_k, candidates), method)
+
+    # pair up the candidates' representations with the unknown text as [author, unknown]
+    with span('rescore'):
+        scores = np.asarray(models.classify(np.concatenate((
+            index.representations[shortlist],
+            np.tile(np.asarray(features, dtype=np.float32), (len(shortlist), 1))), axis=1)))
+
+    ranking = [
+        (index.author_ids[shortlist[i]], index.names[shortlist[i]], float(scores[i]))
+        for i in np.argsort(-scores, kind='stable')[:top_k]]
+    return 0, (ranking, len(shortlist), len(index))
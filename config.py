@@ -8,9 +8,86 @@ class Config:
     ''' Standard configuration settings for the flask app '''
     SECRET_KEY = config('SECRET_KEY')
     SQLACADEMY_TRACK_MODFICATIONS=config('SQLACADEMY_TRACK_MODFICATIONS',cast=bool)
+    # max requests scored together and seconds to wait for more to arrive
+    INFERENCE_BATCH_SIZE = config('INFERENCE_BATCH_SIZE', default=32, cast=int)
+    INFERENCE_BATCH_WINDOW = config('INFERENCE_BATCH_WINDOW', default=0.0, cast=float)
+    # run the networks with TensorFlow ('keras') or exported weights & NumPy ('numpy')
+    INFERENCE_BACKEND = config('INFERENCE_BACKEND', default='keras')
+    # 'full' Word2Vec model, exported vectors only shared through 'mmap'
+    # or exported compact 'float16' or 'int8' vectors
+    W2V_LOAD_MODE = config('W2V_LOAD_MODE', default='full')
+    # documents whose features are kept in memory (0 disables the cache)
+    # and optional SQLite file keeping them on disk
+    FEATURE_CACHE_SIZE = config('FEATURE_CACHE_SIZE', default=1024, cast=int)
+    FEATURE_CACHE_DB = config('FEATURE_CACHE_DB', default='')
+    # SQLite file keeping author profiles, otherwise they are kept in memory
+    AUTHOR_PROFILE_DB = config('AUTHOR_PROFILE_DB', default='')
+    # how the author index shortlists the authors closest to a text ('ivf' or 'exact'),
+    # authors shortlisted to be rescored and IVF lists scanned by every search
+    AUTHOR_SEARCH = config('AUTHOR_SEARCH', default='ivf')
+    AUTHOR_SEARCH_CANDIDATES = config('AUTHOR_SEARCH_CANDIDATES', default=50, cast=int)
+    AUTHOR_SEARCH_PROBES = config('AUTHOR_SEARCH_PROBES', default=8, cast=int)
+    # estimated share of word shingles two known texts must have in common for the later
+    # one to be dropped as a near duplicate (0 only drops exact duplicates)
+    # and the MinHash permutations it is estimated with
+    NEAR_DUPLICATE_THRESHOLD = config('NEAR_DUPLICATE_THRESHOLD', default=0.9, cast=float)
+    NEAR_DUPLICATE_PERMUTATIONS = config('NEAR_DUPLICATE_PERMUTATIONS', default=128, cast=int)
+    # max (author, unknown text) pairs scored by one batch request
+    BATCH_MAX_PAIRS = config('BATCH_MAX_PAIRS', default=10000, cast=int)
+    # pages & characters extracted from an uploaded file (0 for no limit)
+    EXTRACT_MAX_PAGES = config('EXTRACT_MAX_PAGES', default=1000, cast=int)
+    EXTRACT_MAX_CHARS = config('EXTRACT_MAX_CHARS', default=2000000, cast=int)
+    # processes extracting uploaded files in parallel (0 extracts them in the request)
+    # and seconds a worker may spend reading a file before it is treated as unreadable
+    EXTRACT_WORKERS = config('EXTRACT_WORKERS', default=2, cast=int)
+    EXTRACT_TIMEOUT = config('EXTRACT_TIMEOUT', default=30.0, cast=float)
+    # threads running background comparison jobs, optional SQLite file sharing
+    # their state between processes and seconds finished jobs are kept for
+    JOB_WORKERS = config('JOB_WORKERS', default=2, cast=int)
+    JOB_DB = config('JOB_DB', default='')
+    JOB_TTL = config('JOB_TTL', default=3600.0, cast=float)
+    # report the time spent in each stage of a request in its Server-Timing header
+    SERVER_TIMING = config('SERVER_TIMING', default=False, cast=bool)
+    # admin token which profiles a /compare request when sent in its X-Profile-Token
+    # header (unset disables profiling) and folder the pstats files are stored in
+    PROFILE_TOKEN = config('PROFILE_TOKEN', default='')
+    PROFILE_DIR = config('PROFILE_DIR', default=os.path.join(BASE_DIR, 'profiles'))
+    # threads running comparisons in the ASGI app, comparisons waiting for a thread
+    # before it answers 503 and max bytes of a request body it reads
+    ASYNC_COMPARE_WORKERS = config('ASYNC_COMPARE_WORKERS', default=4, cast=int)
+    ASYNC_COMPARE_QUEUE = config('ASYNC_COMPARE_QUEUE', default=16, cast=int)
+    MAX_UPLOAD_BYTES = config('MAX_UPLOAD_BYTES', default=50 * 1024 * 1024, cast=int)
+    # uploads the ASGI app reads or holds at once before it answers 503 and bytes
+    # of the files of an upload held in memory before the rest are written to disk
+    ASYNC_MAX_UPLOADS = config('ASYNC_MAX_UPLOADS', default=256, cast=int)
+    ASYNC_SPOOL_BYTES = config('ASYNC_SPOOL_BYTES', default=1024 * 1024, cast=int)
+    # load & warm up the models in the background as soon as the app starts
+    WARM_UP_ON_START = config('WARM_UP_ON_START', default=True, cast=bool)
 
 class DevConfig(Config):
     ''' Developer configuration settings for the flask app '''
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASE_DIR, 'dev.db')
     DEBUG = True
     SQLALCHEMY_ECHO = True
+
+class ProdConfig(Config):
+    ''' Production configuration settings for the flask app served by gunicorn '''
+    DEBUG = False
+    # each worker warms up once forked, after the master has loaded the word vectors
+    WARM_UP_ON_START = False
+    # address, worker processes, threads per worker and seconds before a worker is restarted
+    BIND = config('BIND', default='0.0.0.0:8000')
+    WEB_WORKERS = config('WEB_WORKERS', default=os.cpu_count() or 1, cast=int)
+    WEB_THREADS = config('WEB_THREADS', default=4, cast=int)
+    WEB_TIMEOUT = config('WEB_TIMEOUT', default=120, cast=int)
+    # TensorFlow threads of every worker, splitting the cores between the workers
+    TF_INTRA_OP_THREADS = config(
+        'TF_INTRA_OP_THREADS', default=max(1, (os.cpu_count() or 1) // WEB_WORKERS), cast=int)
+    TF_INTER_OP_THREADS = config('TF_INTER_OP_THREADS', default=1, cast=int)
+
+# configuration used for each APP_ENV
+CONFIGS = {'development': DevConfig, 'production': ProdConfig}
+
+def get_config():
+    ''' Configuration of the environment set in APP_ENV '''
+    return CONFIGS[config('APP_ENV', default='development')]
@@ -1,42 +1,302 @@
 ''' Functions for Document Processing and Response Simplification '''
+import os
+import io
+import re
+import queue
+import zipfile
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import xml.etree.ElementTree as ET
 import fitz
-import docx2txt
+from config import Config
 
-def read_pdf(file):
-    '''Extract text from .pdf file '''
-    text = ""
+# parts of a .docx file read around word/document.xml, as docx2txt does
+DOCX_HEADERS = 'word/header[0-9]*.xml'
+DOCX_FOOTERS = 'word/footer[0-9]*.xml'
+
+# tags of the docx xml which are turned into text
+W_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DOCX_TEXT = W_NAMESPACE+'t'
+DOCX_PARAGRAPH = W_NAMESPACE+'p'
+DOCX_BREAKS = {W_NAMESPACE+'tab': '\t', W_NAMESPACE+'br': '\n',
+               W_NAMESPACE+'cr': '\n', DOCX_PARAGRAPH: '\n\n'}
+
+
+class TextBuffer:
+    '''Collects pieces of text until max_chars characters (0 for no limit)'''
+
+    def __init__(self, max_chars: int = 0):
+        self.max_chars = max_chars
+        self.length = 0
+        self._pieces = []
+
+    @property
+    def full(self) -> bool:
+        '''Whether the character limit has been reached'''
+        return 0 < self.max_chars <= self.length
+
+    def write(self, text: str):
+        '''Add a piece of text'''
+        self._pieces.append(text)
+        self.length += len(text)
+
+    def getvalue(self) -> str:
+        '''The collected text, cut to the character limit'''
+        text = ''.join(self._pieces)
+        return text[:self.max_chars] if self.max_chars else text
+
+
+class StoredFile:
+    '''Copy of an uploaded file in memory or a temporary file, read after its request ends'''
+
+    def __init__(self, filename: str, data):
+        '''data is the contents of the file, or a binary file holding them from its start'''
+        self.filename = filename
+        self.stream = io.BytesIO(data) if isinstance(data, bytes) else data
+
+    @classmethod
+    def from_upload(cls, file):
+        '''Copy an uploaded file'''
+        return cls(file.filename, file.read())
+
+    def read(self, size: int = -1) -> bytes:
+        '''Read the file contents'''
+        return self.stream.read(size)
+
+    def close(self):
+        '''Free the file contents'''
+        self.stream.close()
+
+
+def open_pdf(file):
+    '''Open an uploaded .pdf file, from disk when it has a path so pages are read as needed'''
+    stream = getattr(file, 'stream', file)
+    path = getattr(stream, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return fitz.open(path, filetype='pdf')
+
+    return fitz.open(stream=stream.read(), filetype='pdf')
+
+
+def read_pdf(file, max_pages: int = Config.EXTRACT_MAX_PAGES,
+             max_chars: int = Config.EXTRACT_MAX_CHARS):
+    '''Extract text from .pdf file page by page, up to max_pages & max_chars (0 for no limit)'''
+    text = TextBuffer(max_chars)
     try:
-        pdf_file = fitz.open(stream=file.read(), filetype="pdf")
-        for page in pdf_file:
-            text += page.get_text()
+        with open_pdf(file) as pdf_file:
+            for page_number, page in enumerate(pdf_file):
+                if text.full or (max_pages and page_number >= max_pages):
+                    break
+                text.write(page.get_text())
     except:
         return None
-    return text
+    return text.getvalue()
+
+
+def read_docx_part(part, text: TextBuffer):
+    '''Stream the text of one xml part of a .docx file, as docx2txt extracts it'''
+    for event, element in ET.iterparse(part, events=('start', 'end')):
+        if event == 'start':
+            if element.tag in DOCX_BREAKS:
+                text.write(DOCX_BREAKS[element.tag])
+        elif element.tag == DOCX_TEXT:
+            text.write(element.text or '')
+        elif element.tag == DOCX_PARAGRAPH:
+            element.clear()  # drop paragraphs once read so memory stays flat
+
+        if text.full:
+            return
 
 
-def read_doc(file):
-    '''Extract text from .doc & .docx file'''
+def read_doc(file, max_chars: int = Config.EXTRACT_MAX_CHARS):
+    '''
+    Extract text from .doc & .docx file up to max_chars (0 for no limit),
+    streaming the headers, main document & footers without touching images
+    '''
+    text = TextBuffer(max_chars)
     try:
-        text = docx2txt.process(file)
+        with zipfile.ZipFile(getattr(file, 'stream', file)) as docx_file:
+            names = docx_file.namelist()
+            parts = [name for name in names if re.match(DOCX_HEADERS, name)] + \
+                ['word/document.xml'] + [name for name in names if re.match(DOCX_FOOTERS, name)]
+            for name in parts:
+                if text.full:
+                    break
+                with docx_file.open(name) as part:
+                    read_docx_part(part, text)
     except:
         return None
-    return text
+    return text.getvalue().strip()
 
 
-def process_file(file):
-    '''Process files based on its type'''
+def read_txt(file, max_chars: int = Config.EXTRACT_MAX_CHARS):
+    '''Decode text from .txt file up to max_chars (0 for no limit)'''
+    stream = None
+    try:
+        stream = io.TextIOWrapper(getattr(file, 'stream', file), encoding='UTF-8', newline='')
+        return stream.read(max_chars or -1)
+    except (UnicodeDecodeError, ValueError, OSError, AttributeError):
+        return None
+    finally:
+        if stream is not None:
+            stream.detach()
+
+
+def read_file(filename: str, file):
+    '''Extract text from a file based on the type in its filename'''
     text = None
-    if file.filename.endswith(".pdf"):
+    if filename.endswith(".pdf"):
         text = read_pdf(file)
-    if file.filename.endswith(".docx"):
+    if filename.endswith(".docx"):
         text = read_doc(file)
-    if file.filename.endswith(".txt"):
+    if filename.endswith(".txt"):
+        text = read_txt(file)
+
+    return text
+
+
+def process_file(file):
+    '''Process files based on its type'''
+    return read_file(file.filename, file)
+
+
+def extract_bytes(filename: str, data: bytes):
+    '''Extract text from the contents of a file, run in the extraction pool's processes'''
+    return read_file(filename, io.BytesIO(data))
+
+
+def run_extraction_worker(connection):
+    '''Extract the files sent through connection one at a time, until it is closed'''
+    connection.send(None)  # ready
+    while True:
+        try:
+            filename, data = connection.recv()
+        except EOFError:
+            return
+        try:
+            text = extract_bytes(filename, data)
+        except Exception:  # pylint: disable=broad-except
+            text = None
+        connection.send(text)
+
+
+class ExtractionWorker:
+    '''Spawned process extracting one file at a time, which can be stopped if stuck on one'''
+
+    def __init__(self):
+        # spawned so it doesn't inherit the models & threads of the app
+        context = multiprocessing.get_context('spawn')
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=run_extraction_worker, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+        try:
+            self.connection.recv()
+        except EOFError:
+            self.stop()
+            raise
+
+    def extract(self, filename: str, data: bytes, timeout: float):
+        '''
+        Extract the text of a file, raising TimeoutError if it takes over timeout seconds
+        or EOFError if the process died reading it
+        '''
+        self.connection.send((filename, data))
+        if not self.connection.poll(timeout):
+            raise TimeoutError(f'{filename} was not read within {timeout} seconds')
+        return self.connection.recv()
+
+    def stop(self):
+        '''Terminate the process, whatever it is doing'''
+        self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+
+class ExtractionPool:
+    '''
+    Processes shared between requests which extract the text of many files at once,
+    so CPU-bound parsing isn't serialised within a request or by the GIL. Files are
+    queued in order across requests and handed to a worker process once one is free
+    '''
+
+    def __init__(self, max_workers: int = 2, timeout: float = 30.0):
+        '''
+        timeout is how long (in seconds) a worker may spend on a file, from when it starts
+        reading it, after which the file is treated as unreadable and only that worker is
+        terminated, as it can't be interrupted and would otherwise stay stuck on the file
+        '''
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._threads = None
+        self._workers = None
+        self._pid = None
+
+    def map(self, files, timeout: float = None) -> list:
+        '''
+        Extract the text of every file in order, with None for files which can't be read,
+        giving each file timeout seconds (the pool's timeout by default)
+        '''
+        threads, workers = self._start()
+        timeout = self.timeout if timeout is None else timeout
+        futures = [
+            threads.submit(self._extract, workers, file.filename, file.read(), timeout)
+            for file in files]
+
+        texts = []
+        for future in futures:
+            try:
+                texts.append(future.result())
+            except Exception:  # pylint: disable=broad-except
+                texts.append(None)
+        return texts
+
+    def _start(self) -> tuple:
+        '''
+        Start the threads handing out files on first use (and again in forked processes),
+        one per worker process, which are started when first needed
+        '''
+        with self._lock:
+            if self._pid != os.getpid() or self._threads is None:
+                self._threads = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix='extraction')
+                self._workers = queue.SimpleQueue()
+                for _ in range(self.max_workers):
+                    self._workers.put(None)
+                self._pid = os.getpid()
+            return self._threads, self._workers
+
+    @staticmethod
+    def _extract(workers: queue.SimpleQueue, filename: str, data: bytes, timeout: float):
+        '''
+        Extract a file with a free worker, replacing the worker if it timed out or died,
+        which doesn't affect the files of other requests as they are still queued
+        '''
+        # there is a worker (or a slot to start one) for each thread, so this never waits
+        worker = workers.get()
         try:
-            text = file.read().decode('UTF-8')
-        except:
+            if worker is None:
+                worker = ExtractionWorker()
+            return worker.extract(filename, data, timeout)
+        except (TimeoutError, EOFError, OSError):
+            if worker is not None:
+                worker.stop()
+                worker = None
             return None
+        finally:
+            workers.put(worker)
 
-    return text
+
+def process_files(files, pool: ExtractionPool = None) -> list:
+    '''Process many files in order, in parallel when given a pool'''
+    files = list(files)
+    if pool is None or len(files) < 2:
+        return [process_file(file) for file in files]
+
+    return pool.map(files)
 
 
 def proportion(val1: float, val2: float) -> float:
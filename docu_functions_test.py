@@ -0,0 +1,144 @@
+'''Unit Testing for the document processing functions'''
+import io
+import os
+import multiprocessing
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import fitz
+import docx2txt
+from docu_functions import (
+    read_pdf, read_doc, read_txt, process_files, ExtractionPool, StoredFile)
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def read_pdf_whole(file):
+    '''read_pdf as it was before extracting page by page'''
+    text = ""
+    try:
+        pdf_file = fitz.open(stream=file.read(), filetype="pdf")
+        for page in pdf_file:
+            text += page.get_text()
+    except:
+        return None
+    return text
+
+
+def read_doc_whole(file):
+    '''read_doc as it was before streaming the docx parts'''
+    try:
+        text = docx2txt.process(file)
+    except:
+        return None
+    return text
+
+
+def read_txt_whole(file):
+    '''read_txt as it was before decoding up to a limit'''
+    try:
+        return file.read().decode('UTF-8')
+    except:
+        return None
+
+
+class ExtractionTestCase(unittest.TestCase):
+    '''Class to test extracting text from the test_files'''
+    readers = {
+        '.pdf': (read_pdf, read_pdf_whole),
+        '.docx': (read_doc, read_doc_whole),
+        '.txt': (read_txt, read_txt_whole)
+    }
+
+    def test_same_text(self):
+        '''Text must match the one extracted from the whole file, including corrupt files'''
+        for name in sorted(os.listdir(BASE_DIR+'/test_files')):
+            extension = os.path.splitext(name)[1]
+            if extension not in self.readers:
+                continue
+
+            reader, whole_reader = self.readers[extension]
+            with self.subTest(name=name), \
+                    open(BASE_DIR+'/test_files/'+name, 'rb') as file, \
+                    open(BASE_DIR+'/test_files/'+name, 'rb') as whole_file:
+                self.assertEqual(reader(file), whole_reader(whole_file))
+
+    def test_unreadable_txt(self):
+        '''Text files which can't be decoded or read must be None rather than raise'''
+        self.assertIsNone(read_txt(io.BytesIO(b'\xff\xfe not UTF-8 \x80')))
+        closed = io.BytesIO(b'This is a test.')
+        closed.close()
+        self.assertIsNone(read_txt(closed))
+        self.assertIsNone(read_txt(object()))
+        self.assertEqual(read_txt(io.BytesIO(b'This is a test.')), 'This is a test.')
+
+    def test_limits(self):
+        '''Extraction must stop at the page & character limits'''
+        with open(BASE_DIR+'/test_files/pdf_test01.pdf', 'rb') as file:
+            with fitz.open(stream=file.read(), filetype='pdf') as pdf_file:
+                first_page = pdf_file[0].get_text()
+            file.seek(0)
+            self.assertEqual(read_pdf(file, max_pages=1), first_page)
+            file.seek(0)
+            self.assertEqual(read_pdf(file, max_chars=100), first_page[:100])
+
+        with open(BASE_DIR+'/test_files/docx_test01.docx', 'rb') as file:
+            text = read_doc(file, max_chars=100)
+            file.seek(0)
+            self.assertLessEqual(len(text), 100)
+            self.assertTrue(read_doc_whole(file).startswith(text))
+
+        with open(BASE_DIR+'/test_files/txt_test01.txt', 'rb') as file:
+            text = read_txt(file, max_chars=100)
+            file.seek(0)
+            self.assertEqual(text, read_txt_whole(file)[:100])
+
+
+def stored_file(path: str) -> StoredFile:
+    '''Hold a test file in memory as if it were uploaded'''
+    with open(path, 'rb') as file:
+        return StoredFile(os.path.basename(path), file.read())
+
+
+class ExtractionPoolTestCase(unittest.TestCase):
+    '''Class to test extracting many files in parallel'''
+
+    def test_same_texts(self):
+        '''Pooled extraction must return the same texts in order, with None for corrupt files'''
+        names = sorted(os.listdir(BASE_DIR+'/test_files'))
+        paths = [BASE_DIR+'/test_files/'+name for name in names]
+        expected = process_files(stored_file(path) for path in paths)
+        self.assertIn(None, expected)
+
+        pool = ExtractionPool(2, timeout=60)
+        self.assertEqual(process_files((stored_file(path) for path in paths), pool), expected)
+        self.assertEqual(process_files((stored_file(path) for path in paths), pool), expected)
+
+    def test_timeout(self):
+        '''Files not read in time must be unreadable and only their stuck workers replaced'''
+        paths = [BASE_DIR+'/test_files/pdf_test01.pdf'] * 4
+        expected = process_files(stored_file(path) for path in paths)
+        before = set(multiprocessing.active_children())
+
+        pool = ExtractionPool(2, timeout=0.001)
+        self.assertEqual(process_files((stored_file(path) for path in paths), pool), [None] * 4)
+
+        # the stuck workers are terminated rather than left running
+        self.assertLessEqual(len(set(multiprocessing.active_children()) - before), 2)
+
+        # the next request gets new workers
+        pool.timeout = 60
+        self.assertEqual(process_files((stored_file(path) for path in paths), pool), expected)
+
+    def test_concurrent_timeout(self):
+        '''A request timing out must not fail the files of another request sharing the pool'''
+        paths = [BASE_DIR+'/test_files/'+name for name in (
+            'pdf_test01.pdf', 'docx_test01.docx', 'txt_test01.txt') * 3]
+        expected = process_files(stored_file(path) for path in paths)
+        pool = ExtractionPool(2, timeout=60)
+
+        with ThreadPoolExecutor(2) as requests:
+            slow = requests.submit(
+                pool.map, [stored_file(BASE_DIR+'/test_files/pdf_test01.pdf')] * 4, 0.001)
+            texts = requests.submit(pool.map, [stored_file(path) for path in paths])
+            self.assertEqual(slow.result(), [None] * 4)
+            self.assertEqual(texts.result(), expected)
@@ -0,0 +1,131 @@
+''' Content-addressed cache of the features extracted from each document '''
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from sqlite_connections import ProcessConnection
+
+# bumped whenever the way features are extracted changes, invalidating cached features
+FEATURE_VERSION = 1
+
+
+class DocumentFeatures:
+    '''Features of one document: word2vec & style vectors, word count and base network features'''
+
+    def __init__(self, w2v_vec, style_vec, word_count, features=None):
+        self.w2v_vec = w2v_vec
+        self.style_vec = style_vec
+        self.word_count = word_count
+        self.features = features
+
+    @property
+    def vector(self):
+        '''Combined word & style vector which is the input of the base network'''
+        return np.concatenate((self.w2v_vec, self.style_vec), axis=None)
+
+
+def normalise_text(text: str) -> str:
+    '''Normalise a text in ways which can't change its features'''
+    return text.replace('\r\n', '\n').strip()
+
+
+def document_key(text: str, model_version: str) -> str:
+    '''Key of a document's features, from its normalised text and the model versions'''
+    digest = hashlib.sha256(f'{FEATURE_VERSION}:{model_version}'.encode('UTF-8'))
+    digest.update(b'\0')
+    digest.update(normalise_text(text).encode('UTF-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+def array_to_blob(array) -> bytes:
+    '''Serialise a numpy array to store in a database'''
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def blob_to_array(blob: bytes):
+    '''Deserialise a numpy array stored with array_to_blob'''
+    return np.load(io.BytesIO(blob), allow_pickle=False)
+
+
+class FeatureCache:
+    '''
+    LRU cache of document features held in memory up to max_size entries,
+    with an optional SQLite database as an unbounded on-disk tier
+    '''
+
+    def __init__(self, max_size: int = 1024, db_path: str = None):
+        self.max_size = max_size
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if db_path:
+            self._db = ProcessConnection(db_path, [
+                'CREATE TABLE IF NOT EXISTS document_features ('
+                'key TEXT PRIMARY KEY, w2v_vec BLOB, style_vec BLOB, '
+                'word_count INTEGER, features BLOB)'])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> DocumentFeatures:
+        '''Get the features stored under key, or None if they aren't cached'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            elif self._db is not None:
+                entry = self._db_get(key)
+                if entry is not None:
+                    self._memory_put(key, entry)
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            return entry
+
+    def put(self, key: str, entry: DocumentFeatures):
+        '''Store the features of a document, which must include its base network features'''
+        with self._lock:
+            self._memory_put(key, entry)
+            if self._db is not None:
+                db = self._db.get()
+                db.execute(
+                    'INSERT OR REPLACE INTO document_features VALUES (?, ?, ?, ?, ?)',
+                    (key, array_to_blob(entry.w2v_vec), array_to_blob(entry.style_vec),
+                     int(entry.word_count), array_to_blob(entry.features)))
+                db.commit()
+
+    def clear(self):
+        '''Remove every cached entry, including the ones on disk'''
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                db = self._db.get()
+                db.execute('DELETE FROM document_features')
+                db.commit()
+
+    def _memory_put(self, key: str, entry: DocumentFeatures):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _db_get(self, key: str) -> DocumentFeatures:
+        row = self._db.get().execute(
+            'SELECT w2v_vec, style_vec, word_count, features '
+            'FROM document_features WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        w2v_vec, style_vec, word_count, features = row
+        return DocumentFeatures(
+            blob_to_array(w2v_vec), blob_to_array(style_vec), word_count, blob_to_array(features))
@@ -1,7 +1,13 @@
 '''Unit Testing for Flask Application'''
 import os
+import time
+import pstats
+import tempfile
 import unittest
 from application import app
+from compare_texts import models, feature_cache, count_extracted
+from metrics import metrics
+from model_registry import ModelRegistry
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -445,3 +451,342 @@ class FlaskTestCase(unittest.TestCase):
         self.assertEqual(response1.status_code, response2.status_code)
         self.assertEqual(response1.content_type, response2.content_type)
         self.assertEqual(response1.data, response2.data)
+
+    def test_duplicates(self):
+        '''Test near duplicate known texts are reported and left out of the comparison'''
+        with open(BASE_DIR+'/test_files/txt_test01.txt', encoding='UTF-8') as file:
+            text = file.read()
+        copy = 'Draft 2\n\n' + text.upper().replace('\n', '\n\n')
+
+        response = self.client.post('/compare', data={
+            'known_texts': [text, copy, text], 'unknown_text': 'This is a test.'},
+            content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(duplicate['input'], duplicate['duplicate_of'])
+             for duplicate in response.json['duplicates']],
+            [('known_texts[1]', 'known_texts[0]'), ('known_texts[2]', 'known_texts[0]')])
+
+        single = self.client.post('/compare', data={
+            'known_texts': [text], 'unknown_text': 'This is a test.'},
+            content_type='multipart/form-data')
+        self.assertEqual(single.json['duplicates'], [])
+        self.assertEqual(response.json['score'], single.json['score'])
+        self.assertEqual(response.json['word_count'], single.json['word_count'])
+
+    def test_health(self):
+        '''Tests the health & readiness checks'''
+        response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(response.json['state'], (
+            'unloaded', 'loading', 'loaded', 'warming', 'ready'))
+
+        models.warm_up()
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json['ready'])
+        self.assertGreater(response.json['warm_up_time'], 0)
+
+    def test_recovery(self):
+        '''Tests a failed warm-up is forgotten once the models load on first use'''
+        registry = ModelRegistry('missing', 'numpy')
+        with self.assertRaises(ValueError):
+            registry.warm_up()
+        self.assertEqual(registry.status()['state'], 'failed')
+
+        registry.w2v_load_mode = 'float16'
+        self.assertIsNotNone(registry.word2vec_model)
+        self.assertTrue(registry.status()['ready'])
+        self.assertIsNone(registry.status()['error'])
+
+    def test_cache(self):
+        '''Test that repeated texts are served from the feature cache'''
+        data = {
+            'known_texts': ['This is a cached test.', 'Another cached test.'],
+            'unknown_text': 'This is an unknown cached test.'
+        }
+        response1 = self.client.post(
+            '/compare', data=data, content_type='multipart/form-data')
+        hits = feature_cache.hits
+        response2 = self.client.post(
+            '/compare', data=data, content_type='multipart/form-data')
+
+        self.assertEqual(response2.status_code, 200)
+        self.assertEqual(feature_cache.hits, hits + 3)
+        self.assertEqual(response1.data, response2.data)
+
+    def test_authors(self):
+        '''Tests registering authors and comparing against their profiles'''
+        response = self.client.post(
+            '/authors', data={'name': 'Test Author'}, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 201)
+        author_id = response.json['author_id']
+        self.assertEqual(response.json['document_count'], 0)
+
+        # an author without known texts can't be compared against
+        response = self.client.post(
+            f'/authors/{author_id}/compare', data={'unknown_text': 'This is a test.'},
+            content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 400)
+
+        # no known texts
+        response = self.client.post(
+            f'/authors/{author_id}/documents', data={'known_texts': ['']},
+            content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 400)
+
+        # known file, then the same file again along with a new text
+        for known_texts, added, document_count in (([], 1, 1), (['This is a test.'], 1, 2)):
+            with open(BASE_DIR+'/test_files/txt_test01.txt', 'rb') as known_file:
+                response = self.client.post(
+                    f'/authors/{author_id}/documents',
+                    data={'known_texts': known_texts, 'known_files': [known_file]},
+                    content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['added'], added)
+            self.assertEqual(response.json['document_count'], document_count)
+
+        response = self.client.get(f'/authors/{author_id}')
+        self.assertEqual(response.json['document_count'], 2)
+
+        # no unknown text
+        response = self.client.post(
+            f'/authors/{author_id}/compare', data={}, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 401)
+
+        with open(BASE_DIR+'/test_files/txt_test02.txt', 'rb') as unknown_file:
+            response = self.client.post(
+                f'/authors/{author_id}/compare', data={'unknown_file': unknown_file},
+                content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('score', response.json)
+
+        # unregistered author
+        response = self.client.get('/authors/missing')
+        self.assertEqual(response.status_code, 404)
+
+    def test_author_score(self):
+        '''A profile with one text must score the same as comparing that text'''
+        author_id = self.client.post('/authors').json['author_id']
+        self.client.post(
+            f'/authors/{author_id}/documents', data={'known_texts': ['This is a test.']},
+            content_type='multipart/form-data')
+
+        response1 = self.client.post(
+            f'/authors/{author_id}/compare', data={'unknown_text': 'This is another test.'},
+            content_type='multipart/form-data')
+        response2 = self.client.post(
+            '/compare', data={
+                'known_texts': ['This is a test.'], 'unknown_text': 'This is another test.'},
+            content_type='multipart/form-data')
+
+        self.assertEqual(response1.status_code, 200)
+        self.assertEqual(response1.json['score'], response2.json['score'])
+
+    def test_identify(self):
+        '''Tests finding the likeliest registered authors of a text'''
+        texts = [
+            'This is a test.', 'The cat sat on the mat, and it was happy!',
+            'Stocks fell sharply today; investors worried about rates.']
+        author_ids = []
+        for i, text in enumerate(texts):
+            author_id = self.client.post('/authors', data={'name': f'Author {i}'}).json['author_id']
+            self.client.post(
+                f'/authors/{author_id}/documents', data={'known_texts': [text]},
+                content_type='multipart/form-data')
+            author_ids.append(author_id)
+
+        for method in ('exact', 'ivf'):
+            response = self.client.post(
+                '/authors/identify', data={
+                    'unknown_text': 'The dog sat on the rug.', 'top_k': 2, 'method': method},
+                content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json['authors']), 2)
+            self.assertGreaterEqual(response.json['indexed'], len(texts))
+            scores = [author['score'] for author in response.json['authors']]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+
+        # every author is rescored when the shortlist covers them, scoring like a comparison
+        response = self.client.post(
+            '/authors/identify', data={'unknown_text': 'The dog sat on the rug.', 'top_k': 1000},
+            content_type='multipart/form-data')
+        identified = {author['author_id']: author['score'] for author in response.json['authors']}
+        for author_id in author_ids:
+            compare_response = self.client.post(
+                f'/authors/{author_id}/compare', data={'unknown_text': 'The dog sat on the rug.'},
+                content_type='multipart/form-data')
+            self.assertEqual(identified[author_id], compare_response.json['score'])
+
+        # no unknown text, bad parameters
+        response = self.client.post(
+            '/authors/identify', data={}, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 401)
+        for data in ({'top_k': 0}, {'method': 'lsh'}):
+            response = self.client.post(
+                '/authors/identify', data={'unknown_text': 'This is a test.', **data},
+                content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 400)
+
+    def test_batch(self):
+        '''Tests comparing many unknown texts to many authors at once'''
+        with open(BASE_DIR+'/test_files/txt_test01.txt', 'rb') as file:
+            text1 = file.read().decode('UTF-8')
+        with open(BASE_DIR+'/test_files/txt_test02.txt', 'rb') as file:
+            text2 = file.read().decode('UTF-8')
+        author_id = self.client.post('/authors').json['author_id']
+        self.client.post(
+            f'/authors/{author_id}/documents', data={'known_texts': [text2]},
+            content_type='multipart/form-data')
+
+        data = {
+            'authors': [{'name': 'first', 'known_texts': [text1, 'This is a test.']}],
+            'author_ids': [author_id],
+            'unknown_texts': [text2, 'This is a test.', text1]
+        }
+        response = self.client.post('/compare/batch', json=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['authors'], ['first', author_id])
+        self.assertEqual(len(response.json['scores']), 3)
+        self.assertEqual(len(response.json['ranking']), 6)
+        ranked_scores = [rank['score'] for rank in response.json['ranking']]
+        self.assertEqual(ranked_scores, sorted(ranked_scores, reverse=True))
+
+        # scores must match single comparisons
+        single = self.client.post(
+            '/compare', data={'known_texts': [text1, 'This is a test.'], 'unknown_text': text2},
+            content_type='multipart/form-data')
+        self.assertEqual(response.json['scores'][0][0], single.json['score'])
+
+        # pairs
+        data['pairs'] = True
+        data['unknown_texts'] = [text2, text1]
+        response = self.client.post('/compare/batch', json=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json['scores']), 2)
+        self.assertEqual(response.json['scores'][0][0], single.json['score'])
+
+        # errors
+        for data, expected_output in (
+                ({'authors': [{'known_texts': ['']}], 'unknown_texts': ['a']}, 400),
+                ({'author_ids': ['missing'], 'unknown_texts': ['a']}, 404),
+                ({'authors': [{'known_texts': ['a']}], 'unknown_texts': [' ']}, 401),
+                ({'authors': [{'known_texts': ['a']}], 'unknown_texts': ['a', 'b'],
+                  'pairs': True}, 400),
+                ({'unknown_texts': 'a'}, 400)):
+            response = self.client.post('/compare/batch', json=data)
+            self.assertEqual(response.status_code, expected_output)
+
+    def wait_for_job(self, location: str) -> dict:
+        '''Polls a job until it is finished'''
+        for _ in range(600):
+            response = self.client.get(location)
+            self.assertEqual(response.status_code, 200)
+            if response.json['status'] in ('done', 'failed'):
+                return response.json
+            time.sleep(0.1)
+
+        self.fail('Job did not finish')
+
+    def test_jobs(self):
+        '''Tests comparing texts in a background job'''
+        with open(BASE_DIR+'/test_files/txt_test01.txt', 'rb') as file1, \
+                open(BASE_DIR+'/test_files/pdf_test01.pdf', 'rb') as file2:
+            response = self.client.post('/compare/jobs', data={
+                'known_files': [file1, file2], 'unknown_text': 'This is a test.'
+            }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 202)
+        self.assertIn(response.json['status'], ('queued', 'running', 'done'))
+        job = self.wait_for_job(response.headers['Location'])
+
+        with open(BASE_DIR+'/test_files/txt_test01.txt', 'rb') as file1, \
+                open(BASE_DIR+'/test_files/pdf_test01.pdf', 'rb') as file2:
+            response = self.client.post('/compare', data={
+                'known_files': [file1, file2], 'unknown_text': 'This is a test.'
+            }, content_type='multipart/form-data')
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['code'], 200)
+        self.assertEqual(job['result'], response.json)
+
+        # errors are kept with the job
+        response = self.client.post(
+            '/compare/jobs', data={'known_texts': ['This is a test.']},
+            content_type='multipart/form-data')
+        job = self.wait_for_job(response.headers['Location'])
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['code'], 401)
+
+        response = self.client.get('/compare/jobs/missing')
+        self.assertEqual(response.status_code, 404)
+
+    def test_metrics(self):
+        '''Tests the stage timings & counters'''
+        documents = metrics.counter('documents_processed_total')
+        app.config['SERVER_TIMING'] = True
+        try:
+            response = self.client.post('/compare', data={
+                'known_texts': ['This text is only used to test the metrics.'],
+                'unknown_text': 'Neither is this one, which is also used for the metrics.'
+            }, content_type='multipart/form-data')
+        finally:
+            app.config['SERVER_TIMING'] = False
+
+        self.assertEqual(response.status_code, 200)
+        timing = response.headers['Server-Timing']
+        for stage in ('parse', 'word_vector', 'style_vector', 'inference', 'simplify'):
+            self.assertIn(f'{stage};dur=', timing)
+        self.assertEqual(metrics.counter('documents_processed_total'), documents + 2)
+
+        # extracted text is counted in UTF-8 bytes, skipping unreadable files
+        extracted = metrics.counter('bytes_extracted_total')
+        count_extracted(['naïve café', None])
+        self.assertEqual(metrics.counter('bytes_extracted_total'), extracted + 12)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        body = response.get_data(as_text=True)
+        self.assertIn('authowrite_stage_seconds_bucket{stage="predict",le="+Inf"}', body)
+        self.assertIn('authowrite_documents_processed_total', body)
+        self.assertIn('authowrite_feature_cache_hits_total', body)
+
+        response = self.client.get('/healthz')
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_profile(self):
+        '''Tests profiling a request with the admin token'''
+        data = {'known_texts': ['This is a test.'], 'unknown_text': 'This is a test.'}
+        profile_dir = app.config['PROFILE_DIR']
+        with tempfile.TemporaryDirectory() as directory:
+            app.config.update(PROFILE_TOKEN='secret', PROFILE_DIR=directory)
+            try:
+                response = self.client.post(
+                    '/compare', data=data, headers={'X-Profile-Token': 'secret'},
+                    content_type='multipart/form-data')
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('score', response.json)
+                stats = pstats.Stats(os.path.join(directory, response.headers['X-Profile']))
+                self.assertTrue(any(
+                    function == 'compare_mix_texts' for _, _, function in stats.stats))
+
+                response = self.client.post(
+                    '/compare', data=data, headers={'X-Profile-Token': 'wrong'},
+                    content_type='multipart/form-data')
+                self.assertEqual(response.status_code, 403)
+
+                response = self.client.post(
+                    '/compare', data=data, content_type='multipart/form-data')
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('X-Profile', response.headers)
+                self.assertEqual(len(os.listdir(directory)), 1)
+
+                # without an admin token the header is ignored
+                app.config.update(PROFILE_TOKEN='')
+                response = self.client.post(
+                    '/compare', data=data, headers={'X-Profile-Token': 'secret'},
+                    content_type='multipart/form-data')
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('X-Profile', response.headers)
+                self.assertEqual(len(os.listdir(directory)), 1)
+            finally:
+                app.config.update(PROFILE_TOKEN='', PROFILE_DIR=profile_dir)
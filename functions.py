@@ -4,13 +4,124 @@ created by Eduardo Oliveira and his team.
 Edited by Saaiq to use text instead of texts in the usecase
 '''
 import string
+import threading
+from functools import lru_cache
 import numpy as np
 import nltk
 from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 from nltk.stem import WordNetLemmatizer
+from metrics import span
 
 W2V_VECTOR_SIZE = 300
+LEMMA_CACHE_SIZE = 100000
+
+# headers for every key in style dictionary
+STYLE_HEADERS = (
+    '.', ',', ';', ':', '!', '?', '-', '(', ')', '\"', '\'', '`', '/',
+    'sentences_over_avg', 'sentences_under_avg', 'sentences_avg_length', 'avg_sentence_length',
+    'rare_word_count', 'long_word_count', 'words_over_avg_length', 'words_under_avg_length',
+    'words_avg_length', 'ttr', 'word_count'
+)
+
+# punctuations counted in the style vector, in the same order as the style headers
+PUNCTUATIONS = '.,;:!?-()\"\'`/'
+# every punctuation is one ASCII byte, which never appears within another UTF-8 character
+_PUNCTUATION_CODES = np.frombuffer(PUNCTUATIONS.encode('ascii'), dtype=np.uint8)
+_OTHER_BYTES = bytes(sorted(set(range(256)) - set(PUNCTUATIONS.encode('ascii'))))
+
+
+class TextContext:
+    """
+    Holds the NLTK resources shared by every call that processes a text,
+    so the stopwords corpus and lemmatizer are only loaded once per process
+    """
+
+    def __init__(self, lemma_cache_size=LEMMA_CACHE_SIZE):
+        self.stop_words = frozenset(stopwords.words('english'))
+        self.translate_table = str.maketrans(
+            '', '', string.punctuation + string.digits)
+        self.lemmatizer = WordNetLemmatizer()
+        # memo of word to lemma results as the same words repeat across texts
+        self.lemmatize = lru_cache(maxsize=lemma_cache_size)(
+            self.lemmatizer.lemmatize)
+
+
+_TEXT_CONTEXT_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _create_text_context():
+    return TextContext()
+
+
+def get_text_context():
+    """
+    Lazily create the text context shared by every call
+    """
+    with _TEXT_CONTEXT_LOCK:
+        return _create_text_context()
+
+
+class ParsedDocument:
+    """
+    A text tokenised and sentence-split once so the word2vec and
+    style features can both be extracted without re-parsing it.
+    Tokens are kept as an int32 array of IDs into the distinct tokens
+    of the text, so the features are worked out once per distinct token
+    and counted with NumPy rather than over lists of strings
+    """
+
+    def __init__(self, text):
+        if not isinstance(text, str):
+            text = str(text)
+
+        self.text = text
+        tokens = word_tokenize(text.lower())
+        # distinct tokens in order of first use, and the ID of every token
+        self.types = list(dict.fromkeys(tokens))
+        type_ids = {token: i for i, token in enumerate(self.types)}
+        self.token_ids = np.fromiter(
+            map(type_ids.__getitem__, tokens), dtype=np.int32, count=len(tokens))
+        sentences = nltk.sent_tokenize(text)
+        self.sentence_lengths = np.fromiter(
+            (len(sentence.split()) for sentence in sentences),
+            dtype=np.int64, count=len(sentences))
+        self.word_count = len(text.split())
+
+    @property
+    def tokens(self):
+        """
+        Every token of the text as a list of strings
+        """
+        return [self.types[i] for i in self.token_ids.tolist()]
+
+
+def parse_document(text):
+    """
+    Parse a text into a ParsedDocument, passing already parsed documents through
+    """
+    if isinstance(text, ParsedDocument):
+        return text
+
+    return ParsedDocument(text)
+
+
+def preprocess_types(document):
+    """
+    Preprocess every distinct token of a parsed document by removing punctuation
+    and numbers, removing stop words, and lemmatizing, with None for dropped tokens
+    """
+    context = get_text_context()
+    words = []
+    for token in document.types:
+        # Remove punctuation and numbers
+        word = token.translate(context.translate_table)
+        # Remove stop words & lemmatize the rest
+        words.append(
+            context.lemmatize(word) if word and word not in context.stop_words else None)
+
+    return words
 
 
 def preprocess_text(text):
@@ -19,43 +130,63 @@ def preprocess_text(text):
     removing stop words, and lemmatizing.
 
     Args:
-        text (str): The text to preprocess.
+        text (str | ParsedDocument): The text to preprocess.
 
     Returns:
         list: The preprocessed text as a list of tokens.
     """
-    if not isinstance(text, str):
-        text = str(text)
+    document = parse_document(text)
+    words = preprocess_types(document)
 
-    # Tokenize the text into words
-    tokens = word_tokenize(text.lower())
+    return [words[i] for i in document.token_ids.tolist() if words[i] is not None]
 
-    # Remove punctuation and numbers
-    table = str.maketrans('', '', string.punctuation + string.digits)
-    tokens = [word.translate(table) for word in tokens]
 
-    # Remove stop words
-    stop_words = set(stopwords.words('english'))
-    tokens = [word for word in tokens if (
-        not word in stop_words) and (word != '')]
+def get_word_vectors(model):
+    """
+    Get the KeyedVectors of a Word2Vec model (or KeyedVectors passed directly)
+    """
+    return getattr(model, 'wv', model)
 
-    # Lemmatize words
-    lemmatizer = WordNetLemmatizer()
-    tokens = [lemmatizer.lemmatize(word) for word in tokens]
 
-    return tokens
+def take_word_vectors(word_vectors, indices):
+    """
+    Get rows of the word vector matrix as float32,
+    dequantising compact vectors stored as float16 or scaled int8
+    """
+    rows = word_vectors.vectors[indices]
+    scales = getattr(word_vectors, 'scales', None)
+    if scales is not None:
+        return rows * scales[indices, np.newaxis]
+
+    return rows if rows.dtype == np.float32 else rows.astype(np.float32)
+
+
+def lookup_word_indices(text, model):
+    """
+    Map the preprocessed words of a text to their rows in the word vector matrix,
+    dropping words that are not in the vocabulary
+    """
+    document = parse_document(text)
+    key_to_index = get_word_vectors(model).key_to_index
+    # look every distinct word up once, then spread the rows over the tokens
+    type_indices = np.fromiter(
+        (-1 if word is None else key_to_index.get(word, -1)
+         for word in preprocess_types(document)),
+        dtype=np.int64, count=len(document.types))
+    indices = type_indices[document.token_ids]
+
+    return indices[indices >= 0]
 
 
 def convert_text_to_vector(text, model):
     """
-    Convert a list of texts into their corresponding word2vec vectors
+    Convert a text or parsed document into its corresponding word2vec vector
     """
-    words = preprocess_text(text)
-    vector = np.sum([model.wv[word]
-                    for word in words if word in model.wv], axis=0)
-    word_count = np.sum([word in model.wv for word in words])
+    indices = lookup_word_indices(text, model)
+    word_count = len(indices)
 
     if word_count != 0:
+        vector = take_word_vectors(get_word_vectors(model), indices).sum(axis=0)
         vector /= word_count
     else:
         vector = np.zeros(W2V_VECTOR_SIZE)
@@ -63,38 +194,55 @@ def convert_text_to_vector(text, model):
     return vector
 
 
-def count_punctuations(text):
+def convert_texts_to_vectors(texts, model):
     """
-    Count the frequency of different punctuations in the texts
+    Convert many texts or parsed documents into their word2vec vectors at once,
+    returned as one row per text
     """
-    # Define punctuations to count
-    punctuations = set([
-        '.', ',', ';', ':', '!', '?', '-',
-        '(', ')', '\"', '\'', '`', '/']
-    )
+    word_vectors = get_word_vectors(model)
+    index_lists = [lookup_word_indices(text, model) for text in texts]
+    word_counts = np.array([len(indices) for indices in index_lists])
+    vectors = np.zeros((len(texts), W2V_VECTOR_SIZE), dtype=np.float32)
 
-    # Initialize dictionary to count punctuations
-    punctuations_count = {p: 0 for p in punctuations}
+    # texts without any known words are left as zero vectors
+    has_words = word_counts > 0
+    if np.any(has_words):
+        offsets = np.cumsum(word_counts) - word_counts
+        rows = take_word_vectors(word_vectors, np.concatenate(index_lists))
+        vectors[has_words] = np.add.reduceat(rows, offsets[has_words], axis=0)
+        vectors[has_words] /= word_counts[has_words, np.newaxis].astype(vectors.dtype)
 
-    # Count punctuations in text_list
-    for char in text:
-        if char in punctuations:
-            punctuations_count[char] += 1
+    return vectors
+
+
+def count_punctuations(text):
+    """
+    Count the frequency of different punctuations in the texts,
+    over the UTF-8 bytes of the text with everything else deleted
+    """
+    punctuation = text.encode('UTF-8', 'surrogatepass').translate(None, _OTHER_BYTES)
+    char_count = np.bincount(np.frombuffer(punctuation, dtype=np.uint8), minlength=128)
 
     # Return list of punctuation counts
-    return list(punctuations_count.values())
+    return char_count[_PUNCTUATION_CODES].tolist()
 
 
 def analyze_sentence_lengths(sentences):
     """
     Analyze the lengths of sentences
     """
-    sentence_lengths = [len(sentence.split()) for sentence in sentences]
+    return analyze_lengths(np.fromiter(
+        (len(sentence.split()) for sentence in sentences),
+        dtype=np.int64, count=len(sentences)))
+
+
+def analyze_lengths(sentence_lengths):
+    """
+    Analyze the word counts of the sentences of a text
+    """
     average_length = np.mean(sentence_lengths)  # *
-    count_over_avg = np.sum(
-        [length > average_length for length in sentence_lengths])
-    count_under_avg = np.sum(
-        [length < average_length for length in sentence_lengths])
+    count_over_avg = np.count_nonzero(sentence_lengths > average_length)
+    count_under_avg = np.count_nonzero(sentence_lengths < average_length)
     count_avg = len(sentence_lengths) - count_over_avg - count_under_avg
 
     return [count_over_avg, count_under_avg, count_avg, average_length]
@@ -102,42 +250,48 @@ def analyze_sentence_lengths(sentences):
 
 def analyze_words(text):
     """
-    Analyze the words used in the texts
-    """
-    stop_words = set(stopwords.words('english'))
-    lemmatizer = WordNetLemmatizer()
-    tokenized = word_tokenize(text.lower())
-    words = [
-        lemmatizer.lemmatize(word) for word in tokenized
-        if word not in stop_words
-    ]
-    word_freq = nltk.FreqDist(words)
-    rare_count = np.sum([freq <= 2 for word, freq in word_freq.items()])
-    long_count = np.sum([len(word) > 6 for word in words])
-    word_lengths = [len(word) for word in words]
+    Analyze the words used in a text or parsed document
+    """
+    context = get_text_context()
+    document = parse_document(text)
+
+    # lemmatize every distinct token which isn't a stop word, numbering the distinct lemmas
+    lemma_ids = {}
+    type_lemmas = np.fromiter(
+        (-1 if token in context.stop_words
+         else lemma_ids.setdefault(context.lemmatize(token), len(lemma_ids))
+         for token in document.types),
+        dtype=np.int32, count=len(document.types))
+    words = type_lemmas[document.token_ids]
+    words = words[words >= 0]
+
+    word_freq = np.bincount(words, minlength=len(lemma_ids))
+    word_lengths = np.fromiter(
+        map(len, lemma_ids), dtype=np.int64, count=len(lemma_ids))[words]
+    rare_count = np.count_nonzero(word_freq <= 2)
+    long_count = np.count_nonzero(word_lengths > 6)
     average_length = np.mean(word_lengths)
-    count_over_avg = np.sum(
-        [length > average_length for length in word_lengths])
-    count_under_avg = np.sum(
-        [length < average_length for length in word_lengths])
+    count_over_avg = np.count_nonzero(word_lengths > average_length)
+    count_under_avg = np.count_nonzero(word_lengths < average_length)
     count_avg = len(word_lengths) - count_over_avg - count_under_avg
-    ttr = len(set(words)) / len(words) if words else 0  # *
+    ttr = len(word_freq) / len(words) if len(words) else 0  # *
 
     return [rare_count, long_count, count_over_avg, count_under_avg, count_avg, ttr]
 
 
 def calculate_style_vector(text):
     """
-    Calculate the style vector of the texts
+    Calculate the style vector of a text or parsed document
     Edited by Saaiq to output word count and 
     fix dividing values that shouldn't be divided
     """
+    document = parse_document(text)
     punctuation_vec = count_punctuations(
-        text)     # Punctuations stylistic features
-    sentence_vec = analyze_sentence_lengths(
-        nltk.sent_tokenize(text))  # Sentences stylistic features
-    word_vec = analyze_words(text)                 # Words stylistic features
-    word_count = len(text.split())
+        document.text)     # Punctuations stylistic features
+    sentence_vec = analyze_lengths(
+        document.sentence_lengths)  # Sentences stylistic features
+    word_vec = analyze_words(document)             # Words stylistic features
+    word_count = document.word_count
 
     vector = np.concatenate((punctuation_vec, sentence_vec, word_vec))
     if word_count > 0:
@@ -149,36 +303,54 @@ def calculate_style_vector(text):
     return vector, word_count
 
 
-def get_vectors(texts, w2v_model):
+def get_text_vectors(text, w2v_model):
     """
-    Create the word2vec vectors and style vectors of the texts,
-    Edited by Saaiq to output style vector information
+    Create the word2vec vector, style vector and word count of a single text
     """
-    res = []
+    # tokenise & sentence-split once for both feature extractors
+    with span('parse'):
+        document = parse_document(text)
+    with span('word_vector'):
+        w2v_vec = convert_text_to_vector(document, w2v_model)
+    with span('style_vector'):
+        style_vec, word_count = calculate_style_vector(document)
 
-    # headers for every key in style dictionary
-    style_headers = (
-        '.', ',', ';', ':', '!', '?', '-', '(', ')', '\"', '\'', '`', '/',
-        'sentences_over_avg', 'sentences_under_avg', 'sentences_avg_length', 'avg_sentence_length',
-        'rare_word_count', 'long_word_count', 'words_over_avg_length', 'words_under_avg_length', 
-        'words_avg_length', 'ttr', 'word_count'
-    )
-    style_dict = {key: [] for key in style_headers}
+    return w2v_vec, style_vec, word_count
 
-    for text in texts:
-        w2v_vec = convert_text_to_vector(text, w2v_model)
-        style_vec, word_count = calculate_style_vector(text)
 
+def get_style_dict(style_vecs, word_counts):
+    """
+    Summarise the style vectors & word counts of many texts
+    as the median of every style value
+    """
+    style_dict = {key: [] for key in STYLE_HEADERS}
+
+    for style_vec, word_count in zip(style_vecs, word_counts):
         # input style vector information into style dictionary
-        for i, header in enumerate(style_headers):
+        for i, header in enumerate(STYLE_HEADERS):
             if header == "word_count":
                 style_dict[header].append(word_count)
             else:
                 style_dict[header].append(style_vec[i])
 
-        res.append(np.concatenate((w2v_vec, style_vec), axis=None))
-
     # convert to mean of style vectors
-    style_dict = {key: np.median(value) for key, value in style_dict.items()}
+    return {key: np.median(value) for key, value in style_dict.items()}
+
+
+def get_vectors(texts, w2v_model):
+    """
+    Create the word2vec vectors and style vectors of the texts,
+    Edited by Saaiq to output style vector information
+    """
+    res = []
+    style_vecs = []
+    word_counts = []
+
+    for text in texts:
+        w2v_vec, style_vec, word_count = get_text_vectors(text, w2v_model)
+        style_vecs.append(style_vec)
+        word_counts.append(word_count)
+
+        res.append(np.concatenate((w2v_vec, style_vec), axis=None))
 
-    return res, w2v_vec, style_dict
+    return res, w2v_vec, get_style_dict(style_vecs, word_counts)
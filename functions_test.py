@@ -0,0 +1,233 @@
+'''Unit Testing for the text processing functions'''
+import os
+import string
+import unittest
+import warnings
+from collections import Counter
+import numpy as np
+import nltk
+from gensim.models import KeyedVectors
+from nltk.tokenize import word_tokenize
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+from functions import (
+    W2V_VECTOR_SIZE, ParsedDocument, get_text_context, parse_document, preprocess_text,
+    convert_text_to_vector, convert_texts_to_vectors, count_punctuations,
+    analyze_sentence_lengths, analyze_words, calculate_style_vector)
+from docu_functions import read_pdf, read_doc
+from word_vectors import compact_vectors
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def load_corpus() -> list[str]:
+    '''Read every readable text within test_files/'''
+    corpus = []
+    for name in sorted(os.listdir(BASE_DIR+'/test_files')):
+        with open(BASE_DIR+'/test_files/'+name, 'rb') as file:
+            if name.endswith('.pdf'):
+                text = read_pdf(file)
+            elif name.endswith('.docx'):
+                text = read_doc(file)
+            elif name.endswith('.txt'):
+                try:
+                    text = file.read().decode('UTF-8')
+                except UnicodeDecodeError:
+                    text = None
+            else:
+                text = None
+
+        if text and not text.isspace():
+            corpus.append(text)
+
+    return corpus
+
+
+def preprocess_text_uncached(text):
+    '''preprocess_text as it was before the shared text context'''
+    if isinstance(text, ParsedDocument):
+        tokens = text.tokens
+    else:
+        tokens = word_tokenize(text.lower())
+    table = str.maketrans('', '', string.punctuation + string.digits)
+    tokens = [word.translate(table) for word in tokens]
+    stop_words = set(stopwords.words('english'))
+    tokens = [word for word in tokens if (
+        not word in stop_words) and (word != '')]
+    lemmatizer = WordNetLemmatizer()
+    return [lemmatizer.lemmatize(word) for word in tokens]
+
+
+def count_punctuations_counter(text):
+    '''count_punctuations as it was before counting bytes'''
+    char_count = Counter(text)
+    return [char_count[p] for p in '.,;:!?-()"\'`/']
+
+
+def analyze_sentence_lengths_lists(sentences):
+    '''analyze_sentence_lengths as it was before being vectorised'''
+    sentence_lengths = [len(sentence.split()) for sentence in sentences]
+    average_length = np.mean(sentence_lengths)
+    count_over_avg = np.sum(
+        [length > average_length for length in sentence_lengths])
+    count_under_avg = np.sum(
+        [length < average_length for length in sentence_lengths])
+    count_avg = len(sentence_lengths) - count_over_avg - count_under_avg
+
+    return [count_over_avg, count_under_avg, count_avg, average_length]
+
+
+def analyze_words_lists(text):
+    '''analyze_words as it was before being vectorised'''
+    stop_words = set(stopwords.words('english'))
+    lemmatizer = WordNetLemmatizer()
+    tokenized = word_tokenize(text.lower())
+    words = [
+        lemmatizer.lemmatize(word) for word in tokenized
+        if word not in stop_words
+    ]
+    word_freq = nltk.FreqDist(words)
+    rare_count = np.sum([freq <= 2 for word, freq in word_freq.items()])
+    long_count = np.sum([len(word) > 6 for word in words])
+    word_lengths = [len(word) for word in words]
+    average_length = np.mean(word_lengths)
+    count_over_avg = np.sum(
+        [length > average_length for length in word_lengths])
+    count_under_avg = np.sum(
+        [length < average_length for length in word_lengths])
+    count_avg = len(word_lengths) - count_over_avg - count_under_avg
+    ttr = len(set(words)) / len(words) if words else 0
+
+    return [rare_count, long_count, count_over_avg, count_under_avg, count_avg, ttr]
+
+
+class TextContextTestCase(unittest.TestCase):
+    '''Class to test the shared text context'''
+    corpus = load_corpus()
+
+    def test_same_tokens(self):
+        '''Tokens must match the ones built without the shared context'''
+        for text in self.corpus:
+            self.assertEqual(preprocess_text(text), preprocess_text_uncached(text))
+
+    def test_cache(self):
+        '''Words seen before must be lemmatized from the shared context's cache'''
+        documents = [parse_document(text) for text in self.corpus]
+        context = get_text_context()
+        for document in documents:
+            preprocess_text(document)
+
+        before = context.lemmatize.cache_info()
+        for document in documents:
+            preprocess_text(document)
+        after = context.lemmatize.cache_info()
+
+        self.assertIs(get_text_context(), context)
+        self.assertEqual(after.misses, before.misses)
+        self.assertGreater(after.hits, before.hits)
+
+
+class StyleVectorTestCase(unittest.TestCase):
+    '''Class to test the vectorised style features against the list based ones'''
+    corpus = load_corpus() + ['This is a test.', 'test', '', '   ']
+
+    def setUp(self):
+        '''Empty texts take the mean of nothing which numpy warns about'''
+        self.enterContext(warnings.catch_warnings())
+        warnings.simplefilter('ignore', RuntimeWarning)
+
+    def test_sentence_lengths(self):
+        '''analyze_sentence_lengths must match the list based version'''
+        for text in self.corpus:
+            sentences = nltk.sent_tokenize(text)
+            np.testing.assert_array_equal(
+                analyze_sentence_lengths(sentences),
+                analyze_sentence_lengths_lists(sentences))
+
+    def test_words(self):
+        '''analyze_words must match the list based version'''
+        for text in self.corpus:
+            np.testing.assert_array_equal(
+                analyze_words(text), analyze_words_lists(text))
+
+    def test_punctuations(self):
+        '''count_punctuations must match counting characters, whatever the encoding'''
+        for text in self.corpus + ['« Déjà vu » — “quoted”, (naïve) 日本語。\'it\'s\' a/b `c`!?;:-.']:
+            self.assertEqual(count_punctuations(text), count_punctuations_counter(text))
+
+    def test_tokens(self):
+        '''The token IDs of a parsed document must spell out its tokens'''
+        for text in self.corpus:
+            document = parse_document(text)
+            self.assertEqual(document.tokens, word_tokenize(text.lower()))
+            self.assertEqual(len(document.types), len(set(document.types)))
+            self.assertEqual(document.token_ids.dtype, np.int32)
+
+    def test_style_vector(self):
+        '''The full style vector must stay numerically identical'''
+        for text in self.corpus:
+            style_vec, word_count = calculate_style_vector(text)
+            word_count_legacy = len(text.split())
+            legacy_sentence_vec = analyze_sentence_lengths_lists(
+                nltk.sent_tokenize(text))
+            legacy_word_vec = analyze_words_lists(text)
+            legacy_vec = np.concatenate((
+                count_punctuations_counter(text), legacy_sentence_vec, legacy_word_vec))
+            if word_count_legacy > 0:
+                legacy_vec /= word_count_legacy
+                legacy_vec[16] = legacy_sentence_vec[3]
+                legacy_vec[22] = legacy_word_vec[5]
+
+            self.assertEqual(word_count, word_count_legacy)
+            np.testing.assert_array_equal(style_vec, legacy_vec)
+
+
+class WordVectorTestCase(unittest.TestCase):
+    '''Class to test averaging word vectors'''
+    corpus = load_corpus() + ['This is a test.', 'zzzz qqqq', '']
+
+    @classmethod
+    def setUpClass(cls):
+        '''Build small word vectors from the corpus vocabulary'''
+        words = sorted({
+            word for text in cls.corpus[::2] for word in preprocess_text(text)})
+        cls.model = KeyedVectors(W2V_VECTOR_SIZE)
+        cls.model.add_vectors(words, np.random.default_rng(0).standard_normal(
+            (len(words), W2V_VECTOR_SIZE), dtype=np.float32))
+
+    def test_single(self):
+        '''convert_text_to_vector must average the vectors of known words'''
+        for text in self.corpus:
+            words = [word for word in preprocess_text(text) if word in self.model]
+            expected = np.mean([self.model[word] for word in words], axis=0) \
+                if words else np.zeros(W2V_VECTOR_SIZE)
+
+            np.testing.assert_allclose(
+                convert_text_to_vector(text, self.model), expected, rtol=1e-5, atol=1e-6)
+
+    def test_batch(self):
+        '''convert_texts_to_vectors must match converting every text on its own'''
+        vectors = convert_texts_to_vectors(self.corpus, self.model)
+
+        self.assertEqual(vectors.shape, (len(self.corpus), W2V_VECTOR_SIZE))
+        for text, vector in zip(self.corpus, vectors):
+            np.testing.assert_allclose(
+                vector, convert_text_to_vector(text, self.model), rtol=1e-5, atol=1e-6)
+
+    def test_compact(self):
+        '''Compact vectors must stay close to the full ones, skipping pruned words'''
+        for mode, tolerance in (('float16', 1e-3), ('int8', 2e-2)):
+            word_vectors = compact_vectors(self.model, mode)
+            for text in self.corpus:
+                np.testing.assert_allclose(
+                    convert_text_to_vector(text, word_vectors),
+                    convert_text_to_vector(text, self.model), atol=tolerance)
+
+            np.testing.assert_allclose(
+                convert_texts_to_vectors(self.corpus, word_vectors),
+                [convert_text_to_vector(text, word_vectors) for text in self.corpus],
+                rtol=1e-5, atol=1e-6)
+
+        pruned = compact_vectors(self.model, 'int8', max_vocab=10)
+        self.assertEqual(len(pruned), 10)
+        self.assertEqual(pruned.index_to_key, self.model.index_to_key[:10])
@@ -0,0 +1,48 @@
+''' Gunicorn configuration of the production server, run with: gunicorn application:app '''
+# pylint: disable=invalid-name,import-outside-toplevel
+import os
+import gc
+
+os.environ.setdefault('APP_ENV', 'production')
+
+# imported after APP_ENV is set, before numpy so its BLAS threads are sized too
+from config import ProdConfig  # pylint: disable=wrong-import-position
+
+os.environ.setdefault('OMP_NUM_THREADS', str(ProdConfig.TF_INTRA_OP_THREADS))
+
+bind = ProdConfig.BIND
+workers = ProdConfig.WEB_WORKERS
+threads = ProdConfig.WEB_THREADS
+timeout = ProdConfig.WEB_TIMEOUT
+# import the app in the master so the models it loads are shared by the workers
+preload_app = True
+
+
+def when_ready(server):
+    '''
+    Load the word vectors (and NumPy networks) in the master before the workers are
+    forked so they share one copy-on-write copy. TensorFlow isn't fork-safe once it
+    has run, so each worker loads the Keras networks itself
+    '''
+    from compare_texts import models
+
+    models.load(networks=models.backend == 'numpy')
+    # keep the loaded objects out of the garbage collector so it doesn't copy their pages
+    gc.freeze()
+    server.log.info('Loaded models in %.1fs', models.timings['load'])
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    '''Size the TensorFlow thread pools of each worker so they don't oversubscribe the cores'''
+    from compare_texts import models
+    from model_registry import configure_threads
+
+    if models.backend == 'keras':
+        configure_threads(ProdConfig.TF_INTRA_OP_THREADS, ProdConfig.TF_INTER_OP_THREADS)
+
+
+def post_worker_init(worker):  # pylint: disable=unused-argument
+    '''Warm up the worker's models in the background, reported by /readyz'''
+    from compare_texts import models
+
+    models.start_warm_up()
@@ -0,0 +1,175 @@
+''' Background jobs which run long comparisons outside of the request threads '''
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlite_connections import ProcessConnection
+
+# states a job goes through
+JOB_STATES = ('queued', 'running', 'done', 'failed')
+
+
+class Job:
+    '''State of one background job and the response it finished with'''
+
+    def __init__(
+            self, job_id: str, status: str = 'queued', *, code: int = None,
+            result: dict = None, created: float = None, updated: float = None):
+        self.job_id = job_id
+        self.status = status
+        self.code = code
+        self.result = result
+        self.created = time.time() if created is None else created
+        self.updated = self.created if updated is None else updated
+
+    def to_dict(self) -> dict:
+        '''Summary of the job returned by the API'''
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'code': self.code,
+            'result': self.result
+        }
+
+
+class MemoryJobStore:
+    '''Jobs kept in the memory of the current process'''
+
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self) -> Job:
+        '''Register a new queued job, forgetting jobs which finished over ttl seconds ago'''
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            expired = [
+                job_id for job_id, old_job in self._jobs.items()
+                if old_job.status in ('done', 'failed') and old_job.updated < job.created - self.ttl
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+            self._jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Job:
+        '''Get a copy of a job, or None if there isn't one'''
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+
+            return Job(
+                job.job_id, job.status, code=job.code, result=job.result,
+                created=job.created, updated=job.updated)
+
+    def update(self, job_id: str, status: str, code: int = None, result: dict = None):
+        '''Set the state of a job and the response it finished with'''
+        with self._lock:
+            job = self._jobs[job_id]
+            job.status = status
+            job.code = code
+            job.result = result
+            job.updated = time.time()
+
+
+class SQLiteJobStore:
+    '''Jobs kept in an SQLite database shared between processes'''
+
+    def __init__(self, db_path: str, ttl: float = 3600):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._db = ProcessConnection(db_path, [
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'job_id TEXT PRIMARY KEY, status TEXT, code INTEGER, result TEXT, '
+            'created REAL, updated REAL)'
+        ], isolation_level=None)
+        self._lock = threading.Lock()
+
+    def create(self) -> Job:
+        '''Register a new queued job, forgetting jobs which finished over ttl seconds ago'''
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            db = self._db.get()
+            db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?",
+                (job.created - self.ttl,))
+            db.execute(
+                'INSERT INTO jobs VALUES (?, ?, NULL, NULL, ?, ?)',
+                (job.job_id, job.status, job.created, job.updated))
+        return job
+
+    def get(self, job_id: str) -> Job:
+        '''Get a job, or None if there isn't one'''
+        with self._lock:
+            row = self._db.get().execute(
+                'SELECT job_id, status, code, result, created, updated '
+                'FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job_id, status, code, result, created, updated = row
+        return Job(
+            job_id, status, code=code, result=None if result is None else json.loads(result),
+            created=created, updated=updated)
+
+    def update(self, job_id: str, status: str, code: int = None, result: dict = None):
+        '''Set the state of a job and the response it finished with'''
+        with self._lock:
+            self._db.get().execute(
+                'UPDATE jobs SET status = ?, code = ?, result = ?, updated = ? WHERE job_id = ?',
+                (status, code, None if result is None else json.dumps(result),
+                 time.time(), job_id))
+
+
+def create_job_store(db_path: str = None, ttl: float = 3600):
+    '''Create an SQLite job store if a database is given, otherwise an in-memory one'''
+    if db_path:
+        return SQLiteJobStore(db_path, ttl)
+
+    return MemoryJobStore(ttl)
+
+
+class JobRunner:
+    '''
+    Runs jobs on a pool of background threads, keeping their state in a job store
+    so any request (or process, with an SQLite store) can poll for the result
+    '''
+
+    def __init__(self, store, max_workers: int = 2):
+        self.store = store
+        self.max_workers = max(1, max_workers)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def submit(self, job_fn, *args) -> Job:
+        '''
+        Queue job_fn(*args), which returns a (response, status code) tuple,
+        and return the queued job right away
+        '''
+        job = self.store.create()
+        self._get_executor().submit(self._run, job.job_id, job_fn, args)
+        return job
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        '''Start the worker threads on first use (and again in forked processes)'''
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='job')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, job_id: str, job_fn, args: tuple):
+        '''Run one job, recording its response or failure'''
+        self.store.update(job_id, 'running')
+        try:
+            result, code = job_fn(*args)
+        except Exception:  # pylint: disable=broad-except
+            self.store.update(job_id, 'failed', 500, {'message': 'Error calculating score'})
+            return
+
+        self.store.update(job_id, 'done' if code < 400 else 'failed', code, result)
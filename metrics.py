@@ -0,0 +1,148 @@
+''' Timing spans & counters of the comparison pipeline, exposed in the Prometheus text format '''
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# upper bounds (in seconds) of the stage duration histogram buckets
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# prefix of every metric name
+METRIC_PREFIX = 'authowrite_'
+
+# spans of the current request, when it asked for a Server-Timing header
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+class Histogram:
+    '''Counts of observed values within cumulative buckets, along with their sum'''
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+
+    @property
+    def count(self) -> int:
+        '''Number of observed values'''
+        return sum(self.counts)
+
+    def observe(self, value: float):
+        '''Add a value to its bucket'''
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    def cumulative_counts(self) -> list[tuple]:
+        '''(upper bound, values at or below it) of every bucket, ending with +Inf'''
+        counts = []
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            counts.append((bound, running))
+        return counts
+
+
+class MetricsRegistry:
+    '''Thread-safe stage histograms & counters of the current process'''
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        '''Record how long one run of a stage took'''
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def increment(self, name: str, amount: float = 1, description: str = ''):
+        '''Add to a counter'''
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+            self._help.setdefault(name, description)
+
+    def register_gauge(self, name: str, read_fn, description: str = ''):
+        '''Report the value returned by read_fn whenever the metrics are rendered'''
+        with self._lock:
+            self._gauges[name] = read_fn
+            self._help[name] = description
+
+    def stage_count(self, stage: str) -> int:
+        '''Number of recorded runs of a stage'''
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            return 0 if histogram is None else histogram.count
+
+    def counter(self, name: str) -> float:
+        '''Current value of a counter'''
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def render(self) -> str:
+        '''Every metric in the Prometheus text exposition format'''
+        with self._lock:
+            lines = [
+                f'# HELP {METRIC_PREFIX}stage_seconds Time spent in each stage of a comparison',
+                f'# TYPE {METRIC_PREFIX}stage_seconds histogram'
+            ]
+            for stage, histogram in sorted(self._histograms.items()):
+                for bound, count in histogram.cumulative_counts():
+                    bound = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(
+                        f'{METRIC_PREFIX}stage_seconds_bucket{{stage="{stage}",le="{bound}"}} '
+                        f'{count}')
+                lines.append(
+                    f'{METRIC_PREFIX}stage_seconds_sum{{stage="{stage}"}} {histogram.total!r}')
+                lines.append(
+                    f'{METRIC_PREFIX}stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+            values = dict(self._counters)
+            values.update((name, read_fn()) for name, read_fn in self._gauges.items())
+            for name, value in sorted(values.items()):
+                metric_type = 'counter' if name.endswith('_total') else 'gauge'
+                lines.append(f'# HELP {METRIC_PREFIX}{name} {self._help.get(name, "")}')
+                lines.append(f'# TYPE {METRIC_PREFIX}{name} {metric_type}')
+                lines.append(f'{METRIC_PREFIX}{name} {value!r}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# metrics of this process
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def span(stage: str):
+    '''Time a stage, adding it to the stage histogram and the spans of the current request'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe(stage, seconds)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans[stage] = spans.get(stage, 0.0) + seconds
+
+
+def start_request_spans():
+    '''Start collecting the spans of the current request for its Server-Timing header'''
+    _request_spans.set({})
+
+
+def server_timing() -> str:
+    '''Server-Timing header value of the spans collected for the current request, in ms'''
+    spans = _request_spans.get()
+    if not spans:
+        return None
+
+    return ', '.join(
+        f'{stage};dur={seconds*1000:.2f}' for stage, seconds in spans.items())
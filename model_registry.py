@@ -0,0 +1,282 @@
+''' Lazy loading registry for the Word2Vec and Keras models '''
+import hashlib
+import threading
+import time
+from functools import cached_property
+import numpy as np
+from functions import get_vectors
+from word_vectors import load_word_vectors, word_vectors_files
+import numpy_networks
+
+# ways the networks can be run
+INFERENCE_BACKENDS = ('keras', 'numpy')
+
+# text run through the whole pipeline when warming up
+WARM_UP_TEXT = 'This is a short text used to warm up the models. It has two sentences.'
+
+
+def build_predict_scores(base_network, clf_network):
+    '''Build the compiled graph which scores stacked known & unknown vectors'''
+    # imported here so the app can start serving before TensorFlow is initialised
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel
+
+    @tf.function(input_signature=(
+        tf.TensorSpec(shape=(None, base_network.input_shape[-1]), dtype=tf.float32),
+        tf.TensorSpec(shape=(None, base_network.output_shape[-1]), dtype=tf.float32),
+        tf.TensorSpec(shape=(None,), dtype=tf.int32),
+        tf.TensorSpec(shape=(), dtype=tf.int32)))
+    def predict_scores(vectors, features, segment_ids, pair_count):
+        '''
+        Runs the base and clf networks as one graph to score pair_count pairs.
+        The vectors are run through the base network and stacked on top of the
+        already known feature vectors, where segment 2i holds the known rows and
+        segment 2i+1 the unknown rows of pair i. Returns the scores of every pair
+        and the feature vectors of the vectors
+        '''
+        new_features = base_network(vectors, training=False)
+        feature_vectors = tf.concat([new_features, features], axis=0)
+
+        # get author & unknown representations of every pair
+        representations = tf.math.unsorted_segment_mean(
+            feature_vectors, segment_ids, 2*pair_count)
+        pairs = tf.reshape(
+            representations, (-1, 2*feature_vectors.shape[-1]))
+
+        # use representations to get predictions using clf network model
+        return clf_network(pairs, training=False)[:, 0], new_features
+
+    return predict_scores
+
+
+def build_embed(base_network):
+    '''Build the compiled graph which turns text vectors into feature vectors'''
+    # imported here so the app can start serving before TensorFlow is initialised
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel
+
+    @tf.function(input_signature=(
+        tf.TensorSpec(shape=(None, base_network.input_shape[-1]), dtype=tf.float32),))
+    def embed(vectors):
+        '''Runs the base network over a stack of text vectors'''
+        return base_network(vectors, training=False)
+
+    return embed
+
+
+def build_classify(clf_network):
+    '''Build the compiled graph which scores stacked author & unknown representations'''
+    # imported here so the app can start serving before TensorFlow is initialised
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel
+
+    @tf.function(input_signature=(
+        tf.TensorSpec(shape=(None, clf_network.input_shape[-1]), dtype=tf.float32),))
+    def classify(pairs):
+        '''Runs the clf network over a stack of concatenated representations'''
+        return clf_network(pairs, training=False)[:, 0]
+
+    return classify
+
+
+def configure_threads(intra_op_threads: int, inter_op_threads: int):
+    '''Size the TensorFlow thread pools, which only works before TensorFlow runs anything'''
+    # imported here so the app can start serving before TensorFlow is initialised
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel
+
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def file_fingerprint(path: str) -> str:
+    '''Hash of a whole file, read in chunks so large files aren't held in memory'''
+    with open(path, 'rb') as file:
+        return hashlib.file_digest(file, 'sha256').hexdigest()
+
+
+class ModelRegistry:
+    '''
+    Holds the models used to compare texts, loading them on first use
+    and keeping track of their load & warm-up state
+    '''
+
+    def __init__(self, w2v_load_mode: str = 'full', backend: str = 'keras'):
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(
+                f'Unknown inference backend {backend!r}, expected one of {INFERENCE_BACKENDS}')
+
+        self.w2v_load_mode = w2v_load_mode
+        self.backend = backend
+        self.state = 'unloaded'
+        self.timings = {'load': None, 'warm_up': None}
+        self.error = None
+        self._lock = threading.RLock()
+        self._models = {}
+
+    def load(self, networks: bool = True) -> dict:
+        '''
+        Load every model once, returning them by name. Loading the networks can be
+        left until first use, so a server can load only the word vectors before forking
+        '''
+        with self._lock:
+            if 'word2vec_model' not in self._models or (
+                    networks and 'classify' not in self._models):
+                self.state = 'loading'
+                start = time.perf_counter()
+                try:
+                    if 'word2vec_model' not in self._models:
+                        self._models['word2vec_model'] = load_word_vectors(self.w2v_load_mode)
+                    if networks:
+                        self._models.update(self._load_networks())
+                except Exception as error:
+                    self.state = 'failed'
+                    self.error = repr(error)
+                    raise
+
+                self.timings['load'] = (
+                    self.timings['load'] or 0) + time.perf_counter() - start
+                self.state = 'loaded' if networks else 'preloaded'
+
+            # a failed warm-up mustn't keep the app out of rotation once a later load works
+            if networks and self.error is not None:
+                self.state = 'ready'
+                self.error = None
+
+            return self._models
+
+    def _load_networks(self) -> dict:
+        '''Load the networks & build their inference graphs with the chosen backend'''
+        if self.backend == 'numpy':
+            base_network = numpy_networks.NumpyNetwork(numpy_networks.BASE_NETWORK_PATH+'.npz')
+            clf_network = numpy_networks.NumpyNetwork(numpy_networks.CLF_NETWORK_PATH+'.npz')
+            builders = (
+                numpy_networks.build_predict_scores, numpy_networks.build_embed,
+                numpy_networks.build_classify)
+        else:
+            # imported here so the app can start serving before TensorFlow is initialised
+            from tensorflow import keras  # pylint: disable=import-outside-toplevel
+
+            base_network = keras.models.load_model(
+                numpy_networks.BASE_NETWORK_PATH, compile=False)
+            clf_network = keras.models.load_model(
+                numpy_networks.CLF_NETWORK_PATH, compile=False)
+            builders = (build_predict_scores, build_embed, build_classify)
+
+        predict_scores_builder, embed_builder, classify_builder = builders
+        return {
+            'base_network': base_network,
+            'clf_network': clf_network,
+            'predict_scores': predict_scores_builder(base_network, clf_network),
+            'embed': embed_builder(base_network),
+            'classify': classify_builder(clf_network)
+        }
+
+    @property
+    def word2vec_model(self):
+        '''Word2Vec model (or KeyedVectors) used to vectorise texts'''
+        return self.load()['word2vec_model']
+
+    @property
+    def base_network(self):
+        '''Keras network turning text vectors into feature vectors'''
+        return self.load()['base_network']
+
+    @property
+    def clf_network(self):
+        '''Keras network scoring a pair of author & unknown representations'''
+        return self.load()['clf_network']
+
+    @property
+    def predict_scores(self):
+        '''Compiled graph running both networks over stacked vectors'''
+        return self.load()['predict_scores']
+
+    @property
+    def embed(self):
+        '''Compiled graph running the base network over stacked vectors'''
+        return self.load()['embed']
+
+    @property
+    def classify(self):
+        '''Compiled graph running the clf network over stacked representation pairs'''
+        return self.load()['classify']
+
+    @property
+    def input_size(self) -> int:
+        '''Size of the combined word & style vector expected by the base network'''
+        return self.base_network.input_shape[-1]
+
+    @property
+    def feature_size(self) -> int:
+        '''Size of the feature vectors output by the base network'''
+        return self.base_network.output_shape[-1]
+
+    @cached_property
+    def version(self) -> str:
+        '''
+        Fingerprint of the model files, which changes whenever a model is replaced.
+        Every file is hashed in full, once per process, as retrained vectors can keep
+        the size & header of the files they replace
+        '''
+        if self.backend == 'numpy':
+            network_paths = [
+                numpy_networks.BASE_NETWORK_PATH+'.npz', numpy_networks.CLF_NETWORK_PATH+'.npz']
+        else:
+            network_paths = [
+                numpy_networks.BASE_NETWORK_PATH+'/fingerprint.pb',
+                numpy_networks.CLF_NETWORK_PATH+'/fingerprint.pb']
+        fingerprints = [
+            file_fingerprint(path)
+            for path in network_paths + word_vectors_files(self.w2v_load_mode)]
+
+        return hashlib.sha256('|'.join(fingerprints).encode('UTF-8')).hexdigest()[:16]
+
+    @property
+    def ready(self) -> bool:
+        '''Whether the models are loaded and warmed up'''
+        return self.state == 'ready'
+
+    def warm_up(self):
+        '''
+        Load the models and run a dummy text through the whole pipeline
+        so the NLTK resources are loaded and the inference graph is traced
+        '''
+        with self._lock:
+            models = self.load()
+            if self.ready:
+                return
+
+            self.state = 'warming'
+            start = time.perf_counter()
+            try:
+                vectors, _, _ = get_vectors([WARM_UP_TEXT], models['word2vec_model'])
+                models['predict_scores'](
+                    np.array(vectors*2, dtype=np.float32),
+                    np.zeros((0, self.feature_size), dtype=np.float32),
+                    np.array([0, 1], dtype=np.int32), 1)
+            except Exception as error:
+                self.state = 'failed'
+                self.error = repr(error)
+                raise
+
+            self.timings['warm_up'] = time.perf_counter() - start
+            self.state = 'ready'
+
+    def start_warm_up(self) -> threading.Thread:
+        '''Warm up in a background thread so the app can serve while the models load'''
+        def run():
+            try:
+                self.warm_up()
+            except Exception:  # pylint: disable=broad-except
+                pass  # the error is kept in the state reported by status()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def status(self) -> dict:
+        '''Report the load state & timings of the models'''
+        return {
+            'state': self.state,
+            'ready': self.ready,
+            'load_time': self.timings['load'],
+            'warm_up_time': self.timings['warm_up'],
+            'error': self.error
+        }
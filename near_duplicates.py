@@ -0,0 +1,122 @@
+''' Near duplicate texts, found by comparing MinHash signatures of their word shingles '''
+import re
+import unicodedata
+from zlib import crc32
+import numpy as np
+
+_WORD = re.compile(r'\w+')
+
+# odd constants combining the hashes of the words of a shingle
+_SHINGLE_MULTIPLIERS = np.array(
+    [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9,
+     0xD6E8FEB86659FD93, 0xFF51AFD7ED558CCD], dtype=np.uint64)
+
+
+def normalised_words(text: str) -> list[str]:
+    '''
+    Words of a text, case folded & without the punctuation, spacing or line breaks
+    which differ between copies of a document extracted from different file types
+    '''
+    return _WORD.findall(unicodedata.normalize('NFKC', text).casefold())
+
+
+def shingle_hashes(words: list[str], size: int = 3):
+    '''Distinct 64 bit hashes of every run of size words (all of them for shorter texts)'''
+    codes = {word: crc32(word.encode('UTF-8')) for word in set(words)}
+    word_hashes = np.fromiter((codes[word] for word in words), np.uint64, len(words))
+    size = max(1, min(size, len(word_hashes), len(_SHINGLE_MULTIPLIERS)))
+
+    count = max(0, len(word_hashes) - size + 1)
+    hashes = np.zeros(count, dtype=np.uint64)
+    for i in range(size):
+        # wraps around like any 64 bit hash
+        hashes += word_hashes[i:i+count] * _SHINGLE_MULTIPLIERS[i]
+    return np.unique(hashes)
+
+
+class MinHasher:
+    '''
+    MinHash signatures of texts, where the share of equal values in the signatures
+    of two texts estimates the Jaccard similarity of their sets of word shingles.
+    Every permutation is a multiply-shift hash of the shingle hashes
+    '''
+
+    def __init__(self, permutations: int = 128, shingle_size: int = 3,
+                 seed: int = 0, chunk_size: int = 4096):
+        rng = np.random.default_rng(seed)
+        self.multipliers = rng.integers(0, 2**64, permutations, dtype=np.uint64) | np.uint64(1)
+        self.increments = rng.integers(0, 2**64, permutations, dtype=np.uint64)
+        self.shingle_size = shingle_size
+        self.chunk_size = chunk_size
+
+    def signature(self, text: str):
+        '''
+        MinHash signature of a text, or None if it has no words, as the signatures of
+        any two texts without shingles would be the same without them being similar
+        '''
+        hashes = shingle_hashes(normalised_words(text), self.shingle_size)
+        if len(hashes) == 0:
+            return None
+
+        signature = np.full(len(self.multipliers), np.iinfo(np.uint64).max, dtype=np.uint64)
+        # hash the shingles in chunks so long texts don't need a huge matrix
+        for start in range(0, len(hashes), self.chunk_size):
+            chunk = hashes[start:start+self.chunk_size, np.newaxis]
+            values = (chunk * self.multipliers + self.increments) >> np.uint64(32)
+            np.minimum(signature, values.min(axis=0), out=signature)
+        return signature
+
+
+def find_duplicates(items: list, threshold: float, signature) -> list[tuple]:
+    '''
+    (position, position of the earlier item it duplicates, estimated similarity) of every
+    item which duplicates an earlier item that was kept, either by being equal to it or
+    by their MinHash signatures, given by signature(position), estimating a similarity
+    reaching threshold (0 only finds equal items, without asking for any signature).
+    Items without a signature are only duplicates of equal items
+    '''
+    duplicates = []
+    # position of the kept item each distinct item was found to be
+    seen = {}
+    kept, signatures = [], []
+    for position, item in enumerate(items):
+        # exact copies don't need a signature
+        if item in seen:
+            duplicates.append((position, seen[item], 1.0))
+            continue
+        seen[item] = position
+        if threshold <= 0:
+            continue
+
+        item_signature = signature(position)
+        if item_signature is None:
+            continue
+        if signatures:
+            similarities = np.mean(np.asarray(signatures) == item_signature, axis=1)
+            closest = int(np.argmax(similarities))
+            if similarities[closest] >= threshold:
+                seen[item] = kept[closest]
+                duplicates.append((position, kept[closest], float(similarities[closest])))
+                continue
+        kept.append(position)
+        signatures.append(item_signature)
+
+    return duplicates
+
+
+def find_near_duplicates(
+        texts: list[str], threshold: float, hasher: MinHasher = None) -> list[tuple]:
+    '''
+    (position, position of the earlier text it duplicates, estimated similarity) of every
+    text which duplicates an earlier text that was kept, either exactly or with an estimated
+    similarity of their shingles reaching threshold (0 only finds exact duplicates)
+    '''
+    hasher = hasher or MinHasher()
+    return find_duplicates(texts, threshold, lambda position: hasher.signature(texts[position]))
+
+
+def describe_duplicates(labels: list[str], duplicates: list[tuple]) -> list[dict]:
+    '''Input, earlier input it duplicates & similarity of every duplicate, named by labels'''
+    return [
+        {'input': labels[position], 'duplicate_of': labels[original], 'similarity': similarity}
+        for position, original, similarity in duplicates]
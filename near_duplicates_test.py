@@ -0,0 +1,72 @@
+'''Unit Testing for finding near duplicate texts'''
+import os
+import unittest
+import numpy as np
+from near_duplicates import MinHasher, normalised_words, shingle_hashes, find_near_duplicates
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def jaccard(text1: str, text2: str) -> float:
+    '''Exact Jaccard similarity of the word shingles of two texts'''
+    shingles1 = set(shingle_hashes(normalised_words(text1)).tolist())
+    shingles2 = set(shingle_hashes(normalised_words(text2)).tolist())
+    return len(shingles1 & shingles2) / len(shingles1 | shingles2)
+
+
+class NearDuplicatesTestCase(unittest.TestCase):
+    '''Class to test finding near duplicate texts'''
+
+    def setUp(self):
+        with open(BASE_DIR+'/test_files/txt_test01.txt', encoding='UTF-8') as file:
+            self.text = file.read()
+        with open(BASE_DIR+'/test_files/txt_test02.txt', encoding='UTF-8') as file:
+            self.other = file.read()
+
+    def test_normalise(self):
+        '''Case, punctuation, spacing & line breaks must not change the words of a text'''
+        self.assertEqual(
+            normalised_words('Hello,  World!\r\nIt’s  me.'),
+            normalised_words('hello world\nit’s me'))
+        self.assertEqual(len(shingle_hashes(normalised_words('one two'))), 1)
+        self.assertEqual(len(shingle_hashes([])), 0)
+
+    def test_signature(self):
+        '''Signatures must be deterministic & estimate the Jaccard similarity'''
+        hasher = MinHasher(256, chunk_size=64)
+        edited = ' '.join(self.text.split()[:-40]) + ' a brand new ending to the essay'
+        signature = hasher.signature(self.text)
+
+        self.assertTrue(np.array_equal(signature, MinHasher(256).signature(self.text)))
+        for text in (edited, self.other):
+            estimate = np.mean(signature == hasher.signature(text))
+            self.assertAlmostEqual(estimate, jaccard(self.text, text), delta=0.1)
+
+    def test_duplicates(self):
+        '''Copies must be collapsed into the first text they duplicate which was kept'''
+        copy = 'Page 1\n' + self.text.replace('\n', ' \n') + '\nPage 2'
+        texts = [self.text, self.other, copy, self.text, self.other.lower()]
+        duplicates = find_near_duplicates(texts, 0.9)
+
+        self.assertEqual([duplicate[:2] for duplicate in duplicates], [(2, 0), (3, 0), (4, 1)])
+        self.assertEqual(duplicates[1][2], 1.0)
+        self.assertGreaterEqual(duplicates[0][2], 0.9)
+
+        # a copy of a collapsed text is collapsed into the text that was kept
+        self.assertEqual(
+            [duplicate[:2] for duplicate in find_near_duplicates([self.text, copy, copy], 0.9)],
+            [(1, 0), (2, 0)])
+        # without a threshold only exact duplicates are collapsed
+        self.assertEqual(
+            [duplicate[:2] for duplicate in find_near_duplicates(texts, 0)], [(3, 0)])
+        self.assertEqual(find_near_duplicates(
+            ['This is a test.', 'This is a test. Another one!'], 0.9), [])
+
+        # texts without words are only collapsed into exact copies
+        self.assertIsNone(MinHasher().signature('?!... -- ***'))
+        self.assertEqual(
+            find_near_duplicates(['?!...', '-- ***', self.text, '?!...'], 0.9), [(3, 0, 1.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+''' Export of the Keras networks to plain weights which are run with NumPy '''
+import os
+import argparse
+import numpy as np
+
+# initial folder path
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+BASE_NETWORK_PATH = BASE_DIR+'/model_files/base_network'
+CLF_NETWORK_PATH = BASE_DIR+'/model_files/clf_network'
+
+# activations the exported networks can use
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'sigmoid': lambda x: np.reciprocal(1 + np.exp(-x, out=x), out=x)
+}
+
+
+def fold_layers(model) -> list[tuple]:
+    '''
+    Turn the layers of a Keras model into a list of (weights, bias, activation),
+    folding every batch normalisation into the dense layer next to it and
+    dropping the layers which do nothing at inference (input & dropout)
+    '''
+    layers = []
+    weights = None
+    bias = None
+
+    def add_affine(layer_weights, layer_bias):
+        nonlocal weights, bias
+        if weights is None:
+            weights, bias = layer_weights, layer_bias
+        else:
+            weights, bias = weights @ layer_weights, bias @ layer_weights + layer_bias
+
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind in ('InputLayer', 'Dropout'):
+            continue
+
+        if kind == 'BatchNormalization':
+            gamma, beta, mean, variance = [
+                weight.astype(np.float64) for weight in layer.get_weights()]
+            scale = gamma / np.sqrt(variance + layer.epsilon)
+            add_affine(np.diag(scale), beta - mean * scale)
+        elif kind == 'Dense':
+            layer_weights, layer_bias = [
+                weight.astype(np.float64) for weight in layer.get_weights()]
+            add_affine(layer_weights, layer_bias)
+            activation = layer.get_config()['activation']
+            if activation != 'linear':
+                layers.append((weights, bias, activation))
+                weights = bias = None
+        elif kind == 'Activation' and weights is not None:
+            layers.append((weights, bias, layer.get_config()['activation']))
+            weights = bias = None
+        else:
+            raise ValueError(f'Layer {layer.name} of type {kind} can\'t be exported')
+
+    if weights is not None:
+        layers.append((weights, bias, 'linear'))
+
+    return layers
+
+
+def export_network(model_path: str, output_path: str = None) -> str:
+    '''Export the weights of a Keras SavedModel into an .npz file next to it'''
+    # imported here so the NumPy networks can be run without TensorFlow
+    from tensorflow import keras  # pylint: disable=import-outside-toplevel
+
+    model = keras.models.load_model(model_path, compile=False)
+    arrays = {}
+    for i, (weights, bias, activation) in enumerate(fold_layers(model)):
+        arrays[f'weights_{i}'] = weights.astype(np.float32)
+        arrays[f'bias_{i}'] = bias.astype(np.float32)
+        arrays[f'activation_{i}'] = np.array(activation)
+
+    output_path = output_path or model_path + '.npz'
+    np.savez(output_path, **arrays)
+    return output_path
+
+
+class NumpyNetwork:
+    '''Dense network exported by export_network, run with NumPy matrix products'''
+
+    def __init__(self, path: str):
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f'{path} not found, export it first with: python numpy_networks.py')
+
+        self.path = path
+        self.layers = []
+        with np.load(path, allow_pickle=False) as arrays:
+            for i in range(len(arrays.files) // 3):
+                self.layers.append((
+                    arrays[f'weights_{i}'], arrays[f'bias_{i}'],
+                    ACTIVATIONS[str(arrays[f'activation_{i}'])]))
+
+    @property
+    def input_shape(self) -> tuple:
+        '''Shape of the input batches, matching the Keras model'''
+        return (None, self.layers[0][0].shape[0])
+
+    @property
+    def output_shape(self) -> tuple:
+        '''Shape of the output batches, matching the Keras model'''
+        return (None, self.layers[-1][0].shape[1])
+
+    def __call__(self, inputs):
+        outputs = np.asarray(inputs, dtype=np.float32)
+        for weights, bias, activation in self.layers:
+            outputs = activation(outputs @ weights + bias)
+        return outputs
+
+
+def build_predict_scores(base_network: NumpyNetwork, clf_network: NumpyNetwork):
+    '''NumPy version of model_registry.build_predict_scores'''
+
+    def predict_scores(vectors, features, segment_ids, pair_count):
+        '''
+        Runs the base and clf networks to score pair_count pairs, where segment 2i
+        holds the known rows and segment 2i+1 the unknown rows of pair i. Returns
+        the scores of every pair and the feature vectors of the vectors
+        '''
+        new_features = base_network(vectors)
+        feature_vectors = np.concatenate([new_features, features], axis=0)
+
+        # get author & unknown representations of every pair
+        sums = np.zeros((2*pair_count, feature_vectors.shape[-1]), dtype=np.float32)
+        np.add.at(sums, segment_ids, feature_vectors)
+        counts = np.bincount(segment_ids, minlength=2*pair_count)
+        representations = sums / np.maximum(counts, 1)[:, None].astype(np.float32)
+        pairs = representations.reshape(-1, 2*feature_vectors.shape[-1])
+
+        # use representations to get predictions using clf network model
+        return clf_network(pairs)[:, 0], new_features
+
+    return predict_scores
+
+
+def build_embed(base_network: NumpyNetwork):
+    '''NumPy version of model_registry.build_embed'''
+    return base_network
+
+
+def build_classify(clf_network: NumpyNetwork):
+    '''NumPy version of model_registry.build_classify'''
+
+    def classify(pairs):
+        '''Runs the clf network over a stack of concatenated representations'''
+        return clf_network(pairs)[:, 0]
+
+    return classify
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export the Keras networks to run them with the NumPy backend')
+    parser.add_argument(
+        '--models', nargs='+', default=[BASE_NETWORK_PATH, CLF_NETWORK_PATH],
+        help='Keras SavedModels to export, each written to <model>.npz')
+    args = parser.parse_args()
+
+    for network_path in args.models:
+        print(f'Exported {network_path} to {export_network(network_path)}')
@@ -0,0 +1,65 @@
+'''Unit Testing for the NumPy inference backend'''
+import os
+import tempfile
+import unittest
+import numpy as np
+from tensorflow import keras
+import model_registry
+import numpy_networks
+from numpy_networks import NumpyNetwork, export_network, BASE_NETWORK_PATH, CLF_NETWORK_PATH
+
+
+class NumpyNetworkTestCase(unittest.TestCase):
+    '''Class to test the exported networks against the Keras ones'''
+
+    @classmethod
+    def setUpClass(cls):
+        '''Export both networks and load them with both backends'''
+        cls.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        cls.keras_networks = []
+        cls.numpy_networks = []
+        for path in (BASE_NETWORK_PATH, CLF_NETWORK_PATH):
+            output_path = os.path.join(cls.directory.name, os.path.basename(path)+'.npz')
+            cls.keras_networks.append(keras.models.load_model(path, compile=False))
+            cls.numpy_networks.append(NumpyNetwork(export_network(path, output_path)))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_networks(self):
+        '''Both networks must match their Keras outputs'''
+        rng = np.random.default_rng(0)
+        for keras_network, numpy_network in zip(self.keras_networks, self.numpy_networks):
+            self.assertEqual(numpy_network.input_shape, keras_network.input_shape)
+            self.assertEqual(numpy_network.output_shape, keras_network.output_shape)
+
+            inputs = rng.standard_normal(
+                (64, keras_network.input_shape[-1])).astype(np.float32)
+            np.testing.assert_allclose(
+                numpy_network(inputs), keras_network(inputs, training=False).numpy(),
+                rtol=1e-4, atol=1e-5)
+
+    def test_predict_scores(self):
+        '''The NumPy graphs must score pairs like the compiled Keras graphs'''
+        keras_base, keras_clf = self.keras_networks[0], self.keras_networks[1]
+        numpy_base, numpy_clf = self.numpy_networks[0], self.numpy_networks[1]
+        rng = np.random.default_rng(1)
+        vectors = rng.standard_normal((7, 323)).astype(np.float32)
+        features = rng.standard_normal((3, 64)).astype(np.float32)
+        segment_ids = np.array([0, 0, 1, 2, 3, 3, 5, 4, 4, 2], dtype=np.int32)
+
+        keras_scores, keras_features = model_registry.build_predict_scores(
+            keras_base, keras_clf)(vectors, features, segment_ids, 3)
+        numpy_scores, numpy_features = numpy_networks.build_predict_scores(
+            numpy_base, numpy_clf)(vectors, features, segment_ids, 3)
+        np.testing.assert_allclose(numpy_scores, keras_scores.numpy(), rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(numpy_features, keras_features.numpy(), rtol=1e-4, atol=1e-5)
+
+        pairs = rng.standard_normal((5, 128)).astype(np.float32)
+        np.testing.assert_allclose(
+            numpy_networks.build_classify(numpy_clf)(pairs),
+            model_registry.build_classify(keras_clf)(pairs).numpy(), rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(
+            numpy_networks.build_embed(numpy_base)(vectors),
+            model_registry.build_embed(keras_base)(vectors).numpy(), rtol=1e-4, atol=1e-5)
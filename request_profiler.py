@@ -0,0 +1,30 @@
+''' Opt-in profiling of single requests, stored as pstats files '''
+import os
+import hmac
+import time
+import uuid
+import cProfile
+
+
+def is_profile_token(token: str, admin_token: str) -> bool:
+    '''Whether a request's profile token matches the admin token, which must be set'''
+    return bool(token and admin_token) and hmac.compare_digest(
+        token.encode('UTF-8'), admin_token.encode('UTF-8'))
+
+
+def profile_call(directory: str, name: str, func, *args, **kwargs) -> tuple:
+    '''
+    Run func under cProfile and store its stats in directory, returning the result
+    and the file name. Only the calling thread is profiled, so time spent in the
+    inference batcher or extraction pool shows up as waiting on their results
+    '''
+    os.makedirs(directory, exist_ok=True)
+    file_name = f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{uuid.uuid4().hex[:8]}.pstats'
+
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(os.path.join(directory, file_name))
+
+    return result, file_name
@@ -0,0 +1,36 @@
+''' SQLite connections which are safe to use from forked processes '''
+import os
+import sqlite3
+import threading
+
+
+class ProcessConnection:
+    '''
+    Connection to an SQLite database opened by every process on first use, as
+    SQLite connections mustn't be used across fork(), like by the gunicorn workers
+    of an app preloaded by the master. The schema is created with a connection
+    which is closed straight away, so the process creating it holds none open
+    '''
+
+    def __init__(self, db_path: str, schema: list[str] = (), **kwargs):
+        self.db_path = db_path
+        self.kwargs = kwargs
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+
+        db = sqlite3.connect(db_path, **kwargs)
+        try:
+            for statement in schema:
+                db.execute(statement)
+            db.commit()
+        finally:
+            db.close()
+
+    def get(self) -> sqlite3.Connection:
+        '''Connection of this process, opened on first use (and again in forked processes)'''
+        with self._lock:
+            if self._pid != os.getpid():
+                self._db = sqlite3.connect(self.db_path, check_same_thread=False, **self.kwargs)
+                self._pid = os.getpid()
+            return self._db
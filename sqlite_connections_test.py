@@ -0,0 +1,71 @@
+'''Unit Testing for SQLite stores used by forked processes'''
+import os
+import tempfile
+import unittest
+import numpy as np
+from author_profiles import SQLiteProfileStore
+from feature_cache import FeatureCache, DocumentFeatures
+from jobs import SQLiteJobStore
+
+
+def features(value: float) -> DocumentFeatures:
+    '''Features of a made up document'''
+    return DocumentFeatures(
+        np.full(4, value, dtype=np.float32), np.full(3, value, dtype=np.float32),
+        10, np.full(8, value, dtype=np.float32))
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'fork() is needed to test forked processes')
+class ForkTestCase(unittest.TestCase):
+    '''Class to test stores opened before a fork, like by a preloaded gunicorn master'''
+
+    def setUp(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.cache = FeatureCache(0, directory+'/features.db')
+        self.authors = SQLiteProfileStore(directory+'/authors.db')
+        self.jobs = SQLiteJobStore(directory+'/jobs.db')
+
+    def write(self, name: str) -> str:
+        '''Write to every store, returning the ID of the job created'''
+        self.cache.put(name, features(len(name)))
+        author = self.authors.create(name)
+        self.authors.add_documents(author.author_id, [(name, features(len(name)))])
+        job = self.jobs.create()
+        self.jobs.update(job.job_id, 'done', 200, {'name': name})
+        return job.job_id
+
+    def test_fork(self):
+        '''Processes forked after the stores are used must write with their own connections'''
+        parent_job = self.write('parent')
+        parent_db = self.jobs._db.get()  # pylint: disable=protected-access
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # the child reports its job, or nothing if it failed
+            code = 1
+            try:
+                os.close(read_fd)
+                if self.jobs._db.get() is not parent_db:  # pylint: disable=protected-access
+                    os.write(write_fd, self.write('child').encode('ascii'))
+                    code = 0
+            finally:
+                os._exit(code)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as pipe:
+            child_job = pipe.read().decode('ascii')
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+        # the parent keeps writing after the fork and sees what the child wrote
+        self.write('parent again')
+        self.assertEqual(self.jobs.get(child_job).result, {'name': 'child'})
+        self.assertEqual(self.jobs.get(parent_job).result, {'name': 'parent'})
+        self.assertEqual(self.cache.get('child').word_count, 10)
+        self.assertEqual(
+            sorted(self.authors.representations()[1]), ['child', 'parent', 'parent again'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+''' Report of how far scores move when using compact word vectors '''
+import os
+import json
+import argparse
+import numpy as np
+from docu_functions import read_file
+from functions import parse_document, convert_texts_to_vectors, calculate_style_vector
+from model_registry import ModelRegistry
+from word_vectors import COMPACT_MODES, load_compact_vectors
+
+# initial folder path
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def read_texts(directory: str) -> list[str]:
+    '''Read the non-empty texts of every readable file in a folder'''
+    texts = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as file:
+            text = read_file(name, file)
+        if text and not text.isspace():
+            texts.append(text)
+    return texts
+
+
+class PairScorer:
+    '''Scores every ordered pair of texts, one text being known and the other unknown'''
+
+    def __init__(self, texts: list[str], registry: ModelRegistry):
+        self.registry = registry
+        self.documents = [parse_document(text) for text in texts]
+        self.style_vecs = np.array([
+            calculate_style_vector(document)[0] for document in self.documents])
+        self.known, self.unknown = np.nonzero(~np.eye(len(texts), dtype=bool))
+
+    def scores(self, word_vectors):
+        '''Scores out of 100 of every pair using the given word vectors'''
+        vectors = np.concatenate(
+            (convert_texts_to_vectors(self.documents, word_vectors), self.style_vecs), axis=1)
+        features = np.asarray(self.registry.embed(vectors.astype(np.float32)))
+        pairs = np.concatenate((features[self.known], features[self.unknown]), axis=1)
+        return np.asarray(self.registry.classify(pairs)) * 100
+
+
+def accuracy_report(modes: list[str], texts: list[str]) -> dict:
+    '''
+    Compare the scores of every pair of held-out texts using each exported compact mode
+    against the full word vectors, reporting how far the scores (out of 100) move
+    '''
+    registry = ModelRegistry()
+    scorer = PairScorer(texts, registry)
+    reference = registry.word2vec_model.wv
+    reference_scores = scorer.scores(reference)
+    report = {
+        'texts': len(texts),
+        'pairs': len(reference_scores),
+        'full': {'vocabulary': len(reference), 'bytes': reference.vectors.nbytes}
+    }
+
+    for mode in modes:
+        word_vectors = load_compact_vectors(mode)
+        scores = scorer.scores(word_vectors)
+        drift = np.abs(scores - reference_scores)
+        report[mode] = {
+            'vocabulary': len(word_vectors),
+            'bytes': word_vectors.nbytes,
+            'mean_score_drift': float(drift.mean()),
+            'max_score_drift': float(drift.max()),
+            'changed_scores': int(np.count_nonzero(np.rint(scores) != np.rint(reference_scores)))
+        }
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Report how far scores move with exported compact word vectors')
+    parser.add_argument(
+        'modes', nargs='+', choices=COMPACT_MODES, help='Compact vectors to report on')
+    parser.add_argument(
+        '--texts', default=BASE_DIR+'/test_files',
+        help='Folder of held-out documents compared against each other')
+    args = parser.parse_args()
+
+    print(json.dumps(accuracy_report(args.modes, read_texts(args.texts)), indent=2))
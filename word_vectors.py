@@ -0,0 +1,182 @@
+''' Functions to export and load the Word2Vec word vectors '''
+import os
+import glob
+import argparse
+import numpy as np
+import gensim
+from gensim.models import KeyedVectors
+
+# initial folder path
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+W2V_MODEL_PATH = BASE_DIR+'/model_files/word2vec_model.model'
+W2V_VECTORS_PATH = BASE_DIR+'/model_files/word2vec_vectors.kv'
+# compact vectors are stored as <path>.<mode>.npy with their vocabulary (& scales)
+W2V_COMPACT_PATH = BASE_DIR+'/model_files/word2vec_vectors'
+
+# ways the word vectors can be stored compactly
+COMPACT_MODES = ('float16', 'int8')
+
+# ways the word vectors can be loaded
+LOAD_MODES = ('full', 'mmap') + COMPACT_MODES
+
+
+class CompactVectors:
+    '''
+    Word vectors stored as float16, or as int8 with a scale per word,
+    used by the text functions in place of KeyedVectors
+    '''
+
+    def __init__(self, index_to_key: list[str], vectors, scales=None):
+        self.index_to_key = index_to_key
+        self.key_to_index = {key: i for i, key in enumerate(index_to_key)}
+        self.vectors = vectors
+        self.scales = scales
+
+    def __len__(self) -> int:
+        return len(self.index_to_key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.key_to_index
+
+    @property
+    def vector_size(self) -> int:
+        '''Size of every word vector'''
+        return self.vectors.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        '''Memory taken by the vectors & scales'''
+        return self.vectors.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+
+def compact_paths(mode: str, base_path: str = W2V_COMPACT_PATH) -> dict:
+    '''Files storing the vectors, vocabulary & scales of a compact mode'''
+    return {
+        'vectors': f'{base_path}.{mode}.npy',
+        'vocab': f'{base_path}.{mode}.vocab',
+        'scales': f'{base_path}.{mode}.scales.npy'
+    }
+
+
+def word_vectors_path(mode: str) -> str:
+    '''File holding the word vectors loaded by a mode'''
+    if mode in COMPACT_MODES:
+        return compact_paths(mode)['vectors']
+    return W2V_VECTORS_PATH if mode == 'mmap' else W2V_MODEL_PATH
+
+
+def word_vectors_files(mode: str) -> list[str]:
+    '''
+    Every file making up the word vectors loaded by a mode: the vocabulary & scales of
+    compact vectors, or the arrays gensim saves next to its pickle as <path>.<name>.npy
+    '''
+    if mode in COMPACT_MODES:
+        return [path for path in compact_paths(mode).values() if os.path.exists(path)]
+
+    path = word_vectors_path(mode)
+    return [path] + sorted(glob.glob(glob.escape(path) + '.*.npy'))
+
+
+def export_word_vectors(
+        model_path: str = W2V_MODEL_PATH, vectors_path: str = W2V_VECTORS_PATH) -> str:
+    '''
+    Save only the KeyedVectors of the Word2Vec model, without its training state,
+    with the vector matrix stored as a separate .npy file so it can be memory-mapped
+    '''
+    model = gensim.models.Word2Vec.load(model_path)
+    model.wv.save(vectors_path, sep_limit=0)
+    return vectors_path
+
+
+def compact_vectors(word_vectors, mode: str, max_vocab: int = 0) -> CompactVectors:
+    '''
+    Store KeyedVectors as float16, or as int8 scaled by each word's largest value,
+    optionally keeping only the max_vocab most frequent words (0 keeps every word)
+    '''
+    if mode not in COMPACT_MODES:
+        raise ValueError(f'Unknown compact mode {mode!r}, expected one of {COMPACT_MODES}')
+
+    # Word2Vec sorts its vocabulary from the most to the least frequent word
+    keys = word_vectors.index_to_key[:max_vocab or None]
+    vectors = word_vectors.vectors[:len(keys)]
+
+    if mode == 'float16':
+        return CompactVectors(keys, vectors.astype(np.float16))
+
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return CompactVectors(
+        keys, np.rint(vectors / scales[:, np.newaxis]).astype(np.int8), scales.astype(np.float32))
+
+
+def export_compact_vectors(
+        mode: str, max_vocab: int = 0, model_path: str = W2V_MODEL_PATH,
+        base_path: str = W2V_COMPACT_PATH) -> str:
+    '''Save the word vectors of the Word2Vec model as compact vectors'''
+    word_vectors = compact_vectors(
+        gensim.models.Word2Vec.load(model_path).wv, mode, max_vocab)
+    paths = compact_paths(mode, base_path)
+
+    np.save(paths['vectors'], word_vectors.vectors)
+    if word_vectors.scales is not None:
+        np.save(paths['scales'], word_vectors.scales)
+    with open(paths['vocab'], 'w', encoding='UTF-8') as vocab:
+        vocab.write('\n'.join(word_vectors.index_to_key))
+
+    return paths['vectors']
+
+
+def load_compact_vectors(mode: str, base_path: str = W2V_COMPACT_PATH) -> CompactVectors:
+    '''Load compact vectors, memory-mapped read-only so workers share one copy'''
+    paths = compact_paths(mode, base_path)
+    if not os.path.exists(paths['vectors']):
+        raise FileNotFoundError(
+            f'{paths["vectors"]} not found, export it first with: '
+            f'python word_vectors.py --compact {mode}')
+
+    with open(paths['vocab'], encoding='UTF-8') as vocab:
+        keys = vocab.read().split('\n')
+    scales = np.load(paths['scales']) if mode == 'int8' else None
+
+    return CompactVectors(keys, np.load(paths['vectors'], mmap_mode='r'), scales)
+
+
+def load_word_vectors(mode: str = 'full', vectors_path: str = W2V_VECTORS_PATH):
+    '''
+    Load the word vectors, either as the full Word2Vec model ('full'), as the exported
+    KeyedVectors memory-mapped read-only so every worker shares one page-cached copy ('mmap')
+    or as exported compact vectors ('float16' or 'int8')
+    '''
+    if mode == 'full':
+        return gensim.models.Word2Vec.load(W2V_MODEL_PATH)
+
+    if mode == 'mmap':
+        if not os.path.exists(vectors_path):
+            raise FileNotFoundError(
+                f'{vectors_path} not found, export it first with: python word_vectors.py')
+        return KeyedVectors.load(vectors_path, mmap='r')
+
+    if mode in COMPACT_MODES:
+        return load_compact_vectors(mode)
+
+    raise ValueError(f'Unknown word vector load mode {mode!r}, expected one of {LOAD_MODES}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export the Word2Vec word vectors for memory-mapped or compact loading')
+    parser.add_argument('--model', default=W2V_MODEL_PATH, help='Word2Vec model to export')
+    parser.add_argument('--output', default=W2V_VECTORS_PATH, help='KeyedVectors file to write')
+    parser.add_argument(
+        '--compact', choices=COMPACT_MODES, help='Export compact vectors of this type instead')
+    parser.add_argument(
+        '--max-vocab', type=int, default=0,
+        help='Only keep the most frequent words in compact vectors (0 keeps every word)')
+    args = parser.parse_args()
+
+    if args.compact:
+        print(f'Exported word vectors to '
+              f'{export_compact_vectors(args.compact, args.max_vocab, args.model)}')
+    else:
+        print(f'Exported word vectors to {export_word_vectors(args.model, args.output)}')